@@ -0,0 +1,115 @@
+from pymodaq.control_modules.move_utility_classes import (DAQ_Move_base, comon_parameters_fun, main,
+                                                          DataActuatorType)
+from pymodaq.utils.data import DataActuator
+from pymodaq_gui.parameter import Parameter
+
+from pymodaq_plugins_MockXUV.hardware.beam_pointing import BeamPointing, get_beam_pointing
+
+
+class DAQ_Move_MockBeamSteering(DAQ_Move_base):
+    """ Piezo steering mirror of the beam seen by the mock stabilization camera (see its Beam settings).
+
+    Each axis displaces the spot on the camera, in its pixels: it is the actuator of the beam stabilization PID
+    (see models/PIDModelBeamStab), one control module per axis.
+    """
+    _controller_units = 'px'
+    is_multiaxes = True
+    _axis_names = {'X': 1, 'Y': 0}  # index of the axis in the (y, x) positions of BeamPointing
+    _epsilon = 0.001
+    data_actuator_type = DataActuatorType.DataActuator
+
+    params = [
+        {'title': 'Beam drift (px):', 'name': 'drift', 'type': 'float', 'value': 0.05, 'min': 0,
+         'tip': 'rms step of the random walk of the beam at each chunk of the camera'},
+        {'title': 'Beam jitter (px):', 'name': 'jitter', 'type': 'float', 'value': 0.2, 'min': 0,
+         'tip': 'rms shot to shot jitter of the beam'},
+    ] + comon_parameters_fun(is_multiaxes, axis_names=_axis_names, epsilon=_epsilon)
+
+    def ini_attributes(self):
+        self.controller: BeamPointing = None
+
+    def get_actuator_value(self):
+        """Get the current value from the hardware with scaling conversion.
+
+        Returns
+        -------
+        DataActuator: The position obtained after scaling conversion.
+        """
+        pos = DataActuator(data=float(self.controller.correction[self.axis_value]), units=self.axis_unit)
+        pos = self.get_position_with_scaling(pos)
+        return pos
+
+    def close(self):
+        """Terminate the communication protocol"""
+        pass
+
+    def commit_settings(self, param: Parameter):
+        """Apply the consequences of a change of value in the actuator settings
+
+        Parameters
+        ----------
+        param: Parameter
+            A given parameter (within actuator_settings) whose value has been changed by the user
+        """
+        if param.name() in ('drift', 'jitter'):
+            setattr(self.controller, param.name(), param.value())
+
+    def ini_stage(self, controller=None):
+        """Actuator communication initialization
+
+        Parameters
+        ----------
+        controller: (object)
+            custom object of a PyMoDAQ plugin (Slave case). None if only one actuator by controller (Master case)
+
+        Returns
+        -------
+        info: str
+        initialized: bool
+            False if initialization failed otherwise True
+        """
+        if self.is_master:
+            self.controller = get_beam_pointing()  # the one seen by the stabilization camera of this process
+        else:
+            self.controller = controller
+        self.controller.drift = self.settings['drift']
+        self.controller.jitter = self.settings['jitter']
+
+        info = "Beam steering mirror initialized"
+        initialized = True
+        return info, initialized
+
+    def move_abs(self, value: DataActuator):
+        """ Move the actuator to the absolute target defined by value
+
+        Parameters
+        ----------
+        value: (float) value of the absolute target positioning
+        """
+        value = self.check_bound(value)
+        self.target_value = value
+        value = self.set_position_with_scaling(value)
+        self.controller.steer(self.axis_value, value.value())
+
+    def move_rel(self, value: DataActuator):
+        """ Move the actuator to the relative target actuator value defined by value
+
+        Parameters
+        ----------
+        value: (float) value of the relative target positioning
+        """
+        value = self.check_bound(self.current_value + value) - self.current_value
+        self.target_value = value + self.current_value
+        self.controller.steer(self.axis_value, self.set_position_with_scaling(self.target_value).value())
+
+    def move_home(self):
+        """Call the reference method of the controller"""
+        self.controller.steer(self.axis_value, 0.)
+
+    def stop_motion(self):
+        """Stop the actuator and emits move_done signal"""
+        self.move_done()
+
+
+if __name__ == '__main__':
+    main(__file__)
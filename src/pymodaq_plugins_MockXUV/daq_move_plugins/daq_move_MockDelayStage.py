@@ -0,0 +1,129 @@
+from pymodaq.control_modules.move_utility_classes import (DAQ_Move_base, comon_parameters_fun, main,
+                                                          DataActuatorType)
+from pymodaq.utils.data import DataActuator
+from pymodaq_gui.parameter import Parameter
+
+from pymodaq_plugins_MockXUV.hardware.delay_stage import MockDelayStage, get_delay_stage
+
+RESPONSE_SETTINGS = ('irf', 'tau_decay', 'tau_cool', 'shift')
+
+
+class DAQ_Move_MockDelayStage(DAQ_Move_base):
+    """ Pump-probe delay line of the mock XUV setup.
+
+    Its position (ps) sets the pump-on spectra of the detectors following it (see the MockCMOS settings), through
+    the sample response defined here: moving the stage does not cost more than a table lookup in the simulators.
+    """
+    _controller_units = MockDelayStage.units
+    is_multiaxes = False
+    _axis_names = ['Delay']
+    _epsilon = 0.001
+    data_actuator_type = DataActuatorType.DataActuator
+
+    params = [
+        {'title': 'Velocity (ps/s):', 'name': 'velocity', 'type': 'float', 'value': 0., 'default': 0., 'min': 0,
+         'tip': 'Speed of the delay line, 0 for instantaneous moves'},
+        {'title': 'Sample response', 'name': 'response', 'type': 'group', 'children': [
+            {'title': 'Rise time (ps):', 'name': 'irf', 'type': 'float', 'value': 0.1, 'min': 0,
+             'tip': 'rms width of the instrument response'},
+            {'title': 'Decay time (ps):', 'name': 'tau_decay', 'type': 'float', 'value': 5., 'min': 1e-3},
+            {'title': 'Cooling time (ps):', 'name': 'tau_cool', 'type': 'float', 'value': 0.5, 'min': 1e-3,
+             'tip': 'Relaxation time of the spectral shift of the transient'},
+            {'title': 'Shift at t0 (pixels):', 'name': 'shift', 'type': 'float', 'value': 10.},
+        ]},
+    ] + comon_parameters_fun(is_multiaxes, axis_names=_axis_names, epsilon=_epsilon)
+
+    def ini_attributes(self):
+        self.controller: MockDelayStage = None
+
+    def get_actuator_value(self):
+        """Get the current value from the hardware with scaling conversion.
+
+        Returns
+        -------
+        DataActuator: The position obtained after scaling conversion.
+        """
+        pos = DataActuator(data=self.controller.get_value(), units=self.axis_unit)
+        pos = self.get_position_with_scaling(pos)
+        return pos
+
+    def close(self):
+        """Terminate the communication protocol"""
+        self.controller.stop()
+
+    def commit_settings(self, param: Parameter):
+        """Apply the consequences of a change of value in the actuator settings
+
+        Parameters
+        ----------
+        param: Parameter
+            A given parameter (within actuator_settings) whose value has been changed by the user
+        """
+        if param.name() == 'velocity':
+            self.controller.velocity = param.value()
+        elif param.name() in RESPONSE_SETTINGS:
+            self.set_response()
+
+    def set_response(self):
+        self.controller.set_response(**{name: self.settings['response', name] for name in RESPONSE_SETTINGS})
+
+    def ini_stage(self, controller=None):
+        """Actuator communication initialization
+
+        Parameters
+        ----------
+        controller: (object)
+            custom object of a PyMoDAQ plugin (Slave case). None if only one actuator by controller (Master case)
+
+        Returns
+        -------
+        info: str
+        initialized: bool
+            False if initialization failed otherwise True
+        """
+        if self.is_master:
+            self.controller = get_delay_stage()  # the one followed by the detectors of this process
+        else:
+            self.controller = controller
+        self.controller.velocity = self.settings['velocity']
+        self.set_response()
+
+        info = "Delay stage initialized"
+        initialized = True
+        return info, initialized
+
+    def move_abs(self, value: DataActuator):
+        """ Move the actuator to the absolute target defined by value
+
+        Parameters
+        ----------
+        value: (float) value of the absolute target positioning
+        """
+        value = self.check_bound(value)
+        self.target_value = value
+        value = self.set_position_with_scaling(value)
+        self.controller.move_at(value.value())
+
+    def move_rel(self, value: DataActuator):
+        """ Move the actuator to the relative target actuator value defined by value
+
+        Parameters
+        ----------
+        value: (float) value of the relative target positioning
+        """
+        value = self.check_bound(self.current_value + value) - self.current_value
+        self.target_value = value + self.current_value
+        self.controller.move_at(self.set_position_with_scaling(self.target_value).value())
+
+    def move_home(self):
+        """Call the reference method of the controller"""
+        self.controller.move_at(0.)
+
+    def stop_motion(self):
+        """Stop the actuator and emits move_done signal"""
+        self.controller.stop()
+        self.move_done()
+
+
+if __name__ == '__main__':
+    main(__file__)
@@ -1,9 +1,14 @@
+import time
+
 import numpy as np
 from pymodaq.utils.daq_utils import ThreadCommand
 from pymodaq.utils.data import DataFromPlugins, Axis, DataToExport
 from pymodaq.control_modules.viewer_utility_classes import DAQ_Viewer_base, comon_parameters, main
 from pymodaq.utils.parameter import Parameter
 from pymodaq_plugins_MockXUV.hardware.hhg_spectrum import HHG_Spectrum
+from pymodaq_plugins_MockXUV.hardware.noise import NoiseGenerator
+from pymodaq_plugins_MockXUV.instrumentation import FPSMeter, StageTimer, fps_params, stage_params
+from pymodaq_plugins_MockXUV.processing.harmonics import HarmonicFits, HarmonicIndexer
 
 
 class DAQ_1DViewer_XUVSpectrum(DAQ_Viewer_base):
@@ -18,6 +23,7 @@ class DAQ_1DViewer_XUVSpectrum(DAQ_Viewer_base):
         The particular object that allow the communication with the hardware, in general a python wrapper around the
          hardware library.
     """
+    timed_stages = ('simulation', 'fit', 'data', 'emit')
     params = comon_parameters+[
         {'title': 'Image', 'name': 'roi', 'type': 'group', 'children':
             [{'title': 'Height', 'name': 'height', 'type': 'int', 'value': 1},
@@ -27,18 +33,28 @@ class DAQ_1DViewer_XUVSpectrum(DAQ_Viewer_base):
              {'title': 'Auto Vertical Centering', 'name': 'auto_vert', 'type': 'bool', 'value': False},
              {'title': 'Update ROI', 'name': 'update_roi', 'type': 'bool_push', 'value': False},
              {'title': 'Clear ROI+Bin', 'name': 'clear_roi', 'type': 'bool_push', 'value': False},
-             {'title': 'Binning', 'name': 'binning', 'type': 'list', 'limits': [1, 2]}, ]
+             {'title': 'Binning', 'name': 'binning', 'type': 'list', 'limits': [1, 2], 'value': 1}, ]
          },
         {'title': 'Set Background', 'name': 'take_background', 'type': 'bool_push', 'value': False},
+        {'title': 'Harmonics', 'name': 'harmonics', 'type': 'group', 'children':
+            [{'title': 'Fit harmonics', 'name': 'fit_on', 'type': 'bool', 'value': False,
+              'tip': 'Emit the amplitude, centre and width of a gaussian fit of each harmonic of each shot'},
+             {'title': 'Harmonics found', 'name': 'n_harmonics', 'type': 'int', 'value': 0, 'readonly': True},
+             {'title': 'Find harmonics', 'name': 'reindex', 'type': 'bool_push', 'value': False,
+              'tip': 'Find again the windows of the harmonics in the reference spectrum'}]
+         },
 
         {'title': 'Timing', 'name': 'timing_opts', 'type': 'group', 'children':
             [{'title': 'Exposure Time (ms)', 'name': 'exposure_time', 'type': 'float', 'value': 0.13},
              {'title': 'Chunk size', 'name': 'chunk_size', 'type': 'int', 'value': 1000},
-             {'title': 'Compute FPS', 'name': 'fps_on', 'type': 'bool', 'value': True},
-             {'title': 'Actual FPS', 'name': 'fps', 'type': 'float', 'value': 0.0, 'readonly': True, 'decimals': 6},
-             {'title': 'Max FPS', 'name': 'fps2', 'type': 'float', 'value': 0.0, 'readonly': True, 'decimals': 6},
+             {'title': 'Batched shots', 'name': 'batched', 'type': 'bool', 'value': False,
+              'tip': 'Emit chunk size shots at once as a shot x pixel image'},
+             *fps_params(),
+             *stage_params(),
              {'title': 'NLevel:', 'name': 'amp_noise', 'type': 'float', 'value': 2000, 'default': 2000, 'min': 0},
-             {'title': 'SLevel:', 'name': 'shift_noise', 'type': 'float', 'value': 5, 'default': 5, 'min': 0}],
+             {'title': 'SLevel:', 'name': 'shift_noise', 'type': 'float', 'value': 5, 'default': 5, 'min': 0},
+             {'title': 'Noise seed:', 'name': 'noise_seed', 'type': 'int', 'value': -1, 'default': -1,
+              'tip': 'Negative for a non reproducible noise'}],
         },
         ]
 
@@ -46,6 +62,10 @@ class DAQ_1DViewer_XUVSpectrum(DAQ_Viewer_base):
         #  autocompletion
         self.background = np.empty(0)
         self.controller: HHG_Spectrum = None
+        self.noise = NoiseGenerator(name='XUVSpectrum')
+        self.fps_meter = FPSMeter()
+        self.stage_timer = StageTimer(stages=self.timed_stages)
+        self.indexer: HarmonicIndexer = None
 
     def commit_settings(self, param: Parameter):
         """Apply the consequences of a change of value in the detector settings
@@ -57,6 +77,19 @@ class DAQ_1DViewer_XUVSpectrum(DAQ_Viewer_base):
         """
         if param.name() == "take_background":
             self.take_background()
+        elif param.name() == 'update_roi':
+            self.update_roi()
+        elif param.name() == 'clear_roi':
+            self.clear_roi()
+        elif param.name() == 'noise_seed':
+            self.noise.reseed(param.value())
+        elif param.name() == 'fps_on':
+            self.fps_meter.reset()
+        elif param.name() == 'stages_on':
+            self.stage_timer.enabled = param.value()
+            self.stage_timer.reset()
+        elif param.name() == 'reindex':
+            self.index_harmonics()
 
     def ini_detector(self, controller=None):
         """Detector communication initialization
@@ -78,10 +111,12 @@ class DAQ_1DViewer_XUVSpectrum(DAQ_Viewer_base):
 
         if self.is_master:
             self.controller = HHG_Spectrum()
+        self.noise.reseed(self.settings['timing_opts', 'noise_seed'])
+        self.stage_timer.enabled = self.settings['timing_opts', 'stages_on']
 
         # # get the x_axis (you may want to to this also in the commit settings if x_axis may have changed
         # data_x_axis = self.controller.your_method_to_get_the_x_axis()  # if possible
-        self.x_axis = Axis(data=np.arange(self.controller.data.shape[0]), label='Pixels', units='', index=0)
+        self.set_x_axis()
 
         self.dte_signal_temp.emit(DataToExport(name='HHG',
                                                data=[DataFromPlugins(name='Mock1',
@@ -98,6 +133,58 @@ class DAQ_1DViewer_XUVSpectrum(DAQ_Viewer_base):
         """Terminate the communication protocol"""
         pass
 
+    def set_x_axis(self):
+        self.x_axis = Axis(data=self.controller.pixels, label='Pixels', units='', index=0)
+        self.indexer = None  # the windows of the harmonics depend on the region of interest
+
+    def index_harmonics(self):
+        """Find the windows of the harmonics in the reference spectrum of the region of interest"""
+        self.indexer = HarmonicIndexer(self.controller.roi_data, self.controller.pixels)
+        self.settings.child('harmonics', 'n_harmonics').setValue(self.indexer.n_harmonics)
+        if self.indexer.n_harmonics == 0:
+            self.emit_status(ThreadCommand('Update_Status', ['No harmonic found in the region of interest', 'log']))
+
+    def fit_harmonics(self, spectra: np.ndarray) -> list:
+        """Gaussian fits of the harmonics of spectra (one or a chunk of shots), as a DataFromPlugins of one channel
+        per parameter, in a list empty if no harmonic was found"""
+        if self.indexer is None:
+            self.index_harmonics()
+        with self.stage_timer.stage('fit'):
+            fits: HarmonicFits = self.indexer.fit(spectra)
+        if self.indexer.n_harmonics == 0:
+            return []
+        harmonic_axis = Axis(data=np.arange(self.indexer.n_harmonics), label='Harmonic', units='',
+                             index=spectra.ndim - 1)
+        axes = [harmonic_axis]
+        if spectra.ndim == 2:
+            axes.insert(0, Axis(data=np.arange(spectra.shape[0]), label='Shot', units='', index=0))
+        return [DataFromPlugins(name='Harmonics', data=[fits.amplitude, fits.centre, fits.width],
+                                dim='Data2D' if spectra.ndim == 2 else 'Data1D',
+                                labels=['amplitude', 'centre', 'width'], axes=axes)]
+
+    def update_roi(self):
+        """Apply the region of interest and binning of the settings within the controller"""
+        roi = self.settings.child('roi')
+        if roi['auto_vert']:
+            center = self.controller.find_vertical_center(self.noise, self.settings['timing_opts', 'amp_noise'])
+            bottom = int(round(center - roi['height'] / 2))
+            roi.child('bottom').setValue(max(bottom, 0))
+        self.controller.set_roi(roi['left'], roi['width'], roi['bottom'], roi['height'], roi['binning'])
+        for name in ('left', 'width', 'bottom', 'height'):
+            roi.child(name).setValue(self.controller.roi[name])
+        self.set_x_axis()
+
+    def clear_roi(self):
+        """Read back the whole sensor without binning"""
+        self.controller.clear_roi()
+        roi = self.settings.child('roi')
+        roi.child('left').setValue(0)
+        roi.child('width').setValue(self.controller.data.size)
+        roi.child('bottom').setValue(0)
+        roi.child('height').setValue(self.controller.sensor_height)
+        roi.child('binning').setValue(1)
+        self.set_x_axis()
+
     def take_background(self):
         bkg = np.ones_like(self.x_axis.get_data())*5.5
         self.background = bkg
@@ -121,14 +208,58 @@ class DAQ_1DViewer_XUVSpectrum(DAQ_Viewer_base):
 
 
         ##synchrone version (blocking function)
-        data_tot = self.controller.data.copy() + self.settings['timing_opts', 'amp_noise'] * np.random.rand((self.x_axis.size))
-        x = self.x_axis.get_data()
-        data_tot = np.interp(x, x +self.settings['timing_opts', 'shift_noise']*np.random.randn(1), data_tot)
+        if self.settings['timing_opts', 'batched']:
+            self.grab_batch()
+            return
 
-        self.dte_signal.emit(DataToExport('HHG',
-                                          data=[DataFromPlugins(name='Mock1', data=data_tot,
-                                                                dim='Data1D', labels=['data'],
-                                                                axes=[self.x_axis])]))
+        data_tot = self.generate_spectra(1)[0]
+
+        with self.stage_timer.stage('data'):
+            dfp_list = [DataFromPlugins(name='Mock1', data=data_tot, dim='Data1D', labels=['data'],
+                                        axes=[self.x_axis])]
+        if self.settings['harmonics', 'fit_on']:
+            dfp_list.extend(self.fit_harmonics(data_tot))
+        self.emit_data(dfp_list)
+        self.count_delivery(1)
+
+    def generate_spectra(self, nshots: int) -> np.ndarray:
+        start = time.perf_counter()
+        spectra = self.controller.grab_spectra(nshots, self.noise, self.settings['timing_opts', 'amp_noise'],
+                                               self.settings['timing_opts', 'shift_noise'])
+        duration = time.perf_counter() - start
+        self.stage_timer.add('simulation', duration)
+        if self.settings['timing_opts', 'fps_on']:
+            self.fps_meter.add_generation(nshots, duration)
+        return spectra
+
+    def emit_data(self, dfp_list: list):
+        """Emit the data of a grab, with the timing of the stages if exported"""
+        if self.stage_timer.enabled and self.settings['timing_opts', 'stages_export']:
+            dfp_list.extend(self.stage_timer.to_data(DataFromPlugins))  # as published after the previous emit
+        with self.stage_timer.stage('emit'):
+            self.dte_signal.emit(DataToExport('HHG', data=dfp_list))
+        if self.stage_timer.enabled:
+            self.stage_timer.publish(self.settings.child('timing_opts'))
+
+    def count_delivery(self, nshots: int):
+        if self.settings['timing_opts', 'fps_on']:
+            self.fps_meter.add_delivery(nshots)
+            self.fps_meter.publish(self.settings.child('timing_opts'))
+
+    def grab_batch(self):
+        """Emit chunk_size single-shot spectra generated in one vectorized pass, as a shot x pixel image"""
+        nshots = self.settings['timing_opts', 'chunk_size']
+        spectra = self.generate_spectra(nshots)
+
+        with self.stage_timer.stage('data'):
+            shot_axis = Axis(data=np.arange(nshots), label='Shot', units='', index=0)
+            pixel_axis = Axis(data=self.x_axis.get_data(), label='Pixels', units='', index=1)
+            dfp_list = [DataFromPlugins(name='Shots', data=[spectra], dim='Data2D', labels=['data'],
+                                        axes=[shot_axis, pixel_axis])]
+        if self.settings['harmonics', 'fit_on']:
+            dfp_list.extend(self.fit_harmonics(spectra))
+        self.emit_data(dfp_list)
+        self.count_delivery(nshots)
 
 
     def stop(self):
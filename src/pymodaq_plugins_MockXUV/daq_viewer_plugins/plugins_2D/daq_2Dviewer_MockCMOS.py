@@ -8,25 +8,128 @@ from pymodaq_gui.parameter import Parameter
 
 from pymodaq.control_modules.viewer_utility_classes import DAQ_Viewer_base, comon_parameters, main
 from pymodaq.utils.data import DataFromPlugins
+from pymodaq_plugins_MockXUV.hardware.hdf5_stream import COMPRESSIONS, HDF5StreamWriter
 from pymodaq_plugins_MockXUV.hardware.cmos_simulator import Mock_SingleShot
+from pymodaq_plugins_MockXUV.hardware.chunk_producer import ChunkProducer
+from pymodaq_plugins_MockXUV.hardware.delay_stage import get_delay_stage
+from pymodaq_plugins_MockXUV.hardware.frame_pool import WorkArrays
+from pymodaq_plugins_MockXUV.hardware.noise import NoiseGenerator
+from pymodaq_plugins_MockXUV.hardware.replay import ReplaySimulator
+from pymodaq_plugins_MockXUV.hardware.sensor_model import SensorModel
+from pymodaq_plugins_MockXUV.hardware.shm_simulator import SharedMemorySimulator
+from pymodaq_plugins_MockXUV.hardware.simulator_farm import get_farm
+from pymodaq_plugins_MockXUV.instrumentation import FPSMeter, StageTimer, fps_params, stage_params
+from pymodaq_plugins_MockXUV.processing.preview import PreviewThrottle, bin_edges, bin_image
+import queue
 import random
 
 
 class DAQ_2DViewer_MockCMOS(DAQ_Viewer_base):
     """ Instrument plugin class for a 2D viewer.
+
+    Averaging is done chunk after chunk within the plugin (hardware averaging), so only one chunk is held at a time
+    whatever Naverage. The chunks are given back to the simulator as soon as processed: the emitted data never
+    refer to them, the viewer and the extensions using it after the next grabs.
+
+    The chunks may be made by a producer thread, which must not read the settings (Qt parameters): it reads the
+    chunk_settings snapshot taken from them in the plugin thread (see snapshot_settings).
     """
+    chunk_settings = ('chunk_size', 'gas_off', 'amp_noise', 'amp_drift', 'fps_on')
+    timed_stages = ('grab', 'simulation', 'sensor', 'replay', 'noise', 'image', 'ponoff', 'dRoverR', 'stream', 'data',
+                    'preview', 'emit')
+    hardware_averaging = True
     params = comon_parameters + [
         {'title': 'Chunk size', 'name': 'chunk_size', 'type': 'int', 'value': 100},
         {'title': 'Sleep time', 'name': 'sleep_time', 'type': 'int', 'value': 10},
         {'title': 'White noise:', 'name': 'amp_noise', 'type': 'float', 'value': 1000, 'default': 5000, 'min': 0},
+        {'title': '1/f drift:', 'name': 'amp_drift', 'type': 'float', 'value': 0., 'default': 0., 'min': 0,
+         'tip': 'Relative rms fluctuation of the source intensity from shot to shot'},
+        {'title': 'Noise seed:', 'name': 'noise_seed', 'type': 'int', 'value': -1, 'default': -1,
+         'tip': 'Negative for a non reproducible noise'},
+        {'title': 'Precision:', 'name': 'precision', 'type': 'list', 'limits': ['float64', 'float32'],
+         'value': 'float64'},
         {'title': '2D Image:', 'name': 'twod_image', 'type': 'bool', 'value': True, 'default': True},
         {'title': 'dRoverR:', 'name': 'dRoverR', 'type': 'bool', 'value': False, 'default': False},
         {'title': 'pOn/pOff', 'name': 'ponoff', 'type': 'bool', 'value': False, 'default': False},
         {'title': 'Turn off the gas', 'name': 'gas_off', 'type': 'bool', 'value': False, 'default': False},
+        {'title': 'Preview', 'name': 'preview', 'type': 'group', 'children': [
+            {'title': 'Decimated preview:', 'name': 'preview_on', 'type': 'bool', 'value': False, 'default': False,
+             'tip': 'Display a binned copy of the image at a limited rate, the full image of every grab being only '
+                    'saved and given to the extensions'},
+            {'title': 'Max rate (Hz):', 'name': 'max_rate', 'type': 'float', 'value': 30., 'min': 0,
+             'tip': '0 for a preview of every grab'},
+            {'title': 'Shot binning:', 'name': 'shot_binning', 'type': 'int', 'value': 10, 'min': 1},
+            {'title': 'Pixel binning:', 'name': 'pixel_binning', 'type': 'int', 'value': 1, 'min': 1},
+            {'title': 'Previews sent (Hz):', 'name': 'preview_rate', 'type': 'float', 'value': 0., 'readonly': True,
+             'tip': 'Rate of the previews sent to the viewer, which may display fewer of them'},
+        ]},
+        {'title': 'Follow the delay stage:', 'name': 'follow_delay', 'type': 'bool', 'value': False,
+         'default': False, 'tip': 'The pump-on spectra depend on the position of the MockDelayStage actuator. '
+                                  'Thread simulator only'},
+        {'title': 'Producer', 'name': 'producer', 'type': 'group', 'children': [
+            {'title': 'Producer thread:', 'name': 'use_producer', 'type': 'bool', 'value': False, 'default': False},
+            {'title': 'Queue depth:', 'name': 'queue_depth', 'type': 'int', 'value': 2, 'default': 2, 'min': 1},
+            {'title': 'Queue fill:', 'name': 'queue_fill', 'type': 'int', 'value': 0, 'readonly': True},
+            {'title': 'Dropped chunks:', 'name': 'n_dropped', 'type': 'int', 'value': 0, 'readonly': True},
+        ]},
+        {'title': 'Simulator:', 'name': 'simulator', 'type': 'list', 'limits': ['thread', 'process', 'farm', 'replay'],
+         'value': 'thread', 'tip': 'Simulate the chunks in the plugin thread, or (noise included) in a separate '
+                                   'process or in the process pool shared by the farm cameras, through shared '
+                                   'memory, or replay the shots of a recording'},
+        {'title': 'Farm', 'name': 'farm', 'type': 'group', 'children': [
+            {'title': 'Sensor width:', 'name': 'n_pixels', 'type': 'int', 'value': 0, 'default': 0, 'min': 0,
+             'tip': 'Number of pixels of the farm camera, 0 for the width of the data file'},
+            {'title': 'Dropped chunks:', 'name': 'n_dropped', 'type': 'int', 'value': 0, 'readonly': True},
+            {'title': 'Latency (ms):', 'name': 'latency', 'type': 'float', 'value': 0., 'readonly': True},
+        ]},
+        {'title': 'Replay', 'name': 'replay', 'type': 'group', 'children': [
+            {'title': 'Recording:', 'name': 'replay_path', 'type': 'browsepath', 'value': '', 'filetype': True,
+             'tip': 'HDF5 file written by the stream (raw and pump_on datasets) or .npy file of the shots, replayed '
+                    'as is (no noise nor sensor model added) by the replay simulator'},
+            {'title': 'Loop:', 'name': 'loop', 'type': 'bool', 'value': True, 'default': True},
+            {'title': 'Go to shot:', 'name': 'seek_shot', 'type': 'int', 'value': 0, 'min': 0},
+            {'title': 'Shot:', 'name': 'position', 'type': 'int', 'value': 0, 'readonly': True},
+            {'title': 'Recorded shots:', 'name': 'n_shots', 'type': 'int', 'value': 0, 'readonly': True},
+            {'title': 'Disk underruns:', 'name': 'n_underruns', 'type': 'int', 'value': 0, 'readonly': True,
+             'tip': 'Grabs that waited for the shots to be read from the disk'},
+        ]},
+        {'title': 'Sensor model', 'name': 'sensor', 'type': 'group', 'children': [
+            {'title': 'Simulate the sensor:', 'name': 'sensor_on', 'type': 'bool', 'value': False, 'default': False,
+             'tip': 'Shot and read noises, gain and offset maps, hot pixels, saturation and 16 bits ADC (uint16 '
+                    'images) in place of the white noise. Thread simulator only'},
+            {'title': 'Electrons per count:', 'name': 'electrons_per_count', 'type': 'float', 'value': 0.25,
+             'min': 0, 'tip': 'Photoelectrons per count of the simulated profiles'},
+            {'title': 'Gain (ADU/e-):', 'name': 'gain', 'type': 'float', 'value': 1., 'min': 0},
+            {'title': 'Read noise (e-):', 'name': 'read_noise', 'type': 'float', 'value': 2., 'min': 0},
+            {'title': 'Offset (ADU):', 'name': 'offset', 'type': 'float', 'value': 100., 'min': 0},
+            {'title': 'Full well (e-):', 'name': 'full_well', 'type': 'float', 'value': 50000., 'min': 0},
+            {'title': 'Hot pixels fraction:', 'name': 'hot_fraction', 'type': 'float', 'value': 0.001, 'min': 0,
+             'max': 1},
+            {'title': 'Pattern seed:', 'name': 'pattern_seed', 'type': 'int', 'value': 0,
+             'tip': 'Seed of the gain, offset and hot pixel maps'},
+        ]},
+        {'title': 'Stream to HDF5', 'name': 'stream', 'type': 'group', 'children': [
+            {'title': 'Stream:', 'name': 'stream_on', 'type': 'bool', 'value': False, 'default': False,
+             'tip': 'Write every shot (raw frames, pump state and dR/R if computed) to the file'},
+            {'title': 'File:', 'name': 'stream_path', 'type': 'browsepath', 'value': '', 'filetype': True},
+            {'title': 'Compression:', 'name': 'compression', 'type': 'list', 'limits': list(COMPRESSIONS),
+             'value': 'none'},
+            {'title': 'Shots written:', 'name': 'rows_written', 'type': 'int', 'value': 0, 'readonly': True},
+            {'title': 'Queue fill:', 'name': 'queue_fill', 'type': 'int', 'value': 0, 'readonly': True},
+        ]},
+        {'title': 'Timing', 'name': 'timing_opts', 'type': 'group', 'children': fps_params() + stage_params()},
     ]
 
     def ini_attributes(self):
         self.controller: Mock_SingleShot = None
+        self._work = WorkArrays()
+        self._snapshot: dict = {}
+        self.noise = NoiseGenerator(name='MockCMOS')
+        self.fps_meter = FPSMeter()
+        self.stage_timer = StageTimer(stages=self.timed_stages)
+        self.preview_throttle = PreviewThrottle()
+        self._producer: ChunkProducer = None
+        self._stream: HDF5StreamWriter = None
 
     def commit_settings(self, param: Parameter):
         """Apply the consequences of a change of value in the detector settings
@@ -36,9 +139,109 @@ class DAQ_2DViewer_MockCMOS(DAQ_Viewer_base):
         param: Parameter
             A given parameter (within detector_settings) whose value has been changed by the user
         """
-        if param.name() == "a_parameter_you've_added_in_self.params":
-            self.controller.your_method_to_apply_this_param_change()
-        # elif ...
+        if param.name() in self.chunk_settings:
+            self.snapshot_settings()
+        if param.name() in ('use_producer', 'queue_depth'):
+            self.stop_producer()
+        elif param.name() == 'sleep_time' and self._producer is not None:
+            self._producer.period = self.settings['sleep_time'] / 1000
+        elif param.name() == 'noise_seed':
+            self.noise.reseed(param.value())
+        elif param.name() == 'precision':
+            self.controller.dtype = np.dtype(param.value())
+        elif param.name() == 'fps_on':
+            self.fps_meter.reset()
+        elif param.name() == 'max_rate':
+            self.preview_throttle.max_rate = param.value()
+        elif param.name() == 'stages_on':
+            self.stage_timer.enabled = param.value()
+            self.stage_timer.reset()
+        elif self.is_master and (param.name() == 'simulator' or
+                                 param.name() == 'replay_path' and self.settings['simulator'] == 'replay'):
+            self.set_controller()
+            self.set_sensor()
+            self.set_delay_stage()
+            self.set_axes()
+        elif param.parent() is not None and param.parent().name() == 'sensor':
+            self.set_sensor()
+        elif param.name() == 'follow_delay':
+            self.set_delay_stage()
+        elif param.name() == 'loop' and self.controller.replays:
+            self.controller.loop = param.value()
+        elif param.name() == 'seek_shot' and self.controller.replays:
+            self.stop_producer()
+            self.controller.seek(param.value())
+        elif param.name() == 'stream_on':
+            if param.value():
+                self.start_stream()
+            else:
+                self.stop_stream()
+
+        if param.name() in ('amp_noise', 'amp_drift', 'noise_seed', 'sleep_time', 'gas_off', 'n_pixels'):
+            self.configure_controller()
+            if param.name() == 'n_pixels':
+                self.set_axes()
+
+    def set_controller(self):
+        """Simulate the chunks in the plugin thread, in a separate process or in the farm, or replay a recording,
+        depending on the simulator setting"""
+        self.stop_producer()
+        if self.controller is not None:
+            self.controller.close()
+        if self.settings['simulator'] == 'process':
+            self.controller = SharedMemorySimulator(nframes=self.settings['chunk_size'] // 2,
+                                                    dtype=self.settings['precision'])
+        elif self.settings['simulator'] == 'farm':
+            self.controller = get_farm().add_camera(nframes=self.settings['chunk_size'] // 2,
+                                                    dtype=self.settings['precision'])
+        elif self.settings['simulator'] == 'replay' and self.settings['replay', 'replay_path'] != '':
+            self.controller = ReplaySimulator(self.settings['replay', 'replay_path'],
+                                              loop=self.settings['replay', 'loop'], dtype=self.settings['precision'])
+            self.controller.seek(self.settings['replay', 'seek_shot'])
+            self.settings.child('replay', 'n_shots').setValue(self.controller.n_shots)
+        else:
+            if self.settings['simulator'] == 'replay':
+                self.emit_status(ThreadCommand('Update_Status', ['Select a recording to replay', 'log']))
+            self.controller = Mock_SingleShot(dtype=self.settings['precision'])
+        if not self.controller.runs_in_process:
+            self.controller.timer = self.stage_timer  # the simulation stages in the profile of the plugin
+        self.configure_controller()
+
+    def set_sensor(self):
+        """Set up (or remove) the sensor model of a simulator running in the plugin thread"""
+        if self.controller.runs_in_process or self.controller.replays:
+            return
+        if self.settings['sensor', 'sensor_on']:
+            self.controller.sensor = SensorModel(
+                self.controller.pon.shape, electrons_per_count=self.settings['sensor', 'electrons_per_count'],
+                gain=self.settings['sensor', 'gain'], read_noise=self.settings['sensor', 'read_noise'],
+                offset=self.settings['sensor', 'offset'], full_well=self.settings['sensor', 'full_well'],
+                hot_fraction=self.settings['sensor', 'hot_fraction'],
+                pattern_seed=self.settings['sensor', 'pattern_seed'])
+        else:
+            self.controller.sensor = None
+
+    def set_delay_stage(self):
+        """Make the pump-on spectra of a simulator running in the plugin thread follow the delay stage"""
+        if not self.controller.runs_in_process:
+            self.controller.delay_stage = get_delay_stage() if self.settings['follow_delay'] else None
+
+    def snapshot_settings(self):
+        """Copy the chunk_settings in a plain dict, replaced as a whole so _make_chunk reads a consistent set"""
+        self._snapshot = dict(chunk_size=self.settings['chunk_size'], gas_off=self.settings['gas_off'],
+                              amp_noise=self.settings['amp_noise'], amp_drift=self.settings['amp_drift'],
+                              fps_on=self.settings['timing_opts', 'fps_on'])
+
+    def configure_controller(self):
+        """Forward the simulation settings to a controller generating the noise itself"""
+        if self.controller is None or not self.controller.runs_in_process:
+            return
+        config = dict(amp_noise=self.settings['amp_noise'], amp_drift=self.settings['amp_drift'],
+                      seed=self.settings['noise_seed'], gas_off=self.settings['gas_off'],
+                      period=self.settings['sleep_time'] / 1000)
+        if self.settings['simulator'] == 'farm':
+            config['n_pixels'] = self.settings['farm', 'n_pixels'] or None
+        self.controller.configure(**config)
 
     def ini_detector(self, controller=None):
         """Detector communication initialization
@@ -58,7 +261,13 @@ class DAQ_2DViewer_MockCMOS(DAQ_Viewer_base):
         self.ini_detector_init(slave_controller=controller)
 
         if self.is_master:
-            self.controller = Mock_SingleShot()  # instantiate you driver with whatever arguments are needed
+            self.set_controller()
+            self.set_sensor()
+            self.set_delay_stage()
+        self.noise.reseed(self.settings['noise_seed'])
+        self.snapshot_settings()
+        self.stage_timer.enabled = self.settings['timing_opts', 'stages_on']
+        self.preview_throttle.max_rate = self.settings['preview', 'max_rate']
 
         self.set_axes()
 
@@ -80,6 +289,66 @@ class DAQ_2DViewer_MockCMOS(DAQ_Viewer_base):
 
     def close(self):
         """Terminate the communication protocol"""
+        self.stop_producer()
+        self.stop_stream()
+        if self.is_master:
+            self.controller.close()
+
+    def start_stream(self):
+        """Start writing all the grabbed shots to the HDF5 file of the stream settings"""
+        self.stop_stream()
+        if self.settings['stream', 'stream_path'] == '':
+            self.emit_status(ThreadCommand('Update_Status', ['Select a file to stream the shots to', 'log']))
+            self.settings.child('stream', 'stream_on').setValue(False)
+            return
+        attributes = {name: self.settings[name] for name in ('chunk_size', 'amp_noise', 'amp_drift', 'noise_seed')}
+        self._stream = HDF5StreamWriter(self.settings['stream', 'stream_path'],
+                                        compression=self.settings['stream', 'compression'], attributes=attributes)
+        self._stream.start()
+
+    def stop_stream(self):
+        """Write the shots still queued and close the stream file"""
+        if self._stream is not None:
+            stream, self._stream = self._stream, None
+            stream.close()
+
+    def start_producer(self):
+        """Start generating chunks in a worker thread, ahead of the grabs"""
+        if self._producer is None:
+            self._producer = ChunkProducer(self._make_chunk, period=self.settings['sleep_time'] / 1000,
+                                           depth=self.settings['producer', 'queue_depth'],
+                                           on_drop=self._drop_chunk)
+        self._producer.start()
+
+    def stop_producer(self):
+        if self._producer is not None:
+            self._producer.stop()
+            self._producer = None
+
+    def _drop_chunk(self, chunk: tuple):
+        self.controller.release(chunk[0])
+
+    def _make_chunk(self) -> tuple:
+        """Simulate a chunk of shots with its noise, in a buffer to be released to the controller, together with the
+        pump state of its first shot (that of the controller changing with the next chunk made)"""
+        settings = self._snapshot
+        start = time.perf_counter()
+        with self.stage_timer.stage('grab'):  # waiting for the chunk of a simulator process included
+            data_tot = self.controller.grab_XUV(settings['chunk_size'] // 2, gas_off=settings['gas_off'])
+        first_is_on = self.controller.FirstShotIsPumpOn
+        if self.controller.runs_in_process:
+            return data_tot, first_is_on  # noise already added by the simulator process
+
+        if not self.controller.replays:  # recorded shots come with their own noise
+            with self.stage_timer.stage('noise'):
+                self.noise.apply_drift(data_tot, settings['amp_drift'])
+                if self.controller.sensor is None:
+                    self.noise.add_uniform(data_tot, settings['amp_noise'])
+            if self.controller.sensor is not None:
+                data_tot = self.controller.readout(data_tot, self.noise)
+        if settings['fps_on']:
+            self.fps_meter.add_generation(data_tot.shape[0], time.perf_counter() - start)
+        return data_tot, first_is_on
 
     def grab_data(self, Naverage=1, **kwargs):
         """Start a grab from the detector
@@ -92,37 +361,158 @@ class DAQ_2DViewer_MockCMOS(DAQ_Viewer_base):
         kwargs: dict
             others optionals arguments
         """
-        data_tot = self.controller.grab_XUV(self.settings["chunk_size"] // 2, gas_off=self.settings['gas_off'])
+        image = None
+        poff_mean = pon_mean = dR_mean = 0.
+        for ind_average in range(Naverage):
+            chunk = self._next_chunk()
+            if chunk is None:
+                return
+            data_tot, first_is_on = chunk  # the pump state of the first shot changes from chunk to chunk
+            if first_is_on:
+                pon, poff = data_tot[0::2, :], data_tot[1::2, :]
+            else:
+                pon, poff = data_tot[1::2, :], data_tot[0::2, :]
+
+            if self.settings["twod_image"]:
+                with self.stage_timer.stage('image'):
+                    if Naverage == 1:
+                        image = data_tot.copy()  # emitted, while the chunk goes back to the simulator pool
+                    elif image is None:  # integer ADC counts are summed as floats
+                        image = data_tot.astype(data_tot.dtype if data_tot.dtype.kind == 'f' else np.float64)
+                        image_first_is_on = first_is_on
+                    elif first_is_on == image_first_is_on:
+                        image += data_tot
+                    else:  # rows of the same parity hold shots of the same pump state
+                        image[0::2] += data_tot[1::2]
+                        image[1::2] += data_tot[0::2]
+
+            if self.settings["ponoff"]:
+                with self.stage_timer.stage('ponoff'):
+                    poff_mean = poff_mean + poff.mean(axis=0)
+                    pon_mean = pon_mean + pon.mean(axis=0)
+
+            if self.settings["dRoverR"]:
+                with self.stage_timer.stage('dRoverR'):
+                    dR = self._work.get('dR', pon.shape, np.result_type(pon, np.float32))  # float for ADC counts
+                    np.subtract(pon, poff, out=dR, dtype=dR.dtype)
+                    dR /= poff
+                    dR_mean = dR_mean + dR.mean(axis=0)
+
+            if self._stream is not None:
+                with self.stage_timer.stage('stream'):
+                    self.stream_chunk(data_tot, first_is_on, dR if self.settings["dRoverR"] else None)
+
+            self.controller.release(data_tot)
+
+        preview = None
+        with self.stage_timer.stage('data'):
+            dfp_list = []
+
+            if self.settings["twod_image"]:
+                if Naverage > 1:
+                    image /= Naverage
+                preview_on = self.settings['preview', 'preview_on']
+                dfp_list.append(DataFromPlugins(name='Image', data=[image],
+                                                dim='Data2D', labels=['label1'],
+                                                x_axis=self.x_axis,
+                                                y_axis=self.y_axis, do_plot=not preview_on, do_save=True))
+                if preview_on and self.preview_throttle.due():
+                    with self.stage_timer.stage('preview'):
+                        preview = self.preview_image(image)
+
+            if self.settings["ponoff"]:
+                dfp_list.append(DataFromPlugins(name='POnOff', data=[poff_mean / Naverage, pon_mean / Naverage],
+                                                dim='Data1D', labels=['off', 'on'],
+                                                x_axis=self.x_axis))
+
+            if self.settings["dRoverR"]:
+                dfp_list.append(DataFromPlugins(name='dRoverR', data=[dR_mean / Naverage],
+                                                dim='Data1D', labels=['dRoverR'],
+                                                x_axis=self.x_axis))
 
-        data_tot += self.settings['amp_noise'] * np.random.random_sample(data_tot.shape)
+        if self.stage_timer.enabled and self.settings['timing_opts', 'stages_export']:
+            dfp_list.extend(self.stage_timer.to_data(DataFromPlugins))  # as published after the previous emit
 
-        pon = data_tot[0::2, :]
-        poff = data_tot[1::2, :]
-        dR = (pon-poff)/poff
+        with self.stage_timer.stage('emit'):
+            self.dte_signal.emit(DataToExport('CMOS', data=dfp_list))
+            if preview is not None:  # displayed only, the saved data are the same at every grab
+                self.dte_signal_temp.emit(DataToExport('CMOS', data=[preview]))
+        if self.stage_timer.enabled:
+            self.stage_timer.publish(self.settings.child('timing_opts'))
 
-        dfp_list = []
-        time.sleep(self.settings["sleep_time"] / 1000)
+        if self.settings['timing_opts', 'fps_on']:
+            self.fps_meter.add_delivery(Naverage * data_tot.shape[0])
+            self.fps_meter.publish(self.settings.child('timing_opts'))
+        if self.settings['simulator'] == 'farm':
+            stats = self.controller.stats()
+            self.settings.child('farm', 'n_dropped').setValue(stats['dropped'])
+            self.settings.child('farm', 'latency').setValue(stats['latency'] * 1000)
+        elif self.controller.replays:
+            self.settings.child('replay', 'position').setValue(self.controller.position)
+            self.settings.child('replay', 'n_underruns').setValue(self.controller.n_underruns)
 
-        if self.settings["twod_image"]:
-            dfp_list.append(DataFromPlugins(name='Image', data=[data_tot],
-                                            dim='Data2D', labels=['label1'],
-                                            x_axis=self.x_axis,
-                                            y_axis=self.y_axis))
+    def preview_image(self, image: np.ndarray) -> DataFromPlugins:
+        """Binned copy of image for display only (not saved), see the preview settings"""
+        shot_binning = self.settings['preview', 'shot_binning']
+        pixel_binning = self.settings['preview', 'pixel_binning']
+        axes = []
+        for index, (size, binning, label) in enumerate(((image.shape[0], shot_binning, 'Shot'),
+                                                        (image.shape[1], pixel_binning, 'Pixels'))):
+            edges = bin_edges(size, binning)
+            centres = (edges + np.minimum(edges + binning, size) - 1) / 2
+            axes.append(Axis(data=centres, label=label, units='', index=index))
+        self.settings.child('preview', 'preview_rate').setValue(self.preview_throttle.rate)
+        return DataFromPlugins(name='Preview', data=[bin_image(image, shot_binning, pixel_binning)], dim='Data2D',
+                               labels=['preview'], axes=axes, do_plot=True, do_save=False)
 
-        if self.settings["ponoff"]:
-            dfp_list.append(DataFromPlugins(name='POnOff', data=[poff.mean(axis=0), pon.mean(axis=0)],
-                                            dim='Data1D', labels=['off', 'on'],
-                                            x_axis=self.x_axis))
+    def stream_chunk(self, data_tot: np.ndarray, first_is_on: bool, dR: np.ndarray = None):
+        """Queue a chunk (a copy of it) for writing in the stream file, with the pump state of each shot (given that
+        of the first one) and the dR/R of each pump-on/pump-off pair.
 
-        if self.settings["dRoverR"]:
-            dfp_list.append(DataFromPlugins(name='dRoverR', data=[dR.mean(axis=0)],
-                                            dim='Data1D', labels=['dRoverR'],
-                                            x_axis=self.x_axis))
+        Row i of dR_over_R is the pair of rows 2i and 2i + 1 of raw, the pairs streamed while dRoverR was off being
+        NaN rows."""
+        pump_on = np.empty(data_tot.shape[0], dtype=bool)
+        pump_on[0::2] = first_is_on
+        pump_on[1::2] = not first_is_on
+        try:
+            pair = self._stream.n_queued.get('raw', 0) // 2
+            self._stream.append('raw', data_tot)
+            self._stream.append('pump_on', pump_on)
+            if dR is not None:
+                self._stream.append('dR_over_R', dR, start=pair)
+        except RuntimeError as e:
+            self.emit_status(ThreadCommand('Update_Status', [f'{e}: {e.__cause__}', 'log']))
+            self.stop_stream()
+            self.settings.child('stream', 'stream_on').setValue(False)
+            return
+        self.settings.child('stream', 'rows_written').setValue(self._stream.n_rows.get('raw', 0))
+        self.settings.child('stream', 'queue_fill').setValue(self._stream.queue_fill)
 
-        self.dte_signal.emit(DataToExport('CMOS', data=dfp_list))
+    def _next_chunk(self) -> tuple:
+        """Get the next noisy chunk and the pump state of its first shot, from the producer thread if enabled, None
+        if it did not come in time"""
+        if self.settings['producer', 'use_producer']:
+            self.start_producer()
+            try:
+                chunk = self._producer.get(timeout=1 + 10 * self._producer.period)
+            except queue.Empty:
+                self.emit_status(ThreadCommand('Update_Status', ['No chunk produced in time', 'log']))
+                return None
+            self.settings.child('producer', 'queue_fill').setValue(self._producer.queue_fill)
+            self.settings.child('producer', 'n_dropped').setValue(self._producer.n_dropped)
+        else:
+            try:
+                chunk = self._make_chunk()
+            except (TimeoutError, EOFError) as e:
+                self.emit_status(ThreadCommand('Update_Status', [str(e), 'log']))
+                return None
+            if not self.controller.runs_in_process:  # otherwise paced by the simulator process
+                time.sleep(self.settings["sleep_time"] / 1000)
+        return chunk
 
     def stop(self):
         """Stop the current grab hardware wise if necessary"""
+        self.stop_producer()
         return ''
 
 
@@ -8,22 +8,45 @@ from pymodaq_gui.parameter import Parameter
 
 from pymodaq.control_modules.viewer_utility_classes import DAQ_Viewer_base, comon_parameters, main
 from pymodaq.utils.data import DataFromPlugins
+from pymodaq_plugins_MockXUV.hardware.beam_pointing import BeamPointing, get_beam_pointing
 from pymodaq_plugins_MockXUV.hardware.cmos_simulator import Mock_SingleShot
+from pymodaq_plugins_MockXUV.hardware.noise import NoiseGenerator
+from pymodaq_plugins_MockXUV.hardware.replay import ReplaySimulator
+from pymodaq_plugins_MockXUV.instrumentation import FPSMeter, StageTimer, fps_params, stage_params
 import random
 
 
 class DAQ_2DViewer_MockStabCamera(DAQ_Viewer_base):
     """ Instrument plugin class for a 2D viewer.
     """
+    timed_stages = ('grab', 'simulation', 'replay', 'noise', 'data', 'beam', 'emit')
     params = comon_parameters + [
-        {'title': 'Chunk size', 'name': 'chunk_size', 'type': 'int', 'value': 100},
+        {'title': 'Chunk size', 'name': 'chunk_size', 'type': 'int', 'value': 100,
+         'tip': 'That of the MockCMOS when sharing its simulator process or farm camera'},
         {'title': 'Sleep time', 'name': 'sleep_time', 'type': 'int', 'value': 10},
         {'title': 'White noise:', 'name': 'amp_noise', 'type': 'float', 'value': 0.1, 'default': 0.1, 'min': 0},
+        {'title': 'Noise seed:', 'name': 'noise_seed', 'type': 'int', 'value': -1, 'default': -1,
+         'tip': 'Negative for a non reproducible noise'},
+        {'title': 'Beam', 'name': 'beam', 'type': 'group', 'children': [
+            {'title': 'Beam image:', 'name': 'beam_on', 'type': 'bool', 'value': False, 'default': False,
+             'tip': 'Also emit the image of the beam pointing, summed over the chunk (see DAQ_Move_MockBeamSteering)'},
+        ]},
+        {'title': 'Replay', 'name': 'replay', 'type': 'group', 'children': [
+            {'title': 'Recording:', 'name': 'replay_path', 'type': 'browsepath', 'value': '', 'filetype': True,
+             'tip': 'Follow the pump states recorded in this file (see the MockCMOS replay), empty to simulate them'},
+            {'title': 'Loop:', 'name': 'loop', 'type': 'bool', 'value': True, 'default': True},
+            {'title': 'Shot:', 'name': 'position', 'type': 'int', 'value': 0, 'readonly': True},
+        ]},
+        {'title': 'Timing', 'name': 'timing_opts', 'type': 'group', 'children': fps_params() + stage_params()},
         #{'title': '2D Image:', 'name': 'twod_image', 'type': 'bool', 'value': True, 'default': True},
     ]
 
     def ini_attributes(self):
         self.controller: Mock_SingleShot = None
+        self.beam: BeamPointing = None
+        self.noise = NoiseGenerator(name='MockStabCamera')
+        self.fps_meter = FPSMeter()
+        self.stage_timer = StageTimer(stages=self.timed_stages)
 
     def commit_settings(self, param: Parameter):
         """Apply the consequences of a change of value in the detector settings
@@ -33,9 +56,42 @@ class DAQ_2DViewer_MockStabCamera(DAQ_Viewer_base):
         param: Parameter
             A given parameter (within detector_settings) whose value has been changed by the user
         """
-        if param.name() == "a_parameter_you've_added_in_self.params":
-            self.controller.your_method_to_apply_this_param_change()
-        # elif ...
+        if param.name() == 'noise_seed':
+            self.noise.reseed(param.value())
+        elif param.name() == 'fps_on':
+            self.fps_meter.reset()
+        elif param.name() == 'stages_on':
+            self.stage_timer.enabled = param.value()
+            self.stage_timer.reset()
+        elif param.name() == 'amp_noise':
+            self.configure_controller()
+        elif param.name() == 'replay_path' and self.is_master:
+            self.controller.close()
+            self.set_controller()
+            self.set_axes()
+        elif param.name() == 'loop' and self.controller.replays:
+            self.controller.loop = param.value()
+
+    def set_controller(self):
+        """Simulate the pump states, or replay those of the recording of the replay settings"""
+        if self.settings['replay', 'replay_path'] == '':
+            self.controller = Mock_SingleShot()  # instantiate you driver with whatever arguments are needed
+        else:
+            self.controller = ReplaySimulator(self.settings['replay', 'replay_path'], dataset=None,
+                                              loop=self.settings['replay', 'loop'])
+        self.controller.timer = self.stage_timer
+
+    def configure_controller(self):
+        """Forward the noise amplitude to a controller generating the noise itself (shared simulator process)"""
+        if self.controller.runs_in_process:
+            self.controller.configure(stab_amp_noise=self.settings['amp_noise'])
+
+    def follow_chunk_size(self):
+        """Take the chunk size of the XUV chunks of a simulator process or farm camera shared with the MockCMOS,
+        which produces the stab chunks with them"""
+        if self.controller.runs_in_process and self.settings['chunk_size'] != 2 * self.controller.config['nframes']:
+            self.settings.child('chunk_size').setValue(2 * self.controller.config['nframes'])
+            self.set_axes()
 
     def ini_detector(self, controller=None):
         """Detector communication initialization
@@ -55,9 +111,14 @@ class DAQ_2DViewer_MockStabCamera(DAQ_Viewer_base):
         self.ini_detector_init(slave_controller=controller)
 
         if self.is_master:
-            self.controller = Mock_SingleShot()  # instantiate you driver with whatever arguments are needed
+            self.set_controller()
+        self.beam = get_beam_pointing()  # the one steered by the beam steering actuators of this process
+        self.noise.reseed(self.settings['noise_seed'])
+        self.stage_timer.enabled = self.settings['timing_opts', 'stages_on']
+        self.configure_controller()
 
         self.set_axes()
+        self.follow_chunk_size()
         info = "Whatever info you want to log"
         initialized = True
         return info, initialized
@@ -71,6 +132,8 @@ class DAQ_2DViewer_MockStabCamera(DAQ_Viewer_base):
 
     def close(self):
         """Terminate the communication protocol"""
+        if self.is_master:
+            self.controller.close()
 
     def grab_data(self, Naverage=1, **kwargs):
         """Start a grab from the detector
@@ -83,16 +146,48 @@ class DAQ_2DViewer_MockStabCamera(DAQ_Viewer_base):
         kwargs: dict
             others optionals arguments
         """
-        time.sleep(self.settings["sleep_time"] / 1000)
-        data_tot = self.controller.grab_stab(self.settings["chunk_size"] // 2)
-
-        data_tot += self.settings['amp_noise'] * np.random.random_sample(data_tot.shape)
-
-
-        dfp_list = [DataFromPlugins(name='Camera', data=[data_tot],
-                                            dim='Data2D', labels=['label1'],
-                                            x_axis=self.x_axis, y_axis=self.y_axis)]
-        self.dte_signal.emit(DataToExport('CMOS', data=dfp_list))
+        in_process = self.controller.runs_in_process  # then paced and noised by the simulator process
+        if not in_process:
+            time.sleep(self.settings["sleep_time"] / 1000)
+        if in_process:
+            self.follow_chunk_size()
+        start = time.perf_counter()
+        try:
+            with self.stage_timer.stage('grab'):
+                data_tot = self.controller.grab_stab(self.settings["chunk_size"] // 2)
+        except (TimeoutError, EOFError) as e:
+            self.emit_status(ThreadCommand('Update_Status', [str(e), 'log']))
+            return
+
+        if not in_process:
+            with self.stage_timer.stage('noise'):
+                self.noise.add_uniform(data_tot, self.settings['amp_noise'])  # replays only record the pump states
+            if self.controller.replays:
+                self.settings.child('replay', 'position').setValue(self.controller.position)
+            if self.settings['timing_opts', 'fps_on']:
+                self.fps_meter.add_generation(data_tot.shape[0], time.perf_counter() - start)
+
+
+        with self.stage_timer.stage('data'):
+            camera = data_tot.copy()  # the chunk goes back to the simulator pool, see Mock_SingleShot.release
+            self.controller.release(data_tot)
+            dfp_list = [DataFromPlugins(name='Camera', data=[camera],
+                                        dim='Data2D', labels=['label1'],
+                                        x_axis=self.x_axis, y_axis=self.y_axis)]
+        if self.settings['beam', 'beam_on']:
+            with self.stage_timer.stage('beam'):
+                beam = self.noise.add_uniform(self.beam.render(data_tot.shape[0]), self.settings['amp_noise'])
+                dfp_list.append(DataFromPlugins(name='Beam', data=[beam], dim='Data2D', labels=['Beam']))
+        if self.stage_timer.enabled and self.settings['timing_opts', 'stages_export']:
+            dfp_list.extend(self.stage_timer.to_data(DataFromPlugins))  # as published after the previous emit
+        with self.stage_timer.stage('emit'):
+            self.dte_signal.emit(DataToExport('CMOS', data=dfp_list))
+        if self.stage_timer.enabled:
+            self.stage_timer.publish(self.settings.child('timing_opts'))
+
+        if self.settings['timing_opts', 'fps_on']:
+            self.fps_meter.add_delivery(data_tot.shape[0])
+            self.fps_meter.publish(self.settings.child('timing_opts'))
 
     def stop(self):
         """Stop the current grab hardware wise if necessary"""
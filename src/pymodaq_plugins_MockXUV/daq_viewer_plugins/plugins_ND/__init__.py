@@ -1,13 +1,13 @@
-import importlib
 from pathlib import Path
 from ... import set_logger
+from ...plugin_index import make_lazy_package
 logger = set_logger('viewerND_plugins', add_to_console=False)
 
-for path in Path(__file__).parent.iterdir():
-    try:
-        if '__init__' not in str(path):
-            importlib.import_module('.' + path.stem, __package__)
-    except Exception as e:
-        logger.warning("{:} plugin couldn't be loaded due to some missing packages or errors: {:}".format(path.stem, str(e)))
-        pass
+# the plugin modules are imported on first access only, e.g. by pymodaq once it listed them from path.parent
+path = Path(__file__)
+_index = make_lazy_package(__name__, __file__, logger)
+__getattr__ = _index.getattr
 
+
+def __dir__():
+    return sorted(set(globals()) | set(_index.dir()))
@@ -0,0 +1,76 @@
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Union
+
+import h5py
+import numpy as np
+
+
+class AssetCache:
+    """Process wide cache of the read-only arrays the simulators load from their data files.
+
+    Entries are keyed by file path, modification time and dataset name, so an edited file is read again. Arrays
+    are memory mapped when the file layout allows it (.npy files, contiguous uncompressed HDF5 datasets),
+    otherwise read once; in both cases they are shared by all the callers and flagged read-only. The least
+    recently used entries are evicted above max_entries.
+    """
+
+    def __init__(self, max_entries: int = 16):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def info(self) -> dict:
+        return dict(hits=self.hits, misses=self.misses, entries=len(self._entries), max_entries=self.max_entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get(self, path: Union[str, Path], dataset: str = None) -> np.ndarray:
+        """Get the array stored in the file at path (in its dataset for HDF5 files)"""
+        path = Path(path).resolve()
+        key = (str(path), path.stat().st_mtime_ns, dataset)
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            self.misses += 1
+
+            array = _load(path, dataset)
+            for stale_key in [k for k in self._entries if k[0] == key[0] and k[2] == dataset]:
+                del self._entries[stale_key]
+            self._entries[key] = array
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return array
+
+
+def _load(path: Path, dataset: str = None) -> np.ndarray:
+    if path.suffix == '.npy':
+        array = np.asarray(np.load(path, mmap_mode='r'))
+    else:
+        with h5py.File(path, 'r') as f:
+            dset = f[dataset]
+            offset = dset.id.get_offset()
+            if offset is not None and dset.chunks is None and dset.compression is None:
+                array = np.asarray(np.memmap(path, dtype=dset.dtype, mode='r', offset=offset, shape=dset.shape))
+            else:
+                array = dset[()]
+    array.setflags(write=False)
+    return array
+
+
+asset_cache = AssetCache()
+
+
+def load_asset(path: Union[str, Path], dataset: str = None) -> np.ndarray:
+    """Get a read-only array from the process wide asset cache"""
+    return asset_cache.get(path, dataset)
@@ -0,0 +1,66 @@
+import threading
+
+import numpy as np
+
+from pymodaq_plugins_MockXUV.hardware.noise import NoiseGenerator
+
+
+class BeamPointing:
+    """Pointing of the beam seen by the stabilization camera, steered by a mirror.
+
+    The spot (gaussian of rms waist pixels) sits at the center of the frame of the given shape, moved by a slow
+    random walk (drift pixels rms per chunk), a shot to shot jitter (jitter pixels rms) and the correction of the
+    steering mirror (pixels, see steer). render draws a chunk of shots as a single frame summed over them: the
+    spots are separable, so it is one (ny, nshots) by (nshots, nx) matrix product whatever the number of shots.
+    """
+
+    def __init__(self, shape=(64, 64), waist=4., amplitude=1000., drift=0.05, jitter=0.2, seed: int = None):
+        self.shape = tuple(shape)
+        self.waist = waist
+        self.amplitude = amplitude
+        self.drift = drift
+        self.jitter = jitter
+        self.center = (np.array(self.shape, dtype=float) - 1) / 2
+        self.correction = np.zeros(2)  # (y, x) pixels
+        self.offset = np.zeros(2)  # drift accumulated so far, (y, x) pixels
+        self.noise = NoiseGenerator(seed, name='BeamPointing')
+        self._y = np.arange(self.shape[0], dtype=float)
+        self._x = np.arange(self.shape[1], dtype=float)
+        self._lock = threading.Lock()
+
+    @property
+    def position(self) -> np.ndarray:
+        """Mean (y, x) position of the spot, in pixels"""
+        with self._lock:
+            return self.center + self.offset + self.correction
+
+    def steer(self, axis: int, value: float):
+        """Set the correction of the mirror along axis (0 for y, 1 for x), in pixels"""
+        with self._lock:
+            self.correction[axis] = value
+
+    def positions(self, nshots: int) -> np.ndarray:
+        """(y, x) positions of the spot for the next nshots shots, shape (nshots, 2)"""
+        with self._lock:
+            self.offset += self.noise.gaussian(np.empty(2), self.drift)
+            mean = self.center + self.offset + self.correction
+        return mean + self.noise.gaussian(np.empty((nshots, 2)), self.jitter)
+
+    def render(self, nshots: int, out: np.ndarray = None) -> np.ndarray:
+        """Frame summing the spots of the next nshots shots"""
+        positions = self.positions(nshots)
+        profile_y = np.exp(-0.5 * ((self._y - positions[:, :1]) / self.waist) ** 2)
+        profile_x = np.exp(-0.5 * ((self._x - positions[:, 1:]) / self.waist) ** 2)
+        profile_y *= self.amplitude
+        return np.matmul(profile_y.T, profile_x, out=out)
+
+
+_beam: BeamPointing = None
+
+
+def get_beam_pointing() -> BeamPointing:
+    """The beam shared by the steering actuator and the stabilization camera of the process, created on first use"""
+    global _beam
+    if _beam is None:
+        _beam = BeamPointing()
+    return _beam
@@ -0,0 +1,80 @@
+import queue
+import threading
+import time
+from typing import Any, Callable
+
+
+class ChunkProducer:
+    """Worker thread generating chunks ahead of the consumer into a bounded queue.
+
+    Chunks are produced at most every ``period`` seconds, so the chunk period is the largest of the
+    generation time and the period, not their sum. When the queue is full, the newest chunk is dropped (as a
+    camera overrunning its frame buffer would) and handed to ``on_drop`` so its memory can be recycled.
+    """
+
+    def __init__(self, make_chunk: Callable[[], Any], period: float = 0., depth: int = 2,
+                 on_drop: Callable[[Any], None] = None):
+        self.make_chunk = make_chunk
+        self.period = period
+        self.on_drop = on_drop
+        self.n_produced = 0
+        self.n_dropped = 0
+        self._queue = queue.Queue(maxsize=max(1, depth))
+        self._stop_event = threading.Event()
+        self._thread: threading.Thread = None
+
+    @property
+    def depth(self) -> int:
+        return self._queue.maxsize
+
+    @property
+    def queue_fill(self) -> int:
+        return self._queue.qsize()
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.is_running:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='ChunkProducer', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the worker thread and drop the chunks still in the queue"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        while True:
+            try:
+                chunk = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if self.on_drop is not None:
+                self.on_drop(chunk)
+
+    def get(self, timeout: float = None) -> Any:
+        """Get the oldest produced chunk, raise queue.Empty if none came within timeout"""
+        return self._queue.get(timeout=timeout)
+
+    def _run(self):
+        next_time = time.perf_counter()
+        while not self._stop_event.is_set():
+            chunk = self.make_chunk()
+            self.n_produced += 1
+            try:
+                self._queue.put_nowait(chunk)
+            except queue.Full:
+                self.n_dropped += 1
+                if self.on_drop is not None:
+                    self.on_drop(chunk)
+
+            next_time += self.period
+            delay = next_time - time.perf_counter()
+            if delay > 0:
+                self._stop_event.wait(delay)
+            else:
+                next_time = time.perf_counter()  # running late: do not try to catch up with a burst
@@ -2,15 +2,32 @@ import numpy as np
 from pathlib import Path
 import random
 
+from pymodaq_plugins_MockXUV.hardware.asset_cache import load_asset
+from pymodaq_plugins_MockXUV.hardware.delay_stage import MockDelayStage, TransientResponse
+from pymodaq_plugins_MockXUV.hardware.frame_pool import FramePool
+from pymodaq_plugins_MockXUV.hardware.noise import NoiseGenerator
+from pymodaq_plugins_MockXUV.hardware.sensor_model import SensorModel
+from pymodaq_plugins_MockXUV.instrumentation import StageTimer
+
+
+def resample(profile: np.ndarray, n_pixels: int) -> np.ndarray:
+    """Stretch a profile over n_pixels by linear interpolation"""
+    return np.interp(np.linspace(0, profile.size - 1, n_pixels), np.arange(profile.size), profile)
+
 
 class Mock_SingleShot:
+    runs_in_process = False  # chunks are generated in the caller's process, noise is to be added by the caller
+    replays = False  # chunks are simulated, not read from a recording (see replay.ReplaySimulator)
 
-    def __init__(self, filename='ponoff_transient.npy'):
+    def __init__(self, filename='ponoff_transient.npy', n_buffers=4, dtype=np.float64, n_pixels: int = None):
         self.filename = filename
-        data = np.load(Path(__file__).parent / self.filename)
+        data = load_asset(Path(__file__).parent / self.filename)
 
         self.pon = data[1, :]
         self.poff = data[0, :]
+        if n_pixels is not None and n_pixels != self.pon.size:  # other sensor width, stretch the profiles
+            self.pon = resample(self.pon, n_pixels)
+            self.poff = resample(self.poff, n_pixels)
 
         self.bkg_on = np.ones_like(self.pon) * 4000
         self.bkg_off = np.ones_like(self.poff) * 2000
@@ -20,30 +37,95 @@ class Mock_SingleShot:
 
         self.FirstShotIsPumpOn = random.choice([True, False])
 
-    def grab_XUV(self, nframes, gas_off=False):
-        """Simulate grabbing data from the camera."""
+        self.n_buffers = n_buffers
+        self.dtype = np.dtype(dtype)
+        self._pools = dict(xuv=None, stab=None, adc=None)
+        self.sensor: SensorModel = None
+        self.delay_stage: MockDelayStage = None  # if set, the pump-on spectrum depends on its delay
+        self._transient: TransientResponse = None
+        self._transient_revision = None
+        self.timer = StageTimer()  # disabled, a plugin may replace it by its own
+
+    def _acquire(self, kind: str, shape, dtype=None) -> np.ndarray:
+        """Get a chunk buffer from the pool of this kind, (re)creating the pool if the shape or dtype changed"""
+        dtype = self.dtype if dtype is None else np.dtype(dtype)
+        pool = self._pools[kind]
+        if pool is None or pool.shape != tuple(shape) or pool.dtype != dtype:
+            pool = FramePool(shape, dtype=dtype, n_buffers=self.n_buffers)
+            self._pools[kind] = pool
+        return pool.acquire()
+
+    def release(self, data: np.ndarray):
+        """Give back a chunk returned by grab_XUV or grab_stab so its buffer can be reused: it is not to be used
+        afterwards, so copy what is emitted to asynchronous consumers (see FramePool)"""
+        for pool in self._pools.values():
+            if pool is not None and pool.owns(data):
+                pool.release(data)
+                break
+
+    def close(self):
+        self._pools = dict(xuv=None, stab=None, adc=None)
+
+    def pump_on(self) -> np.ndarray:
+        """Pump-on spectrum at the delay of the followed delay stage (the reference one without stage)"""
+        stage = self.delay_stage
+        if stage is None:
+            return self.pon
+        if self._transient is None or self._transient_revision != stage.revision:
+            self._transient = TransientResponse(self.pon, self.poff, **stage.response)
+            self._transient_revision = stage.revision
+        return self._transient.pon_at(stage.get_value())
+
+    def readout(self, chunk: np.ndarray, noise: NoiseGenerator) -> np.ndarray:
+        """Convert a chunk of simulated light into ADC counts through the sensor model, if any
+
+        The chunk is then released and the counts returned in a pooled integer buffer (to be released in turn).
+        Without sensor model, the chunk is returned as is.
+        """
+        if self.sensor is None:
+            return chunk
+        counts = self._acquire('adc', chunk.shape, self.sensor.dtype)
+        with self.timer.stage('sensor'):
+            self.sensor.apply(chunk, counts, noise)
+        self.release(chunk)
+        return counts
+
+    def grab_XUV(self, nframes, gas_off=False, out: np.ndarray = None):
+        """Simulate grabbing data from the camera.
+
+        The chunk is written in out if given, otherwise in a pooled buffer: call release once done with it.
+        """
         # Simulated data for demonstration purposes
         self.FirstShotIsPumpOn = random.choice([True, False])
 
-        if gas_off:
-            data_oneshot = np.vstack((self.bkg_off, self.bkg_on))
-        else:
-            data_oneshot = np.vstack((self.poff, self.pon))
+        with self.timer.stage('simulation'):
+            if gas_off:
+                first_shot, second_shot = self.bkg_off, self.bkg_on
+            else:
+                first_shot, second_shot = self.poff, self.pump_on()
 
-        if self.FirstShotIsPumpOn:
-            data_oneshot = np.flip(data_oneshot, axis=0)  # flip the data so that the first shot is pump on
+            if self.FirstShotIsPumpOn:
+                first_shot, second_shot = second_shot, first_shot
 
-        data_tot = np.tile(data_oneshot, (nframes, 1))
+            data_tot = self._acquire('xuv', (2 * nframes, len(first_shot))) if out is None else out
+            data_tot[0::2, :] = first_shot
+            data_tot[1::2, :] = second_shot
 
         return data_tot
 
-    def grab_stab(self, nframes):
-        """Simulate grabbing data from the camera."""
+    def grab_stab(self, nframes, out: np.ndarray = None):
+        """Simulate grabbing data from the camera.
+
+        The chunk is written in out if given, otherwise in a pooled buffer: call release once done with it.
+        """
         # Simulated data for demonstration purposes
-        stab_data = np.tile(np.hstack((self.stabpon, self.stabpoff)), nframes).T
-        if not self.FirstShotIsPumpOn:
-            stab_data = np.roll(stab_data, shift=1, axis=0)
+        with self.timer.stage('simulation'):
+            stab_data = self._acquire('stab', (2 * nframes, self.stabpon.shape[0])) if out is None else out
+            if self.FirstShotIsPumpOn:
+                stab_data[0::2, :] = self.stabpon[:, 0]
+                stab_data[1::2, :] = self.stabpoff[:, 0]
+            else:
+                stab_data[0::2, :] = self.stabpoff[:, 0]
+                stab_data[1::2, :] = self.stabpon[:, 0]
 
         return stab_data
-
-
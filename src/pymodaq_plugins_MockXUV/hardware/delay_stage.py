@@ -0,0 +1,129 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from pymodaq_plugins_MockXUV.hardware.hhg_spectrum import shift_spectra
+
+
+def rise_and_decay(delays: np.ndarray, irf: float, tau_decay: float) -> np.ndarray:
+    """Exponential decay of time constant tau_decay starting at zero delay, convolved by a gaussian instrument
+    response of irf rms"""
+    if irf <= 0:
+        return np.where(delays >= 0, np.exp(-np.clip(delays, 0, None) / tau_decay), 0.)
+    erfc = np.frompyfunc(math.erfc, 1, 1)
+    # the exponential grows at negative delays where the erfc vanishes faster: clip it to avoid overflows
+    argument = (irf ** 2 / tau_decay - delays) / (np.sqrt(2) * irf)
+    log_envelope = irf ** 2 / (2 * tau_decay ** 2) - delays / tau_decay
+    return 0.5 * np.exp(np.clip(log_envelope, None, 700)) * erfc(argument).astype(float)
+
+
+class TransientResponse:
+    """Pump-on spectrum of the sample at any pump-probe delay (ps), from a table precomputed on delay nodes.
+
+    dR/R has the spectral shape of the reference transient (pon / poff - 1), it rises with the instrument response
+    (irf ps rms) and decays in tau_decay ps, while its spectral features, shifted by shift pixels at zero delay,
+    relax back in tau_cool ps (hot carriers cooling). The pump-on spectra of the delay nodes are computed once;
+    between nodes they are linearly interpolated, and kept in a LRU cache of cache_size entries since a scan
+    visits the same delays over and over. The returned spectra are read-only and shared.
+    """
+
+    def __init__(self, pon: np.ndarray, poff: np.ndarray, delays: np.ndarray = None, irf=0.1, tau_decay=5.,
+                 tau_cool=0.5, shift=10., cache_size=256):
+        self.delays = np.linspace(-2., 20., 441) if delays is None else np.asarray(delays, dtype=float)
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+
+        shape = np.asarray(pon, dtype=float) / poff - 1
+        shifts = shift * np.exp(-np.clip(self.delays, 0, None) / tau_cool)
+        dR_over_R = shift_spectra(np.broadcast_to(shape, (self.delays.size, shape.size)), shifts)
+        dR_over_R *= rise_and_decay(self.delays, irf, tau_decay)[:, None]
+        self.dR_over_R = dR_over_R
+        self.pon_table = (dR_over_R + 1) * poff
+        self.dR_over_R.setflags(write=False)
+        self.pon_table.setflags(write=False)
+
+    def pon_at(self, delay: float) -> np.ndarray:
+        """Pump-on spectrum at delay (the spectrum of the first or last node outside of the table)"""
+        index = int(np.searchsorted(self.delays, delay, side='right')) - 1
+        if index < 0:
+            return self.pon_table[0]
+        if index >= self.delays.size - 1 or self.delays[index] == delay:
+            return self.pon_table[index]
+
+        key = round(float(delay), 9)
+        pon = self._cache.get(key)
+        if pon is not None:
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return pon
+        self.misses += 1
+        weight = (delay - self.delays[index]) / (self.delays[index + 1] - self.delays[index])
+        pon = self.pon_table[index] * (1 - weight)
+        pon += weight * self.pon_table[index + 1]
+        pon.setflags(write=False)
+        self._cache[key] = pon
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return pon
+
+
+class MockDelayStage:
+    """Pump-probe delay line, its position being the delay (ps) applied to the simulators following it.
+
+    A move lasts its length divided by velocity (ps/s), or is instantaneous with a zero velocity. The sample
+    response (see TransientResponse) is set here too, each change incrementing revision so that the simulators
+    rebuild their table.
+    """
+    units = 'ps'
+
+    def __init__(self, velocity: float = 0.):
+        self.velocity = velocity
+        self.response = dict(irf=0.1, tau_decay=5., tau_cool=0.5, shift=10.)
+        self.revision = 0
+        self._start = 0.
+        self._target = 0.
+        self._start_time = 0.
+        self._lock = threading.Lock()
+
+    def get_value(self) -> float:
+        with self._lock:
+            if self.velocity <= 0:
+                return self._target
+            travelled = (time.perf_counter() - self._start_time) * self.velocity
+            distance = self._target - self._start
+            if travelled >= abs(distance):
+                return self._target
+            return self._start + math.copysign(travelled, distance)
+
+    def move_at(self, delay: float):
+        # an instantaneous move is over, even if the velocity is changed afterwards
+        start = self.get_value() if self.velocity > 0 else delay
+        with self._lock:
+            self._start = start
+            self._target = delay
+            self._start_time = time.perf_counter()
+
+    def stop(self):
+        self.move_at(self.get_value())
+
+    def set_response(self, **response):
+        """Change the parameters of the sample response (irf, tau_decay, tau_cool, shift)"""
+        if any(self.response.get(key) != value for key, value in response.items()):
+            self.response.update(response)
+            self.revision += 1
+
+
+_stage: MockDelayStage = None
+
+
+def get_delay_stage() -> MockDelayStage:
+    """The delay stage shared by the actuator and the detectors of the process, created on first use"""
+    global _stage
+    if _stage is None:
+        _stage = MockDelayStage()
+    return _stage
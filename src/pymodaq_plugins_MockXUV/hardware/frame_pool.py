@@ -0,0 +1,81 @@
+import threading
+from collections import deque
+
+import numpy as np
+
+
+class FramePool:
+    """Set of preallocated chunk buffers recycled between grabs.
+
+    Buffers are handed out by :meth:`acquire` and go back to the end of the free list when the consumer
+    calls :meth:`release`, so a released buffer is only overwritten once all the other free buffers have
+    been used. If the consumer holds more buffers than the pool owns, a new one is allocated (and counted in
+    ``n_allocations``): correctness never depends on the consumer, and the pool allocates nothing in steady state.
+
+    A buffer is overwritten soon after its release, so it must not be given away (emitted in a DataFromPlugins
+    for instance) to consumers that may use it later: give them a copy, then release the buffer. Emitted data
+    are used by the viewer and the extensions for an unknown time, so an emitted frame still costs the
+    allocation of its copy: only the simulation of the chunks is allocation free.
+    """
+
+    def __init__(self, shape, dtype=np.float64, n_buffers=4):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.n_allocations = 0
+        self._lock = threading.Lock()
+        self._owned = {}
+        self._free = deque()
+        for _ in range(n_buffers):
+            self._free.append(self._new_buffer())
+
+    def _new_buffer(self) -> np.ndarray:
+        buffer = np.empty(self.shape, dtype=self.dtype)
+        self._owned[id(buffer)] = buffer
+        self.n_allocations += 1
+        return buffer
+
+    @property
+    def n_buffers(self) -> int:
+        return len(self._owned)
+
+    @property
+    def n_free(self) -> int:
+        return len(self._free)
+
+    def owns(self, array: np.ndarray) -> bool:
+        return id(_root(array)) in self._owned
+
+    def acquire(self) -> np.ndarray:
+        """Get a buffer of the pool shape and dtype, its content is undefined"""
+        with self._lock:
+            if len(self._free) > 0:
+                return self._free.popleft()
+            return self._new_buffer()
+
+    def release(self, array: np.ndarray):
+        """Give back a buffer (or any view of it) obtained from acquire"""
+        buffer = _root(array)
+        with self._lock:
+            if id(buffer) in self._owned and not any(buffer is free for free in self._free):
+                self._free.append(buffer)
+
+
+class WorkArrays:
+    """Work arrays of a computation, kept between calls as long as their shape and dtype do not change"""
+
+    def __init__(self):
+        self._arrays = {}
+
+    def get(self, slot: str, shape, dtype) -> np.ndarray:
+        """The work array of slot, its content is undefined"""
+        array = self._arrays.get(slot)
+        if array is None or array.shape != tuple(shape) or array.dtype != dtype:
+            array = np.empty(shape, dtype=dtype)
+            self._arrays[slot] = array
+        return array
+
+
+def _root(array: np.ndarray) -> np.ndarray:
+    while isinstance(array.base, np.ndarray):
+        array = array.base
+    return array
@@ -0,0 +1,125 @@
+import queue
+import threading
+from pathlib import Path
+from typing import Union
+
+import h5py
+import numpy as np
+
+COMPRESSIONS = ('none', 'lzf', 'gzip')
+
+
+class HDF5StreamWriter:
+    """Streams shot-by-shot data to an HDF5 file from a background thread.
+
+    Each channel (raw frames, pump state flags, dR/R...) is a single extendible dataset, chunked along the shots
+    (about chunk_bytes per HDF5 chunk) and optionally compressed with lzf or gzip, to which the arrays given to
+    append are concatenated along their first axis. append copies the data in a bounded queue and returns, the
+    file being written by the worker thread; it blocks only when the writer lags by more than queue_depth arrays.
+    """
+
+    def __init__(self, path: Union[str, Path], compression: str = None, compression_opts: int = None,
+                 chunk_bytes: int = 2 ** 20, queue_depth: int = 16, attributes: dict = None):
+        if compression == 'none':
+            compression = None
+        if compression not in (None, 'lzf', 'gzip'):
+            raise ValueError(f'Unsupported compression {compression}, should be one of {COMPRESSIONS}')
+        self.path = Path(path)
+        self.compression = compression
+        self.compression_opts = compression_opts
+        self.chunk_bytes = chunk_bytes
+        self.attributes = {} if attributes is None else attributes
+        self.n_rows = {}
+        self.n_queued = {}
+        self.nbytes = 0
+        self.error: Exception = None
+        self._queue = queue.Queue(maxsize=max(1, queue_depth))
+        self._thread: threading.Thread = None
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def queue_fill(self) -> int:
+        return self._queue.qsize()
+
+    def start(self):
+        """Create the file (overwriting an existing one) and start the writer thread"""
+        if self.is_running:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        h5file = h5py.File(self.path, 'w')
+        h5file.attrs.update(self.attributes)
+        self._thread = threading.Thread(target=self._run, args=(h5file,), name='HDF5StreamWriter', daemon=True)
+        self._thread.start()
+
+    def append(self, channel: str, data: np.ndarray, start: int = None):
+        """Queue a copy of data to be appended along the first axis of the channel dataset
+
+        The shape of the rows (data.shape[1:]) and the dtype are fixed by the first append to a channel. With start,
+        data are written from row start of the dataset, the rows skipped since the previous append being filled
+        with NaN (zeros for non float data), so that the rows of a channel not appended at every chunk still line up
+        with those of the others.
+        """
+        self._check_error()
+        if not self.is_running:
+            raise RuntimeError('The HDF5 stream writer is not started')
+        data = np.array(data, copy=True, ndmin=1)
+        queued = self.n_queued.get(channel, 0)
+        if start is not None and start < queued:
+            raise ValueError(f'Row {start} of {channel} is already written')
+        if start is not None and start > queued:
+            self._queue.put((channel, np.full((start - queued,) + data.shape[1:],
+                                              np.nan if data.dtype.kind in 'fc' else 0, dtype=data.dtype)))
+            queued = start
+        self._queue.put((channel, data))
+        self.n_queued[channel] = queued + data.shape[0]
+
+    def flush(self):
+        """Wait for all the queued data to be written"""
+        self._queue.join()
+        self._check_error()
+
+    def close(self):
+        """Write the queued data and close the file"""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        self._check_error()
+
+    def _check_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise RuntimeError(f'Writing to {self.path} failed') from error
+
+    def _run(self, h5file: h5py.File):
+        with h5file:
+            while True:
+                item = self._queue.get()
+                try:
+                    if item is None:
+                        break
+                    if self.error is None:
+                        self._write(h5file, *item)
+                        if self._queue.empty():
+                            h5file.flush()  # idle: make what is written readable
+                except Exception as e:
+                    self.error = e
+                finally:
+                    self._queue.task_done()
+
+    def _write(self, h5file: h5py.File, channel: str, data: np.ndarray):
+        dataset = h5file.get(channel)
+        if dataset is None:
+            row_shape = data.shape[1:]
+            chunk_rows = max(1, self.chunk_bytes // max(1, data[:1].nbytes))
+            dataset = h5file.create_dataset(channel, shape=(0,) + row_shape, maxshape=(None,) + row_shape,
+                                            dtype=data.dtype, chunks=(chunk_rows,) + row_shape,
+                                            compression=self.compression, compression_opts=self.compression_opts)
+        start = dataset.shape[0]
+        dataset.resize(start + data.shape[0], axis=0)
+        dataset[start:] = data
+        self.n_rows[channel] = dataset.shape[0]
+        self.nbytes += data.nbytes
@@ -1,22 +1,120 @@
-import h5py
 from pathlib import Path
 
+import numpy as np
+
+from pymodaq_plugins_MockXUV.hardware.asset_cache import load_asset
+from pymodaq_plugins_MockXUV.hardware.noise import NoiseGenerator
+
+HHG_DATASET = 'Raw_datas/Detector000/Data1D/Ch000/Data'
+
+
+def shift_spectra(spectra: np.ndarray, shifts: np.ndarray) -> np.ndarray:
+    """Shift each row of spectra by its (fractional) number of pixels using linear interpolation
+
+    Row i of the result is spectra[i] evaluated at pixel x - shifts[i], with the edge values repeated outside
+    the detector, as np.interp(x, x + shifts[i], spectra[i]) would do, but for all rows at once.
+    """
+    nshots, npixels = spectra.shape
+    positions = np.arange(npixels) - shifts[:, None]
+    np.clip(positions, 0, npixels - 1, out=positions)
+    lower = positions.astype(np.intp)
+    np.minimum(lower, npixels - 2, out=lower)
+    positions -= lower  # now the fractional part
+
+    rows = np.arange(nshots)[:, None]
+    shifted = spectra[rows, lower + 1]
+    shifted -= spectra[rows, lower]
+    shifted *= positions
+    shifted += spectra[rows, lower]
+    return shifted
+
 
 class HHG_Spectrum:
+    """Single shot HHG spectrometer replaying a recorded spectrum.
+
+    The spectrum is the vertical sum of the rows of a sensor, on which the beam has a gaussian vertical profile.
+    A region of interest and a horizontal binning can be set, they are applied to the reference spectrum once so
+    the work done at each grab scales with the region of interest. Without region of interest the whole sensor is
+    read and the recorded spectrum is returned as is.
+    """
+    sensor_height = 256
+    beam_center = 131.7  # row
+    beam_width = 12.  # rows, standard deviation
+    dark_level = 100.  # counts of a pixel out of the beam
+
     def __init__(self, filename='HHG_20240402_Numerobis.h5'):
         self.filename = filename
 
-        with h5py.File(Path(__file__).parent / filename, 'r') as f:
-            data = f["Raw_datas"]["Detector000"]["Data1D"]["Ch000"]["Data"][()]
+        data = load_asset(Path(__file__).parent / filename, HHG_DATASET)
 
         self.data = data
 
+        rows = np.arange(self.sensor_height)
+        self.vertical_profile = np.exp(-0.5 * ((rows - self.beam_center) / self.beam_width) ** 2)
+        self.vertical_profile /= self.vertical_profile.sum()
+        self._vertical_center: float = None
+
+        self.roi = None
+        self.roi_data = data
+        self.pixels = np.arange(data.size, dtype=float)
+
+    def read_vertical_profile(self, noise: NoiseGenerator, amp_noise: float = 0.) -> np.ndarray:
+        """Simulate a full sensor frame summed along each row: the vertical profile of the beam on the dark level,
+        with the white noise of amplitude amp_noise of each pixel"""
+        profile = self.vertical_profile * self.data.sum()
+        profile += (self.dark_level + amp_noise / 2) * self.data.size
+        return noise.add_gaussian(profile, amp_noise * np.sqrt(self.data.size / 12))  # sums of uniform noises
+
+    def find_vertical_center(self, noise: NoiseGenerator = None, amp_noise: float = 0.) -> float:
+        """Row of the centre of the beam on the sensor, computed on first call only by a gaussian fit (a parabola
+        fitted to the logarithm) of the rows of a vertical profile readout above half its maximum, once its
+        background (the median row) removed"""
+        if self._vertical_center is None:
+            profile = self.read_vertical_profile(NoiseGenerator() if noise is None else noise, amp_noise)
+            profile -= np.median(profile)
+            rows = np.flatnonzero(profile >= profile.max() / 2)
+            curvature, slope, _ = np.polyfit(rows, np.log(profile[rows]), 2)
+            self._vertical_center = float(np.clip(-slope / (2 * curvature), 0, self.sensor_height - 1))
+        return self._vertical_center
+
+    def set_roi(self, left: int, width: int, bottom: int, height: int, binning: int = 1):
+        """Restrict the sensor readout to a region of interest, binned horizontally by binning pixels"""
+        left = int(np.clip(left, 0, self.data.size - 2 * binning))
+        width = int(np.clip(width, 2 * binning, self.data.size - left))
+        width -= width % binning
+        bottom = int(np.clip(bottom, 0, self.sensor_height - 1))
+        height = int(np.clip(height, 1, self.sensor_height - bottom))
+        self.roi = dict(left=left, width=width, bottom=bottom, height=height, binning=binning)
+
+        vertical_gain = self.vertical_profile[bottom:bottom + height].sum()
+        roi_data = self.data[left:left + width] * vertical_gain
+        self.roi_data = roi_data.reshape((-1, binning)).sum(axis=1)
+        self.pixels = left + binning * np.arange(self.roi_data.size) + (binning - 1) / 2
+
+    def clear_roi(self):
+        self.roi = None
+        self.roi_data = self.data
+        self.pixels = np.arange(self.data.size, dtype=float)
+
+    def grab_spectra(self, nshots: int, noise: NoiseGenerator, amp_noise: float = 0.,
+                     shift_noise: float = 0.) -> np.ndarray:
+        """Simulate nshots spectra, each with its own white noise and random pixel shift, as a (nshots, npixels)
+        array, npixels being the size of the region of interest"""
+        spectra = np.empty((nshots, self.roi_data.size))
+        spectra[:] = self.roi_data
+        noise.add_uniform(spectra, amp_noise)
+        if shift_noise == 0:
+            return spectra
+        shifts = noise.gaussian(np.empty(nshots), shift_noise)
+        if self.roi is not None:
+            shifts /= self.roi['binning']
+        return shift_spectra(spectra, shifts)
+
 
 class My_Controller_Class:
     def __init__(self, filename='HHG_20240402_Numerobis.h5'):
         self.filename = filename
 
-        with h5py.File(Path(__file__).parent / filename, 'r') as f:
-            data = f["Raw_datas"]["Detector000"]["Data1D"]["Ch000"]["Data"][()]
+        data = load_asset(Path(__file__).parent / filename, HHG_DATASET)
 
-        self.data = data
\ No newline at end of file
+        self.data = data
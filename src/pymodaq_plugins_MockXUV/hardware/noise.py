@@ -0,0 +1,107 @@
+import zlib
+
+import numpy as np
+
+from pymodaq_plugins_MockXUV.hardware.frame_pool import WorkArrays
+
+
+class NoiseGenerator:
+    """Seedable noise stream of one mock detector, built on numpy's Generator.
+
+    Noise is written in place in the arrays given by the caller, in their dtype (so float32 chunks get
+    float32 noise), using work arrays kept between calls. A given (seed, name) couple always gives the same
+    stream, so two detectors seeded alike still get independent noise.
+    """
+    drift_block = 2 ** 16  # number of shots of 1/f drift generated at once
+    exact_poisson_below = 20.  # mean number of counts under which shot noise is not approximated as gaussian
+
+    def __init__(self, seed: int = None, name: str = ''):
+        self.name = name
+        self.rng: np.random.Generator = None
+        self._work = WorkArrays()
+        self._drift = np.empty(0)
+        self._drift_index = 0
+        self.reseed(seed)
+
+    def reseed(self, seed: int = None):
+        """Restart the stream, a None or negative seed gives a non reproducible stream"""
+        if seed is None or seed < 0:
+            self.rng = np.random.default_rng()
+        else:
+            self.rng = np.random.default_rng([seed, zlib.crc32(self.name.encode())])
+        self._drift = np.empty(0)
+        self._drift_index = 0
+
+    def uniform(self, out: np.ndarray, amplitude: float = 1.) -> np.ndarray:
+        """Fill out with noise uniformly distributed in [0, amplitude)"""
+        self.rng.random(out=out, dtype=out.dtype)
+        out *= amplitude
+        return out
+
+    def gaussian(self, out: np.ndarray, sigma: float = 1.) -> np.ndarray:
+        """Fill out with centered gaussian noise of standard deviation sigma"""
+        self.rng.standard_normal(out=out, dtype=out.dtype)
+        out *= sigma
+        return out
+
+    def add_uniform(self, data: np.ndarray, amplitude: float) -> np.ndarray:
+        if amplitude != 0:
+            data += self.uniform(self._work.get('noise', data.shape, data.dtype), amplitude)
+        return data
+
+    def add_gaussian(self, data: np.ndarray, sigma: float) -> np.ndarray:
+        if sigma != 0:
+            data += self.gaussian(self._work.get('noise', data.shape, data.dtype), sigma)
+        return data
+
+    def add_shot_noise(self, data: np.ndarray, gain: float = 1.) -> np.ndarray:
+        """Apply Poisson statistics to data expressed in counts of gain units (ADU per photoelectron)
+
+        Above exact_poisson_below photoelectrons on every pixel the gaussian limit is used, computed in place,
+        otherwise exact Poisson draws are done (which allocate).
+        """
+        if data.min() / gain >= self.exact_poisson_below:
+            sigma = self._work.get('sigma', data.shape, data.dtype)
+            np.multiply(data, gain, out=sigma)
+            np.sqrt(sigma, out=sigma)
+            sigma *= self.gaussian(self._work.get('noise', data.shape, data.dtype))
+            data += sigma
+        else:
+            electrons = np.clip(data / gain, 0, None)
+            np.multiply(self.rng.poisson(electrons), gain, out=data, casting='unsafe')
+        return data
+
+    def drift(self, out: np.ndarray, amplitude: float = 1.) -> np.ndarray:
+        """Fill the 1D array out with the next values of a 1/f (pink) noise of standard deviation amplitude
+
+        The stream is continuous from one call to the next (one value per shot), it is generated by blocks of
+        drift_block shots by shaping white noise in Fourier space.
+        """
+        filled = 0
+        while filled < out.size:
+            if self._drift_index >= self._drift.size:
+                self._drift = self._pink_block(self.drift_block)
+                self._drift_index = 0
+            n = min(out.size - filled, self._drift.size - self._drift_index)
+            out[filled:filled + n] = self._drift[self._drift_index:self._drift_index + n]
+            self._drift_index += n
+            filled += n
+        out *= amplitude
+        return out
+
+    def apply_drift(self, data: np.ndarray, amplitude: float) -> np.ndarray:
+        """Multiply each shot (row) of data by one plus the next value of the 1/f drift"""
+        if amplitude != 0:
+            gain = self.drift(self._work.get('drift', data.shape[:1], data.dtype), amplitude)
+            gain += 1
+            data *= gain[:, None]
+        return data
+
+    def _pink_block(self, size: int) -> np.ndarray:
+        spectrum = np.fft.rfft(self.rng.standard_normal(size))
+        frequencies = np.fft.rfftfreq(size)
+        spectrum[0] = 0.
+        spectrum[1:] /= np.sqrt(frequencies[1:])
+        block = np.fft.irfft(spectrum, size)
+        block /= block.std()
+        return block
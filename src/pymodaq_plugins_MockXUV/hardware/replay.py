@@ -0,0 +1,264 @@
+import queue
+import threading
+from pathlib import Path
+from typing import Union
+
+import h5py
+import numpy as np
+
+from pymodaq_plugins_MockXUV.hardware.cmos_simulator import Mock_SingleShot
+
+REPLAY_SUFFIXES = ('.npy', '.h5', '.hdf5')
+
+
+class _Block:
+    """Shots start to start + n_shots of a recording, read ahead in preallocated buffers"""
+
+    def __init__(self, block_shots: int, row_shape, dtype):
+        self.rows = None if row_shape is None else np.empty((block_shots,) + tuple(row_shape), dtype=dtype)
+        self.pump_on = np.empty(block_shots, dtype=bool)
+        self.start = 0
+        self.n_shots = 0
+        self.generation = 0
+
+
+class ReplaySimulator(Mock_SingleShot):
+    """Controller serving the shots of a recording (as written by the MockCMOS stream) instead of simulating them.
+
+    The recording is a (nshots, npixels) dataset of an HDF5 file (dataset, read by chunks) or a .npy file (memory
+    mapped), so it may be far bigger than the memory. The pump state of each shot is read from the pump_dataset of
+    the HDF5 file, otherwise the shots alternate, starting with a pump-on one if first_is_on.
+
+    A reader thread reads the recording ahead of the grabs, by blocks of block_shots (about block_bytes, rounded to
+    the HDF5 chunks) into prefetch + 2 preallocated blocks: the memory used does not depend on the recording size.
+    Once at its end, the replay restarts from the first shot if loop, otherwise the grabs raise EOFError. seek
+    moves the replay to any shot. With dataset None, only the pump states are read (see grab_stab).
+
+    The shots are replayed by pump-on/pump-off pairs, reordered in each chunk so that they all start with the
+    pump state of its first shot (FirstShotIsPumpOn), as in the simulated chunks.
+    """
+    runs_in_process = False  # chunks are read in the caller's process, but they are not to be noised
+    replays = True
+
+    def __init__(self, path: Union[str, Path], dataset: str = 'raw', pump_dataset: str = 'pump_on',
+                 first_is_on: bool = True, loop: bool = True, block_bytes: int = 2 ** 22, prefetch: int = 4,
+                 timeout: float = 5., n_buffers: int = 4, dtype=np.float64):
+        super().__init__(n_buffers=n_buffers, dtype=dtype)
+        self.path = Path(path)
+        self.loop = loop
+        self.timeout = timeout
+        self.n_underruns = 0  # grabs that had to wait for the reader thread
+        self.n_loops = 0
+        self._h5file: h5py.File = None
+        self._shots, self._pump_on = self._open(dataset, pump_dataset)
+        self.n_shots = self._n_shots_of(dataset, first_is_on)
+        self._first_is_on = first_is_on
+
+        row_shape = None if self._shots is None else self._shots.shape[1:]
+        row_bytes = 1 if self._shots is None else max(1, self._shots[:1].nbytes)
+        block_shots = max(2, min(self.n_shots, block_bytes // row_bytes))
+        chunks = None if self._shots is None else getattr(self._shots, 'chunks', None)
+        if chunks is not None and block_shots > chunks[0]:
+            block_shots -= block_shots % chunks[0]  # read whole HDF5 chunks
+        self.block_shots = block_shots - block_shots % 2
+        self._free = queue.Queue()
+        for _ in range(prefetch + 2):
+            self._free.put(_Block(self.block_shots, row_shape, None if self._shots is None else self._shots.dtype))
+        self._filled = queue.Queue()
+        self._block: _Block = None  # block being replayed
+        self._offset = 0  # next shot to replay in it
+        self._generation = 0
+        self._next_read = 0
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+        self._set_references()
+        self._thread = threading.Thread(target=self._run, name='ReplayReader', daemon=True)
+        self._thread.start()
+
+    def _open(self, dataset: str, pump_dataset: str):
+        if self.path.suffix == '.npy':
+            shots = None if dataset is None else np.load(self.path, mmap_mode='r')
+            return shots, None
+        if self.path.suffix not in REPLAY_SUFFIXES:
+            raise ValueError(f'Cannot replay {self.path}, the recording should be one of {REPLAY_SUFFIXES} files')
+        self._h5file = h5py.File(self.path, 'r')
+        shots = None if dataset is None else self._h5file[dataset]
+        pump_on = self._h5file.get(pump_dataset) if pump_dataset is not None else None
+        return shots, pump_on
+
+    def _n_shots_of(self, dataset: str, first_is_on: bool) -> int:
+        if self._shots is not None and self._shots.ndim != 2:
+            raise ValueError(f'{dataset} of {self.path} should be a (nshots, npixels) array, not {self._shots.shape}')
+        if self._shots is None and self._pump_on is None:
+            raise ValueError(f'No pump states in {self.path} to replay')
+        n_shots = min(array.shape[0] for array in (self._shots, self._pump_on) if array is not None)
+        if n_shots < 2:
+            raise ValueError(f'{self.path} does not hold a single pump-on/pump-off pair of shots')
+        return n_shots - n_shots % 2  # whole pairs only, so that a looping replay keeps the pairs
+
+    def _set_references(self):
+        """Average pump-on and pump-off shots of the first block, as the pon and poff of the simulators"""
+        block = _Block(self.block_shots, None if self._shots is None else self._shots.shape[1:],
+                       None if self._shots is None else self._shots.dtype)
+        self._read(block, 0)
+        if self._shots is None:
+            self.pon, self.poff = self.stabpon[:, 0].copy(), self.stabpoff[:, 0].copy()
+        else:
+            rows, pump_on = block.rows[:block.n_shots], block.pump_on[:block.n_shots]
+            self.pon = rows[pump_on].mean(axis=0)
+            self.poff = rows[~pump_on].mean(axis=0)
+        self.FirstShotIsPumpOn = bool(block.pump_on[0])
+
+    @property
+    def position(self) -> int:
+        """Index of the next shot to be replayed"""
+        if self._block is None:
+            with self._lock:
+                return self._next_read if self._filled.empty() else self._filled.queue[0].start
+        return self._block.start + self._offset
+
+    @property
+    def queue_fill(self) -> int:
+        """Number of blocks read ahead"""
+        return self._filled.qsize()
+
+    def seek(self, shot: int):
+        """Replay from shot (rounded down to a pump-on/pump-off pair) onwards"""
+        shot = int(np.clip(shot, 0, self.n_shots - 2))
+        with self._lock:
+            self._generation += 1
+            self._next_read = shot - shot % 2
+        self._recycle(self._block)
+        self._block = None
+        while True:
+            try:
+                self._recycle(self._filled.get_nowait())
+            except queue.Empty:
+                break
+
+    def close(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._h5file is not None:
+            self._h5file.close()
+            self._h5file = None
+        super().close()
+
+    def _recycle(self, block: _Block):
+        if block is not None:
+            self._free.put(block)
+
+    def _read(self, block: _Block, start: int):
+        """Read the shots of the recording from start into block"""
+        stop = min(start + self.block_shots, self.n_shots)
+        n_shots = stop - start
+        if self._shots is not None:
+            if isinstance(self._shots, h5py.Dataset):
+                self._shots.read_direct(block.rows, np.s_[start:stop], np.s_[:n_shots])
+            else:
+                block.rows[:n_shots] = self._shots[start:stop]
+        if self._pump_on is not None:
+            self._pump_on.read_direct(block.pump_on, np.s_[start:stop], np.s_[:n_shots])
+        else:
+            block.pump_on[0:n_shots:2] = self._first_is_on
+            block.pump_on[1:n_shots:2] = not self._first_is_on
+        block.start = start
+        block.n_shots = n_shots
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                block = self._free.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            with self._lock:
+                generation, start = self._generation, self._next_read
+            if start >= self.n_shots and not self.loop:
+                self._free.put(block)
+                self._stop_event.wait(0.01)  # at the end: wait for a seek
+                continue
+            start = start % self.n_shots
+            self._read(block, start)
+            block.generation = generation
+            with self._lock:
+                if generation != self._generation:  # seek during the read
+                    self._free.put(block)
+                    continue
+                self._next_read = start + block.n_shots
+                self._filled.put(block)
+
+    def _next_block(self) -> _Block:
+        """The next block read ahead, blocks read before the last seek being dropped"""
+        while True:
+            if self._filled.empty():
+                with self._lock:
+                    at_end = self._next_read >= self.n_shots and not self.loop
+                if at_end and self._filled.empty():
+                    raise EOFError(f'End of the replay of {self.path}')
+                self.n_underruns += 1
+            try:
+                block = self._filled.get(timeout=self.timeout)
+            except queue.Empty:
+                raise TimeoutError(f'No shot read from {self.path} within {self.timeout} s') from None
+            if block.generation == self._generation:
+                if block.start == 0 and self._block is not None:
+                    self.n_loops += 1
+                return block
+            self._recycle(block)
+
+    def _replay(self, n_shots: int, rows: np.ndarray = None) -> np.ndarray:
+        """Copy the next n_shots shots in rows (if given) and return their pump states"""
+        pump_on = np.empty(n_shots, dtype=bool)
+        done = 0
+        while done < n_shots:
+            if self._block is None or self._offset == self._block.n_shots:
+                block = self._next_block()
+                self._recycle(self._block)
+                self._block, self._offset = block, 0
+            n = min(n_shots - done, self._block.n_shots - self._offset)
+            if rows is not None:
+                rows[done:done + n] = self._block.rows[self._offset:self._offset + n]
+            pump_on[done:done + n] = self._block.pump_on[self._offset:self._offset + n]
+            self._offset += n
+            done += n
+        self.FirstShotIsPumpOn = bool(pump_on[0])
+        if rows is not None:
+            # pairs recorded in the other order (chunks of the recording starting with the other state): swap them
+            swapped = np.flatnonzero(pump_on[0::2] != self.FirstShotIsPumpOn) * 2
+            if swapped.size > 0:
+                first = rows[swapped]
+                rows[swapped] = rows[swapped + 1]
+                rows[swapped + 1] = first
+        return pump_on
+
+    def grab_XUV(self, nframes, gas_off=False, out: np.ndarray = None):
+        """Replay the next nframes pairs of shots (gas_off has no effect on a recording).
+
+        The chunk is written in out if given, otherwise in a pooled buffer: call release once done with it.
+        """
+        if self._shots is None:
+            raise ValueError(f'No shots replayed from {self.path}, only their pump states')
+        data_tot = self._acquire('xuv', (2 * nframes, self._shots.shape[1])) if out is None else out
+        with self.timer.stage('replay'):
+            self._replay(2 * nframes, data_tot)
+        return data_tot
+
+    def grab_stab(self, nframes, out: np.ndarray = None):
+        """Rows of the stabilization camera following the pump states of the shots replayed.
+
+        When the camera shots are replayed (grab_XUV), the rows follow the pump states of the last chunk of grab_XUV
+        as with the simulator, so that a stabilization camera sharing the controller does not take shots from the
+        camera. When only the pump states are replayed, the rows follow those of the next nframes pairs of shots.
+        The chunk is written in out if given, otherwise in a pooled buffer: call release once done with it.
+        """
+        if self._shots is not None:
+            return super().grab_stab(nframes, out)
+        stab_data = self._acquire('stab', (2 * nframes, self.stabpon.shape[0])) if out is None else out
+        with self.timer.stage('replay'):
+            pump_on = self._replay(2 * nframes)
+            stab_data[pump_on, :] = self.stabpon[:, 0]
+            stab_data[~pump_on, :] = self.stabpoff[:, 0]
+        return stab_data
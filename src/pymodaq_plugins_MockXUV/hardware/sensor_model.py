@@ -0,0 +1,84 @@
+import numpy as np
+
+from pymodaq_plugins_MockXUV.hardware.frame_pool import WorkArrays
+from pymodaq_plugins_MockXUV.hardware.noise import NoiseGenerator
+
+
+class SensorModel:
+    """Physics of a CMOS sensor turning the simulated light of each shot into 16 bits ADC counts.
+
+    The signal (simulated counts, electrons_per_count photoelectrons each) goes through, in that order: the dark
+    current of the hot pixels, Poisson shot noise, the per-pixel gain map (gain ADU per electron with a prnu
+    relative spread), gaussian read noise (read_noise electrons rms), saturation at full_well electrons, the
+    per-pixel offset map (offset ADU with an offset_spread rms) and the ADC (rounding and clipping to its bits).
+
+    The gain, offset and hot pixel maps (shape pixel_shape, that of one shot) are drawn once from pattern_seed,
+    as the fixed pattern of a given sensor. apply works in place in the float chunk it is given, then writes the
+    counts in an integer array, so a frame costs a few passes on the data and no allocation.
+    """
+
+    def __init__(self, pixel_shape, electrons_per_count=0.25, gain=1., prnu=0.01, read_noise=2., offset=100.,
+                 offset_spread=2., hot_fraction=1e-3, hot_electrons=2000., full_well=50000., bits=16,
+                 pattern_seed=0):
+        self.pixel_shape = tuple(np.atleast_1d(pixel_shape))
+        self.electrons_per_count = electrons_per_count
+        self.gain = gain
+        self.read_noise = read_noise
+        self.full_well = full_well
+        self.bits = bits
+        self.adc_max = 2 ** bits - 1
+        self.dtype = np.uint8 if bits <= 8 else np.uint16 if bits <= 16 else np.uint32
+
+        pattern = NoiseGenerator(pattern_seed, name='SensorModel')
+        self.gain_map = pattern.gaussian(np.empty(self.pixel_shape), prnu)
+        self.gain_map += 1
+        self.gain_map *= gain
+        self.offset_map = pattern.gaussian(np.empty(self.pixel_shape), offset_spread)
+        self.offset_map += offset
+        n_pixels = int(np.prod(self.pixel_shape))
+        hot_pixels = np.sort(pattern.rng.choice(n_pixels, size=int(round(hot_fraction * n_pixels)), replace=False))
+        self.hot_pixels = (slice(None),) + np.unravel_index(hot_pixels, self.pixel_shape)  # in a chunk of shots
+        self.hot_dark = pattern.rng.exponential(hot_electrons, size=hot_pixels.size)
+        self._maps_cache = {}
+        self._work = WorkArrays()
+
+    def _maps(self, dtype) -> dict:
+        """The maps used by apply, in the dtype of the chunks"""
+        maps = self._maps_cache.get(np.dtype(dtype))
+        if maps is None:
+            maps = dict(gain=self.gain_map, gain_squared=self.gain_map ** 2, offset=self.offset_map,
+                        saturation=self.full_well * self.gain_map)
+            maps = {name: array.astype(dtype) for name, array in maps.items()}
+            self._maps_cache[np.dtype(dtype)] = maps
+        return maps
+
+    def apply(self, signal: np.ndarray, out: np.ndarray, noise: NoiseGenerator) -> np.ndarray:
+        """Read out a chunk of shots (shape (nshots,) + pixel_shape) of simulated signal into out (the ADC
+        counts, of an integer dtype), signal being overwritten on the way"""
+        if signal.shape[1:] != self.pixel_shape:
+            raise ValueError(f'Shots of shape {signal.shape[1:]} given to a sensor of shape {self.pixel_shape}')
+        maps = self._maps(signal.dtype)
+        signal *= self.electrons_per_count
+        if self.hot_dark.size > 0:
+            signal[self.hot_pixels] += self.hot_dark
+
+        if signal.min() >= noise.exact_poisson_below:
+            # shot and read noises summed in a single gaussian draw, of variance gain² (electrons + read_noise²)
+            sigma = self._work.get('sigma', signal.shape, signal.dtype)
+            np.multiply(signal, maps['gain_squared'], out=sigma)
+            sigma += (self.read_noise * self.gain) ** 2
+            np.sqrt(sigma, out=sigma)
+            sigma *= noise.gaussian(self._work.get('noise', signal.shape, signal.dtype))
+            signal *= maps['gain']
+            signal += sigma
+        else:
+            noise.add_shot_noise(signal)
+            signal *= maps['gain']
+            noise.add_gaussian(signal, self.read_noise * self.gain)
+
+        np.minimum(signal, maps['saturation'], out=signal)
+        signal += maps['offset']
+        np.clip(signal, 0, self.adc_max, out=signal)
+        np.rint(signal, out=signal)
+        np.copyto(out, signal, casting='unsafe')
+        return out
@@ -0,0 +1,253 @@
+import multiprocessing
+import queue
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from pymodaq_plugins_MockXUV.hardware.cmos_simulator import Mock_SingleShot
+from pymodaq_plugins_MockXUV.hardware.noise import NoiseGenerator
+
+
+class SharedFrameRing:
+    """Slots of a fixed shape allocated in a shared memory block and handed between processes by index.
+
+    Slot indexes circulate in two queues: free (owned by the producer) and ready (descriptors of filled slots,
+    owned by the consumer), so the frames themselves never get pickled nor copied. With a None context, the
+    queues are not created and the slot indexes are to be exchanged by the caller.
+    """
+
+    def __init__(self, n_slots: int, slot_shape, dtype=np.float64, context=multiprocessing):
+        self.n_slots = n_slots
+        self.slot_shape = tuple(slot_shape)
+        self.dtype = np.dtype(dtype)
+        nbytes = max(1, n_slots * int(np.prod(self.slot_shape)) * self.dtype.itemsize)
+        self.shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        self.free = None
+        self.ready = None
+        if context is not None:
+            self.free = context.Queue()
+            self.ready = context.Queue()
+            for slot in range(n_slots):
+                self.free.put(slot)
+        self.slots = self._map(self.shm)
+
+    def _map(self, shm: shared_memory.SharedMemory) -> np.ndarray:
+        return np.ndarray((self.n_slots,) + self.slot_shape, dtype=self.dtype, buffer=shm.buf)
+
+    @property
+    def spec(self) -> dict:
+        """What a child process needs to attach to the ring"""
+        return dict(name=self.shm.name, n_slots=self.n_slots, slot_shape=self.slot_shape, dtype=self.dtype.str,
+                    free=self.free, ready=self.ready)
+
+    def slot_of(self, array: np.ndarray) -> int:
+        """Index of the slot holding array (or a view of it), None if array is not in this ring"""
+        address = array.__array_interface__['data'][0]
+        start = self.slots.__array_interface__['data'][0]
+        offset = address - start
+        if 0 <= offset < self.slots.nbytes:
+            return offset // self.slots[0].nbytes
+        return None
+
+    def close(self):
+        self.slots = None
+        try:
+            self.shm.close()
+        except BufferError:
+            pass  # frames still referenced by a consumer, the mapping goes away with them
+        self.shm.unlink()
+
+
+def _attach(spec: dict):
+    # the child process shares the resource tracker of its parent, which creates and unlinks the memory
+    shm = shared_memory.SharedMemory(name=spec['name'])
+    slots = np.ndarray((spec['n_slots'],) + tuple(spec['slot_shape']), dtype=np.dtype(spec['dtype']),
+                       buffer=shm.buf)
+    return shm, slots
+
+
+def _serve(specs: dict, control, stop_event, config: dict):
+    """Simulator process: fill the free slots of each ring with noisy chunks at the configured period"""
+    attached = {kind: _attach(spec) for kind, spec in specs.items()}
+    simulator = Mock_SingleShot()
+    noises = dict(xuv=NoiseGenerator(name='MockCMOS'), stab=NoiseGenerator(name='MockStabCamera'))
+    dropped = dict(xuv=0, stab=0)
+    sequence = 0
+    next_time = time.perf_counter()
+
+    def apply(new_config: dict):
+        if 'seed' in new_config:
+            for noise in noises.values():
+                noise.reseed(new_config['seed'])
+        config.update(new_config)
+
+    apply(dict(config))
+    try:
+        while not stop_event.is_set():
+            while True:
+                try:
+                    apply(control.get_nowait())
+                except queue.Empty:
+                    break
+            nframes = config['nframes']
+            for kind, (shm, slots) in attached.items():
+                try:
+                    slot = specs[kind]['free'].get_nowait()
+                except queue.Empty:
+                    dropped[kind] += 1
+                    continue
+                chunk = slots[slot, :2 * nframes]
+                if kind == 'xuv':
+                    simulator.grab_XUV(nframes, gas_off=config['gas_off'], out=chunk)
+                    noises[kind].apply_drift(chunk, config['amp_drift'])
+                    noises[kind].add_uniform(chunk, config['amp_noise'])
+                else:
+                    simulator.grab_stab(nframes, out=chunk)
+                    noises[kind].add_uniform(chunk, config['stab_amp_noise'])
+                specs[kind]['ready'].put(dict(sequence=sequence, slot=slot, rows=2 * nframes,
+                                              first_is_on=simulator.FirstShotIsPumpOn, dropped=dropped[kind],
+                                              gas_off=config['gas_off'], time=time.time()))
+            sequence += 1
+
+            next_time += config['period']
+            delay = next_time - time.perf_counter()
+            if delay > 0:
+                stop_event.wait(delay)
+            else:
+                next_time = time.perf_counter()
+    finally:
+        for shm, slots in attached.values():
+            del slots
+            shm.close()
+
+
+class SharedMemorySimulator:
+    """Controller running a Mock_SingleShot in its own process, with the same grab/release interface.
+
+    Chunks (noise included) are written by the simulator process in shared memory rings, the grab methods return
+    numpy views on the ring slots, without any copy nor pickling; release gives the slot back to the simulator.
+    When the consumer is too slow, the simulator drops chunks (counted in dropped) rather than blocking. It can be
+    shared by the MockCMOS (XUV chunks) and MockStabCamera (stab chunks) plugins, giving consistent pump states.
+    """
+    runs_in_process = True
+    replays = False
+
+    def __init__(self, nframes=50, n_slots=4, dtype=np.float64, timeout=30., **config):
+        reference = Mock_SingleShot()
+        self.pon = reference.pon
+        self.poff = reference.poff
+        self.stabpon = reference.stabpon
+        self.stabpoff = reference.stabpoff
+        self.FirstShotIsPumpOn = reference.FirstShotIsPumpOn
+
+        self.n_slots = n_slots
+        self._dtype = np.dtype(dtype)
+        self.timeout = timeout
+        self.config = dict(nframes=nframes, gas_off=False, amp_noise=0., amp_drift=0., stab_amp_noise=0.,
+                           seed=-1, period=0.)
+        self.config.update(config)
+        self.dropped = dict(xuv=0, stab=0)
+        self._context = multiprocessing.get_context('spawn')
+        self._rings: dict = None
+        self._process = None
+        self._control = None
+        self._stop_event = None
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self._dtype
+
+    @dtype.setter
+    def dtype(self, dtype):
+        if np.dtype(dtype) != self._dtype:
+            self.close()  # the rings are created again in the new dtype at next grab
+            self._dtype = np.dtype(dtype)
+
+    @property
+    def is_running(self) -> bool:
+        return self._process is not None and self._process.is_alive()
+
+    def start(self):
+        if self.is_running:
+            return
+        nframes = self.config['nframes']
+        if self._rings is not None:
+            self.close()
+        self._rings = dict(xuv=SharedFrameRing(self.n_slots, (2 * nframes, self.pon.size), self._dtype,
+                                               self._context),
+                           stab=SharedFrameRing(self.n_slots, (2 * nframes, self.stabpon.shape[0]), self._dtype,
+                                                self._context))
+        self._control = self._context.Queue()
+        self._stop_event = self._context.Event()
+        self._process = self._context.Process(target=_serve, name='MockXUVSimulator', daemon=True,
+                                              args=({kind: ring.spec for kind, ring in self._rings.items()},
+                                                    self._control, self._stop_event, dict(self.config)))
+        self._process.start()
+
+    def close(self):
+        """Stop the simulator process and free the shared memory"""
+        if self._process is not None:
+            self._stop_event.set()
+            self._process.join(self.timeout)
+            if self._process.is_alive():
+                self._process.terminate()
+            self._process = None
+        if self._rings is not None:
+            for ring in self._rings.values():
+                ring.close()
+            self._rings = None
+
+    def configure(self, **config):
+        """Update the simulation settings (nframes, gas_off, amp_noise, amp_drift, stab_amp_noise, seed,
+        period), restarting the process only if the rings must be resized"""
+        changes = {key: value for key, value in config.items() if self.config.get(key) != value}
+        if len(changes) == 0:
+            return
+        self.config.update(changes)
+        if 'nframes' in changes and self._rings is not None \
+                and 2 * changes['nframes'] > self._rings['xuv'].slot_shape[0]:
+            self.close()
+        elif self.is_running:
+            self._control.put(changes)
+
+    def _grab(self, kind: str, nframes: int) -> np.ndarray:
+        self.start()
+        ring = self._rings[kind]
+        deadline = time.perf_counter() + self.timeout
+        while True:
+            try:
+                descriptor = ring.ready.get(timeout=0.1)
+            except queue.Empty:
+                if not self.is_running or time.perf_counter() > deadline:
+                    raise TimeoutError(f'No {kind} chunk received from the simulator process')
+                continue
+            if descriptor['rows'] == 2 * nframes:
+                break
+            ring.free.put(descriptor['slot'])  # produced before a change of chunk size
+        self.dropped[kind] = descriptor['dropped']
+        self.FirstShotIsPumpOn = descriptor['first_is_on']
+        return ring.slots[descriptor['slot'], :descriptor['rows']]
+
+    def grab_XUV(self, nframes, gas_off=False):
+        """Get the next chunk of XUV shots (noise included), a view in shared memory to be released"""
+        self.configure(nframes=nframes, gas_off=gas_off)
+        return self._grab('xuv', nframes)
+
+    def grab_stab(self, nframes):
+        """Get the next chunk of the stabilization camera (noise included), a view in shared memory to be
+        released. Its chunks are produced with those of grab_XUV, so nframes must be the size of the XUV chunks
+        (ValueError otherwise)."""
+        if nframes != self.config['nframes']:
+            raise ValueError(f"Chunks of {2 * nframes} shots requested from the simulator producing chunks of "
+                             f"{2 * self.config['nframes']} shots: use the chunk size of the MockCMOS")
+        return self._grab('stab', nframes)
+
+    def release(self, data: np.ndarray):
+        if self._rings is None:
+            return
+        for ring in self._rings.values():
+            slot = ring.slot_of(data)
+            if slot is not None:
+                ring.free.put(slot)
+                break
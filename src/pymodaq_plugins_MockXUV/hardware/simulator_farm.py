@@ -0,0 +1,350 @@
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from pymodaq_plugins_MockXUV.hardware.cmos_simulator import Mock_SingleShot
+from pymodaq_plugins_MockXUV.hardware.noise import NoiseGenerator
+from pymodaq_plugins_MockXUV.hardware.shm_simulator import SharedFrameRing, _attach
+from pymodaq_plugins_MockXUV.instrumentation import FPSMeter
+
+
+class _FarmGenerator:
+    """One camera simulated in a farm worker, writing its chunks in its own shared memory ring"""
+
+    def __init__(self, spec: dict, config: dict):
+        self.ring = spec['name']
+        self.shm, self.slots = _attach(spec)
+        self.free = deque(range(spec['n_slots']))
+        self.config = config
+        self.simulator = Mock_SingleShot(n_pixels=spec['slot_shape'][1])
+        self.noise = NoiseGenerator(config['seed'], name=config['name'])
+        self.dropped = 0
+        self.sequence = 0
+        self.next_time = time.perf_counter()
+
+    def configure(self, changes: dict):
+        if 'seed' in changes:
+            self.noise.reseed(changes['seed'])
+        self.config.update(changes)
+
+    @property
+    def blocked(self) -> bool:
+        """Free running camera (no period) waiting for the consumer to release a slot"""
+        return len(self.free) == 0 and self.config['period'] <= 0
+
+    def produce(self) -> dict:
+        """Fill the next free slot, return its descriptor (None if there was no free slot)"""
+        start = time.perf_counter()
+        if len(self.free) == 0:
+            if self.config['period'] > 0:
+                self.dropped += 1
+            return None
+        slot = self.free.popleft()
+        nframes = self.config['nframes']
+        chunk = self.slots[slot, :2 * nframes]
+        self.simulator.grab_XUV(nframes, gas_off=self.config['gas_off'], out=chunk)
+        self.noise.apply_drift(chunk, self.config['amp_drift'])
+        self.noise.add_uniform(chunk, self.config['amp_noise'])
+        self.sequence += 1
+        return dict(camera=self.config['name'], ring=self.ring, sequence=self.sequence, slot=slot, rows=2 * nframes,
+                    first_is_on=self.simulator.FirstShotIsPumpOn, dropped=self.dropped,
+                    gas_off=self.config['gas_off'], time=time.time(), duration=time.perf_counter() - start)
+
+    def close(self):
+        self.slots = None
+        self.shm.close()
+
+
+def _farm_worker(control, results, stop_event):
+    """Farm process: serve each of its cameras at its own period, handling the commands of the parent
+
+    Commands are (action, camera name, argument) tuples, action being add, configure, release or remove.
+    """
+    generators = {}
+
+    def handle(command: tuple):
+        action, name, argument = command
+        if action == 'add':
+            spec, config = argument
+            generators[name] = _FarmGenerator(spec, config)
+        elif name not in generators:
+            return
+        elif action == 'configure':
+            generators[name].configure(argument)
+        elif action == 'release':
+            ring, slot = argument
+            if ring == generators[name].ring:
+                generators[name].free.append(slot)
+        elif action == 'remove':
+            generators.pop(name).close()
+
+    try:
+        while not stop_event.is_set():
+            now = time.perf_counter()
+            for generator in list(generators.values()):
+                if generator.next_time <= now and not generator.blocked:
+                    descriptor = generator.produce()
+                    if descriptor is not None:
+                        results.put(descriptor)
+                    generator.next_time = max(generator.next_time + generator.config['period'], now)
+
+            next_times = [generator.next_time for generator in generators.values() if not generator.blocked]
+            timeout = min(next_times + [time.perf_counter() + 0.1]) - time.perf_counter()  # check stop_event
+            try:
+                handle(control.get(timeout=timeout) if timeout > 0 else control.get_nowait())
+                while True:
+                    handle(control.get_nowait())
+            except queue.Empty:
+                pass
+    finally:
+        for generator in generators.values():
+            generator.close()
+
+
+class _Worker:
+    """Parent side of a farm process, dispatching the descriptors it produces to its cameras"""
+
+    def __init__(self, context, index: int):
+        self.cameras = {}
+        self.control = context.Queue()
+        self.results = context.Queue()
+        self.stop_event = context.Event()
+        self.process = context.Process(target=_farm_worker, name=f'MockXUVFarm{index}', daemon=True,
+                                       args=(self.control, self.results, self.stop_event))
+        self.process.start()
+        self._dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+        self._dispatcher.start()
+
+    @property
+    def is_alive(self) -> bool:
+        return self.process.is_alive()
+
+    def send(self, action: str, name: str, argument=None):
+        self.control.put((action, name, argument))
+
+    def _dispatch(self):
+        while True:
+            descriptor = self.results.get()
+            if descriptor is None:
+                break
+            camera = self.cameras.get(descriptor['camera'])
+            if camera is not None:
+                camera.ready.put(descriptor)
+
+    def close(self, timeout: float):
+        self.stop_event.set()
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.results.put(None)
+        self._dispatcher.join(timeout)
+
+
+class FarmCamera:
+    """Controller of one camera of a SimulatorFarm, with the grab/release interface of Mock_SingleShot.
+
+    grab_XUV returns a view on a slot of the camera shared memory ring (noise included), to be released. The
+    generation and delivery rates of the camera are measured in timing, see stats. grab_stab serves the chunks of
+    a stabilization camera (a MockStabCamera slave of the MockCMOS plugin), simulated in the calling process.
+    """
+    runs_in_process = True
+    replays = False
+
+    def __init__(self, farm: 'SimulatorFarm', worker: _Worker, name: str, n_slots: int, dtype, config: dict):
+        self.farm = farm
+        self.name = name
+        self.n_slots = n_slots
+        self._dtype = np.dtype(dtype)
+        self.config = config
+        self.ready = queue.Queue()
+        self.timing = FPSMeter()
+        self.dropped = 0
+        self.n_chunks = 0
+        self.latency = 0.
+        self._worker = worker
+        self._ring: SharedFrameRing = None
+        self._stab_noise = NoiseGenerator(config['seed'], name=f'{name}-stab')
+        self._set_profiles()
+
+    def _set_profiles(self):
+        self._reference = Mock_SingleShot(n_pixels=self.config['n_pixels'])  # also simulates the stab chunks
+        self.pon = self._reference.pon
+        self.poff = self._reference.poff
+        self.stabpon = self._reference.stabpon
+        self.stabpoff = self._reference.stabpoff
+        self.FirstShotIsPumpOn = self._reference.FirstShotIsPumpOn
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self._dtype
+
+    @dtype.setter
+    def dtype(self, dtype):
+        if np.dtype(dtype) != self._dtype:
+            self._close_ring()  # created again in the new dtype at next grab
+            self._dtype = np.dtype(dtype)
+
+    def _open_ring(self):
+        self._ring = SharedFrameRing(self.n_slots, (2 * self.config['nframes'], self.pon.size), self._dtype,
+                                     context=None)
+        spec = self._ring.spec
+        del spec['free'], spec['ready']
+        self._worker.send('add', self.name, (spec, dict(self.config)))
+
+    def _close_ring(self):
+        if self._ring is not None:
+            self._worker.send('remove', self.name)
+            self._ring.close()
+            self._ring = None
+            while not self.ready.empty():
+                self.ready.get_nowait()
+
+    def configure(self, **config):
+        """Update the simulation settings (nframes, n_pixels, gas_off, amp_noise, amp_drift, stab_amp_noise, seed,
+        period), the ring being created again only if it must be resized"""
+        changes = {key: value for key, value in config.items() if self.config.get(key) != value}
+        if len(changes) == 0:
+            return
+        self.config.update(changes)
+        if 'seed' in changes:
+            self._stab_noise.reseed(changes['seed'])
+        if 'n_pixels' in changes:
+            self._set_profiles()
+        if self._ring is not None and ('n_pixels' in changes or 2 * self.config['nframes'] > self._ring.slot_shape[0]):
+            self._close_ring()
+        elif self._ring is not None:
+            self._worker.send('configure', self.name, changes)
+
+    def grab_XUV(self, nframes, gas_off=False):
+        """Get the next chunk of XUV shots (noise included), a view in shared memory to be released"""
+        self.configure(nframes=nframes, gas_off=gas_off)
+        if self._ring is None:
+            self._open_ring()
+        deadline = time.perf_counter() + self.farm.timeout
+        while True:
+            try:
+                descriptor = self.ready.get(timeout=0.1)
+            except queue.Empty:
+                if not self._worker.is_alive or time.perf_counter() > deadline:
+                    raise TimeoutError(f'No chunk received from the farm for camera {self.name}')
+                continue
+            if descriptor['ring'] != self._ring.shm.name:
+                continue
+            if descriptor['rows'] == 2 * nframes:
+                break
+            self._worker.send('release', self.name, (descriptor['ring'], descriptor['slot']))
+
+        self.n_chunks += 1
+        self.dropped = descriptor['dropped']
+        self.latency = time.time() - descriptor['time']
+        self.FirstShotIsPumpOn = descriptor['first_is_on']
+        self.timing.add_generation(descriptor['rows'], descriptor['duration'])
+        self.timing.add_delivery(descriptor['rows'])
+        return self._ring.slots[descriptor['slot'], :descriptor['rows']]
+
+    def grab_stab(self, nframes):
+        """Get the chunk of the stabilization camera (noise included) following the pump states of the last chunk
+        of grab_XUV, in a pooled buffer to be released. nframes must be the size of the XUV chunks (ValueError
+        otherwise)."""
+        if nframes != self.config['nframes']:
+            raise ValueError(f"Chunks of {2 * nframes} shots requested from the farm camera {self.name} producing "
+                             f"chunks of {2 * self.config['nframes']} shots: use the chunk size of the MockCMOS")
+        self._reference.FirstShotIsPumpOn = self.FirstShotIsPumpOn
+        stab_data = self._reference.grab_stab(nframes)
+        return self._stab_noise.add_uniform(stab_data, self.config.get('stab_amp_noise', 0.))
+
+    def release(self, data: np.ndarray):
+        slot = None if self._ring is None else self._ring.slot_of(data)
+        if slot is not None:
+            self._worker.send('release', self.name, (self._ring.shm.name, slot))
+        else:
+            self._reference.release(data)
+
+    def stats(self) -> dict:
+        """Timing of the camera: delivered and generation-limited shot rates, chunks received and dropped,
+        latency (s) between the end of the generation of the last chunk and its grab"""
+        return dict(fps=self.timing.fps, max_fps=self.timing.max_fps, chunks=self.n_chunks, dropped=self.dropped,
+                    latency=self.latency)
+
+    def close(self):
+        self.farm.remove_camera(self)
+
+
+class SimulatorFarm:
+    """Pool of processes hosting simulated single shot cameras, to load test a DAQ with many of them.
+
+    Each camera (see add_camera) has its own seed, period and geometry, and is served by the least loaded of the
+    n_workers processes (one per core by default), so that the generation does not compete for the GIL of the
+    dashboard process and the aggregate throughput scales with the cores. The processes are started on demand.
+    """
+
+    def __init__(self, n_workers: int = None, n_slots: int = 4, timeout: float = 30.):
+        self.n_workers = n_workers or os.cpu_count() or 1
+        self.n_slots = n_slots
+        self.timeout = timeout
+        self.cameras = {}
+        self._context = multiprocessing.get_context('spawn')
+        self._workers = [None] * self.n_workers
+        self._names = itertools.count()
+        self._lock = threading.Lock()
+
+    def _least_loaded(self) -> _Worker:
+        index = min(range(self.n_workers),
+                    key=lambda ind: 0 if self._workers[ind] is None else len(self._workers[ind].cameras))
+        if self._workers[index] is None:
+            self._workers[index] = _Worker(self._context, index)
+        return self._workers[index]
+
+    def add_camera(self, name: str = None, nframes=50, n_pixels: int = None, period=0., seed=-1, amp_noise=0.,
+                   amp_drift=0., gas_off=False, dtype=np.float64) -> FarmCamera:
+        """Add a camera to the farm, n_pixels being its sensor width (the width of the data file by default)"""
+        with self._lock:
+            if name is None:
+                name = f'camera{next(self._names)}'
+            if name in self.cameras:
+                raise ValueError(f'The farm already has a camera named {name}')
+            worker = self._least_loaded()
+            config = dict(name=name, nframes=nframes, n_pixels=n_pixels, period=period, seed=seed,
+                          amp_noise=amp_noise, amp_drift=amp_drift, gas_off=gas_off)
+            camera = FarmCamera(self, worker, name, self.n_slots, dtype, config)
+            worker.cameras[name] = camera
+            self.cameras[name] = camera
+            return camera
+
+    def remove_camera(self, camera: FarmCamera):
+        with self._lock:
+            camera._close_ring()
+            camera._worker.cameras.pop(camera.name, None)
+            self.cameras.pop(camera.name, None)
+
+    def stats(self) -> dict:
+        """Timing of each camera (see FarmCamera.stats), and their aggregate delivered shot rate under 'total'"""
+        stats = {name: camera.stats() for name, camera in self.cameras.items()}
+        stats['total'] = dict(fps=sum(camera_stats['fps'] for camera_stats in stats.values()))
+        return stats
+
+    def close(self):
+        """Remove all the cameras and stop the processes"""
+        for camera in list(self.cameras.values()):
+            self.remove_camera(camera)
+        for index, worker in enumerate(self._workers):
+            if worker is not None:
+                worker.close(self.timeout)
+                self._workers[index] = None
+
+
+_farm: SimulatorFarm = None
+
+
+def get_farm() -> SimulatorFarm:
+    """The farm shared by all the plugins of the process, created on first use"""
+    global _farm
+    if _farm is None:
+        _farm = SimulatorFarm()
+    return _farm
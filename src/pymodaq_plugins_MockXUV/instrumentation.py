@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+"""
+Throughput and timing instrumentation shared by the mock detector plugins
+"""
+import time
+from collections import deque
+
+import numpy as np
+
+from pymodaq_gui.parameter import Parameter
+
+
+def fps_params():
+    """Parameters displaying the throughput of a detector, to be put in the group given to FPSMeter.publish"""
+    return [
+        {'title': 'Compute FPS', 'name': 'fps_on', 'type': 'bool', 'value': True},
+        {'title': 'Actual FPS', 'name': 'fps', 'type': 'float', 'value': 0.0, 'readonly': True, 'decimals': 6},
+        {'title': 'Max FPS', 'name': 'fps2', 'type': 'float', 'value': 0.0, 'readonly': True, 'decimals': 6},
+    ]
+
+
+class FPSMeter:
+    """Shot rate of a detector over a sliding time window.
+
+    fps is the rate of shots actually delivered (emitted), max_fps the rate the generation alone could sustain,
+    that is without the sleep or exposure throttling and emission overhead.
+    """
+
+    def __init__(self, window: float = 2., publish_period: float = 0.5):
+        self.window = window
+        self.publish_period = publish_period
+        self._delivered = deque()  # (time, nshots)
+        self._generated = deque()  # (time, nshots, duration)
+        self._last_publish = 0.
+
+    def reset(self):
+        self._delivered.clear()
+        self._generated.clear()
+
+    def _trim(self, entries: deque, now: float):
+        while len(entries) > 1 and now - entries[0][0] > self.window:
+            entries.popleft()
+
+    def add_delivery(self, nshots: int):
+        now = time.perf_counter()
+        self._delivered.append((now, nshots))
+        self._trim(self._delivered, now)
+
+    def add_generation(self, nshots: int, duration: float):
+        now = time.perf_counter()
+        self._generated.append((now, nshots, duration))
+        self._trim(self._generated, now)
+
+    @property
+    def fps(self) -> float:
+        delivered = list(self._delivered)
+        if len(delivered) < 2:
+            return 0.
+        elapsed = delivered[-1][0] - delivered[0][0]
+        return sum(entry[1] for entry in delivered[1:]) / elapsed if elapsed > 0 else 0.
+
+    @property
+    def max_fps(self) -> float:
+        generated = list(self._generated)
+        duration = sum(entry[2] for entry in generated)
+        return sum(entry[1] for entry in generated) / duration if duration > 0 else 0.
+
+    def publish(self, group: Parameter, force=False):
+        """Display the rates in the fps and fps2 children of group, at most every publish_period"""
+        now = time.perf_counter()
+        if force or now - self._last_publish >= self.publish_period:
+            self._last_publish = now
+            group.child('fps').setValue(self.fps)
+            group.child('fps2').setValue(self.max_fps)
+
+
+def loop_params():
+    """Parameters displaying the timing of a control loop, to be put in the group given to LoopTimer.publish"""
+    return [
+        {'title': 'Latency (ms)', 'name': 'latency', 'type': 'float', 'value': 0.0, 'readonly': True,
+         'decimals': 3, 'tip': 'Mean time from the acquisition of the data to the command of the actuators'},
+        {'title': 'Max latency (ms)', 'name': 'latency_max', 'type': 'float', 'value': 0.0, 'readonly': True,
+         'decimals': 3},
+        {'title': 'Processing (ms)', 'name': 'processing', 'type': 'float', 'value': 0.0, 'readonly': True,
+         'decimals': 3, 'tip': 'Mean time spent in the model, from its input to its output'},
+        {'title': 'Control rate (Hz)', 'name': 'rate', 'type': 'float', 'value': 0.0, 'readonly': True,
+         'decimals': 3},
+        {'title': 'Shots per iteration', 'name': 'shots', 'type': 'int', 'value': 0, 'readonly': True},
+        {'title': 'Corrected shot rate (Hz)', 'name': 'shot_rate', 'type': 'float', 'value': 0.0, 'readonly': True,
+         'decimals': 3, 'tip': 'Control rate times the shots per iteration, to compare to the shot rate'},
+    ]
+
+
+class LoopTimer:
+    """Latency and rate of a control loop over its last window iterations.
+
+    An iteration starts (start) when its input is received, given the time.time timestamp of the acquisition of
+    that input, and stops (stop) when its output is issued: the latency runs from the acquisition to the output,
+    the processing from start to stop, and the rate is that of the starts.
+    """
+
+    def __init__(self, window: int = 100, publish_period: float = 0.5):
+        self.publish_period = publish_period
+        self.shots = 0
+        self._starts = deque(maxlen=window)
+        self._latencies = deque(maxlen=window)
+        self._processing = deque(maxlen=window)
+        self._acquired = None
+        self._last_publish = 0.
+
+    def reset(self):
+        self._starts.clear()
+        self._latencies.clear()
+        self._processing.clear()
+        self._acquired = None
+
+    def start(self, acquired: float = None, shots: int = 0):
+        """acquired: time.time timestamp of the acquisition of the input (now if None), shots: shots it holds"""
+        now = time.perf_counter()
+        self._starts.append(now)
+        self._acquired = now if acquired is None else now - max(time.time() - acquired, 0.)
+        self.shots = shots
+
+    def stop(self):
+        if self._acquired is None:
+            return
+        now = time.perf_counter()
+        self._latencies.append(now - self._acquired)
+        self._processing.append(now - self._starts[-1])
+        self._acquired = None
+
+    @property
+    def latency(self) -> float:
+        return sum(self._latencies) / len(self._latencies) if self._latencies else 0.
+
+    @property
+    def latency_max(self) -> float:
+        return max(self._latencies, default=0.)
+
+    @property
+    def processing(self) -> float:
+        return sum(self._processing) / len(self._processing) if self._processing else 0.
+
+    @property
+    def rate(self) -> float:
+        if len(self._starts) < 2:
+            return 0.
+        elapsed = self._starts[-1] - self._starts[0]
+        return (len(self._starts) - 1) / elapsed if elapsed > 0 else 0.
+
+    def publish(self, group: Parameter, force=False):
+        """Display the timing in the children of group (see loop_params), at most every publish_period"""
+        now = time.perf_counter()
+        if force or now - self._last_publish >= self.publish_period:
+            self._last_publish = now
+            group.child('latency').setValue(self.latency * 1000)
+            group.child('latency_max').setValue(self.latency_max * 1000)
+            group.child('processing').setValue(self.processing * 1000)
+            group.child('rate').setValue(self.rate)
+            group.child('shots').setValue(self.shots)
+            group.child('shot_rate').setValue(self.rate * self.shots)
+
+
+def stage_params():
+    """Parameters of the stage timing of a detector or model, to be put in the group given to StageTimer.publish"""
+    return [
+        {'title': 'Time the stages', 'name': 'stages_on', 'type': 'bool', 'value': False,
+         'tip': 'Measure the duration of each processing stage of the grabs'},
+        {'title': 'Export the timing', 'name': 'stages_export', 'type': 'bool', 'value': False,
+         'tip': 'Also emit the min, mean and 99th percentile of each stage (ms) as 0D data, saved with the data'},
+        {'title': 'Stages (ms)', 'name': 'stages', 'type': 'text', 'value': '', 'readonly': True},
+    ]
+
+
+class _Stage:
+    """Context manager adding its duration to the durations of a stage, one per run so that the runs of a stage
+    may be nested or concurrent"""
+    __slots__ = ('durations', 'start')
+
+    def __init__(self, durations: deque):
+        self.durations = durations
+        self.start = 0.
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.durations.append(time.perf_counter() - self.start)
+
+
+class _NoStage:
+    """Context manager of the stages of a disabled StageTimer"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NO_STAGE = _NoStage()
+
+
+class StageTimer:
+    """Durations of the named stages of a processing over their last window runs.
+
+    A stage is timed by running it in ``with timer.stage('name'):``. Disabled, stage returns a shared context
+    manager doing nothing, so that the timed code only pays a method call. The durations of a stage may be added
+    from any thread, the statistics (see stats) being computed on demand. The stages declared in stages are the
+    ones exported (see to_data), whether they were run or not, so that the exported data are the same at every
+    grab.
+    """
+
+    def __init__(self, window: int = 1000, publish_period: float = 0.5, enabled: bool = False, stages=()):
+        self.window = window
+        self.publish_period = publish_period
+        self.enabled = enabled
+        self.stages = tuple(stages)
+        self._last_publish = 0.
+        self.reset()
+
+    def reset(self):
+        self._stages = {name: deque(maxlen=self.window) for name in self.stages}
+        self._stats = {}
+
+    def _durations(self, name: str) -> deque:
+        durations = self._stages.get(name)
+        if durations is None:
+            durations = self._stages.setdefault(name, deque(maxlen=self.window))
+        return durations
+
+    def stage(self, name: str):
+        if not self.enabled:
+            return _NO_STAGE
+        return _Stage(self._durations(name))
+
+    def add(self, name: str, duration: float):
+        """Add the duration (s) of a stage timed by other means"""
+        if self.enabled:
+            self._durations(name).append(duration)
+
+    def stats(self) -> dict:
+        """min, mean and p99 (99th percentile) durations (s) and count of the recent runs of each stage run, the
+        declared stages first, then the others in the order they were first run"""
+        stats = {}
+        for name, durations in list(self._stages.items()):
+            durations = np.array(durations)
+            if durations.size > 0:
+                stats[name] = dict(min=durations.min(), mean=durations.mean(),
+                                   p99=np.percentile(durations, 99), count=durations.size)
+        return stats
+
+    def report(self, stats: dict = None) -> str:
+        """The statistics of each stage (in ms), one line per stage, as to be logged (the current ones if stats is
+        None)"""
+        stats = self.stats() if stats is None else stats
+        return '\n'.join(f"{name}: min {stat['min'] * 1000:.3f}, mean {stat['mean'] * 1000:.3f}, "
+                         f"p99 {stat['p99'] * 1000:.3f} ({stat['count']} runs)" for name, stat in stats.items())
+
+    def to_data(self, data_class) -> list:
+        """One 0D data of class data_class (DataFromPlugins for a plugin, DataCalculated for a model) per declared
+        stage, its channels being the min, mean and p99 durations (ms) as last published, NaN until measured"""
+        no_stat = dict(min=np.nan, mean=np.nan, p99=np.nan)
+        return [data_class(f'Timing {name}', data=[np.array([self._stats.get(name, no_stat)[key] * 1000])
+                                                   for key in ('min', 'mean', 'p99')],
+                           labels=['min (ms)', 'mean (ms)', 'p99 (ms)'])
+                for name in self.stages]
+
+    def publish(self, group: Parameter, force=False):
+        """Update the statistics, displayed in the stages child of group (see stage_params), at most every
+        publish_period"""
+        now = time.perf_counter()
+        if force or now - self._last_publish >= self.publish_period:
+            self._last_publish = now
+            self._stats = self.stats()
+            group.child('stages').setValue(self.report(self._stats))
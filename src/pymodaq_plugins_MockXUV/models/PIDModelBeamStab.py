@@ -0,0 +1,104 @@
+from typing import List
+
+import numpy as np
+
+from pymodaq.extensions.pid.utils import PIDModelGeneric, main
+from pymodaq.utils.data import DataToActuators
+from pymodaq_data.data import DataToExport, DataCalculated
+from pymodaq_gui.parameter import Parameter
+
+from pymodaq_plugins_MockXUV.instrumentation import LoopTimer, loop_params
+from pymodaq_plugins_MockXUV.processing.centroid import Centroider
+
+
+class PIDModelBeamStab(PIDModelGeneric):
+    """Beam pointing lock: the centroid of the Beam image of the stabilization camera (enable its Beam image
+    setting) is kept on the setpoints by the two axes of the beam steering mirror.
+
+    The input is computed on the frame as emitted (no copy), from its projections, so the model adds a small
+    fraction of a millisecond to the loop. The latency from the acquisition of each frame to the command of the
+    mirror, and the control rate, are displayed in the Loop timing settings.
+    """
+    limits = dict(max=dict(state=True, value=5),
+                  min=dict(state=True, value=-5),)
+    konstants = dict(kp=0.5, ki=0.05, kd=0.0000)
+
+    Nsetpoints = 2  # number of setpoints
+    setpoint_ini = [31.5, 31.5]  # the center of the default 64x64 frame
+    setpoints_names = ['Yaxis', 'Xaxis']  # number and names of setpoints
+
+    actuators_name = ["Ypiezo", "Xpiezo"]  # MockBeamSteering control modules on the Y and X axis
+    detectors_name = ['StabCamera']  # MockStabCamera control module
+
+    params = [
+        {'title': 'Image:', 'name': 'image', 'type': 'str', 'value': 'Beam',
+         'tip': 'Name of the beam image data of the camera'},
+        {'title': 'Threshold:', 'name': 'threshold', 'type': 'float', 'value': 0., 'min': 0,
+         'tip': 'Pixels below are ignored in the centroid'},
+        {'title': 'Loop timing', 'name': 'loop', 'type': 'group', 'children': loop_params()},
+    ]
+
+    def __init__(self, pid_controller):
+        super().__init__(pid_controller)
+        self.centroider: Centroider = None
+        self.timer = LoopTimer()
+
+    def update_settings(self, param: Parameter):
+        """
+        Get a parameter instance whose value has been modified by a user on the UI
+        Parameters
+        ----------
+        param: (Parameter) instance of Parameter object
+        """
+        if param.name() == 'threshold' and self.centroider is not None:
+            self.centroider.threshold = param.value()
+
+    def ini_model(self):
+        super().ini_model()
+        self.timer.reset()
+
+    def convert_input(self, measurements: DataToExport) -> DataToExport:
+        """
+        Convert the measurements in the units to be fed to the PID (same dimensionality as the setpoint)
+        Parameters
+        ----------
+        measurements: DataToExport
+            Data from the declared detectors from which the model extract a value of the same units as the setpoint
+
+        Returns
+        -------
+        DataToExport: the (y, x) centroid of the beam as two 0D DataCalculated, in pixels
+        """
+        beam = measurements.get_data_from_name(self.settings['image'])
+        if beam is None:
+            raise ValueError(f"No {self.settings['image']} image in the data of the {self.detectors_name[0]} "
+                             f"module: enable the Beam image setting of the stabilization camera")
+        camera = measurements.get_data_from_name('Camera')
+        self.timer.start(beam.timestamp, shots=camera.shape[0] if camera is not None else 0)
+
+        frame = beam.data[0]
+        if self.centroider is None or self.centroider.shape != frame.shape:
+            self.centroider = Centroider(frame.shape, threshold=self.settings['threshold'])
+        y, x = self.centroider.centroid(frame)
+        return DataToExport('inputs', data=[DataCalculated('Yaxis', data=[np.array([y])]),
+                                            DataCalculated('Xaxis', data=[np.array([x])])])
+
+    def convert_output(self, outputs: List[float], **kwargs) -> DataToActuators:
+        """
+        Convert the output of the PID in units to be fed into the actuator
+        Parameters
+        ----------
+        outputs: (list of float) output value from the PID, the relative moves of the mirror in pixels
+
+        Returns
+        -------
+        DataToActuators: the converted output
+        """
+        output = super().convert_output(outputs, **kwargs)
+        self.timer.stop()
+        self.timer.publish(self.settings.child('loop'))
+        return output
+
+
+if __name__ == '__main__':
+    main("BeamStabMockXUV.xml")  # some preset configured with the StabCamera and the Xpiezo and Ypiezo modules
@@ -2,39 +2,122 @@ import numpy as np
 
 from pymodaq_plugins_datamixer.extensions.utils.model import DataMixerModel, np  # np will be used in method eval of the formula
 
+from pymodaq_utils.logger import set_logger, get_module_name
 from pymodaq_utils.math_utils import gauss1D, my_moment
 
-from pymodaq_data.data import DataToExport, DataWithAxes
+from pymodaq_data.data import Axis, DataToExport, DataWithAxes, DataCalculated
 from pymodaq_gui.parameter import Parameter
 
 from pymodaq_plugins_datamixer.extensions.utils.parser import (
     extract_data_names, split_formulae, replace_names_in_formula)
 
+from pymodaq_plugins_MockXUV.instrumentation import StageTimer, stage_params
+from pymodaq_plugins_MockXUV.processing.alignment import ShotAligner
+from pymodaq_plugins_MockXUV.processing.normalization import NORMALIZATIONS, CommonModeNormalizer
+from pymodaq_plugins_MockXUV.processing.outliers import OutlierRejector
+from pymodaq_plugins_MockXUV.processing.running_stats import RunningStats
+
+logger = set_logger(get_module_name(__file__))
+
 
 def gaussian_fit(x, amp, x0, dx, offset):
     return amp * gauss1D(x, x0, dx) + offset
 
 
 class DataMixerModelDeltaR(DataMixerModel):
+    timed_stages = ('background', 'alignment', 'rejection', 'normalization', 'dRoverR', 'statistics', 'data')
     params = [
         {'title': 'Get Data:', 'name': 'get_data', 'type': 'bool_push', 'value': False,
          'label': 'Get Data'},
         {'title': 'Do Background:', 'name': 'do_bkg', 'type': 'bool_push', 'value': False, 'label': 'Take Background'},
         {'title': 'XUV Camera:', 'name': 'camera', 'type': 'list', 'values': []},
         {'title': 'On/Off signal:', 'name': 'on_off_signal', 'type': 'list', 'values': []},
+        {'title': 'Running average:', 'name': 'running', 'type': 'group', 'children': [
+            {'title': 'Shots averaged:', 'name': 'n_shots', 'type': 'int', 'value': 0, 'readonly': True},
+            {'title': 'Reset:', 'name': 'reset_stats', 'type': 'bool_push', 'value': False, 'label': 'Reset'},
+        ]},
+        {'title': 'Shot alignment:', 'name': 'alignment', 'type': 'group', 'children': [
+            {'title': 'Align shots:', 'name': 'align_on', 'type': 'bool', 'value': False,
+             'tip': 'Correct the spectral jitter of each shot before computing dR/R'},
+            {'title': 'Max shift (pixels):', 'name': 'max_shift', 'type': 'int', 'value': 20, 'min': 1},
+            {'title': 'New reference:', 'name': 'reset_reference', 'type': 'bool_push', 'value': False,
+             'label': 'Reset', 'tip': 'Take the pump off average of the next data as reference'},
+            {'title': 'Shift rms (pixels):', 'name': 'shift_rms', 'type': 'float', 'value': 0., 'readonly': True},
+        ]},
+        {'title': 'Shot rejection:', 'name': 'rejection', 'type': 'group', 'children': [
+            {'title': 'Reject outliers:', 'name': 'reject_on', 'type': 'bool', 'value': False,
+             'tip': 'Drop the pairs of shots whose total counts or correlation to the reference is an outlier'},
+            {'title': 'Threshold (sigma):', 'name': 'threshold', 'type': 'float', 'value': 5., 'min': 0,
+             'tip': 'In robust standard deviations (1.4826 MAD) from the median of the recent shots'},
+            {'title': 'Window (shots):', 'name': 'window', 'type': 'int', 'value': 1000, 'min': 10,
+             'tip': 'Number of recent shots of the median and MAD'},
+            {'title': 'Pairs accepted:', 'name': 'accepted', 'type': 'int', 'value': 0, 'readonly': True},
+            {'title': 'Pairs rejected:', 'name': 'rejected', 'type': 'int', 'value': 0, 'readonly': True},
+        ]},
+        {'title': 'Normalization:', 'name': 'normalization', 'type': 'group', 'children': [
+            {'title': 'Mode:', 'name': 'mode', 'type': 'list', 'limits': list(NORMALIZATIONS), 'value': 'none',
+             'tip': 'reference: ratio of the counts of the reference regions of each pair, '
+                    'fit: least squares pon/poff ratio on the reference regions'},
+            {'title': 'Reference regions:', 'name': 'regions', 'type': 'str', 'value': '',
+             'tip': 'Pixel regions insensitive to the pump, as comma separated start:stop (all pixels if empty)'},
+            {'title': 'Noise floor:', 'name': 'noise_floor', 'type': 'float', 'value': 0., 'readonly': True,
+             'tip': 'rms over the pixels of the standard error of the averaged dR/R'},
+            {'title': 'Single shot noise:', 'name': 'single_shot_noise', 'type': 'float', 'value': 0.,
+             'readonly': True, 'tip': 'Noise floor times the square root of the shots averaged'},
+        ]},
+        {'title': 'Timing:', 'name': 'timing', 'type': 'group', 'children': stage_params()},
     ]
+    max_floor_points = 512  # length of the noise floor versus shots averaged curve
 
     def ini_model(self):
         self.update_data_list()
         self.bkg_poff = None
         self.bkg_pon = None
         self.doing_bkg = False
+        self.stats = RunningStats()
+        self.aligner = ShotAligner(self.settings['alignment', 'max_shift'])
+        self.rejector = OutlierRejector(self.settings['rejection', 'threshold'], self.settings['rejection', 'window'])
+        self.normalizer = CommonModeNormalizer(self.settings['normalization', 'mode'],
+                                               self.settings['normalization', 'regions'])
+        self.floor_counts = []
+        self.floors = []
+        self.stage_timer = StageTimer(enabled=self.settings['timing', 'stages_on'], stages=self.timed_stages)
 
     def update_settings(self, param: Parameter):
         if param.name() == 'do_bkg':
             self.do_bkg()
         if param.name() == 'get_data':
             self.update_data_list()
+        if param.name() == 'reset_stats':
+            self.reset_stats()
+        if param.name() == 'max_shift':
+            self.aligner.max_shift = param.value()
+            self.reset_reference()
+        if param.name() in ('reset_reference', 'align_on'):
+            self.reset_reference()
+        if param.name() == 'mode':
+            self.normalizer.mode = param.value()
+            self.reset_stats()
+        if param.name() == 'regions':
+            self.set_regions(param.value())
+        if param.name() == 'threshold':
+            self.rejector.threshold = param.value()
+        if param.name() == 'window':
+            self.rejector = OutlierRejector(self.settings['rejection', 'threshold'], param.value())
+            self.reset_stats()
+        if param.name() == 'stages_on':
+            self.stage_timer.enabled = param.value()
+            self.stage_timer.reset()
+
+    def set_regions(self, regions: str):
+        """Normalize on new reference regions, or keep (and display again) the previous ones if they are invalid"""
+        try:
+            self.normalizer.set_regions(regions)
+        except ValueError as e:
+            logger.warning(f'{e}, the reference regions stay {self.normalizer.regions!r}')
+            self.settings.child('normalization', 'regions').setValue(self.normalizer.regions)
+            return
+        self.reset_stats()
 
     def update_data_list(self):
         dte = self.modules_manager.get_det_data_list()
@@ -53,6 +136,65 @@ class DataMixerModelDeltaR(DataMixerModel):
         self.settings.child('on_off_signal').setValue(data_list1D[0])
         # self.settings.child('dataND').setValue(dict(all_items=data_listND, selected=[]))
 
+    def reset_stats(self):
+        self.stats.reset()
+        self.rejector.reset()
+        self.floor_counts = []
+        self.floors = []
+        self.settings.child('running', 'n_shots').setValue(0)
+        self.settings.child('rejection', 'accepted').setValue(0)
+        self.settings.child('rejection', 'rejected').setValue(0)
+
+    def reset_reference(self):
+        self.aligner.clear_reference()
+        self.reset_stats()
+
+    def align_shots(self, pon: DataWithAxes, poff: DataWithAxes, first_is_on: bool) -> np.ndarray:
+        """Shift back in place the shots of pon and poff onto the reference (the first pump off average met),
+        returning the measured shift of each shot in acquisition order"""
+        if not self.aligner.has_reference:
+            self.aligner.set_reference(poff.data[0].mean(axis=0))
+        aligned_pon, shifts_pon = self.aligner.align(pon.data[0])
+        aligned_poff, shifts_poff = self.aligner.align(poff.data[0])
+        pon.data = [aligned_pon]
+        poff.data = [aligned_poff]
+
+        shifts = np.empty(shifts_pon.size + shifts_poff.size)
+        shifts[int(not first_is_on)::2] = shifts_pon
+        shifts[int(first_is_on)::2] = shifts_poff
+        self.settings.child('alignment', 'shift_rms').setValue(float(np.sqrt(np.mean(shifts ** 2))))
+        return shifts
+
+    def reject_outliers(self, pon: DataWithAxes, poff: DataWithAxes) -> DataCalculated:
+        """Drop in place the pairs of shots of pon and poff having an outlier, returning the counts of accepted and
+        rejected pairs"""
+        keep = self.rejector.accept(pon.data[0], poff.data[0])
+        if not keep.all():
+            pon.data = [pon.data[0][keep]]
+            poff.data = [poff.data[0][keep]]
+        self.settings.child('rejection', 'accepted').setValue(self.rejector.accepted)
+        self.settings.child('rejection', 'rejected').setValue(self.rejector.rejected)
+        return DataCalculated('Shot rejection', data=[np.array([self.rejector.accepted]),
+                                                      np.array([self.rejector.rejected])],
+                              labels=['accepted', 'rejected'])
+
+    def update_noise_floor(self) -> DataCalculated:
+        """Noise floor of the running average, and its curve versus the number of shots averaged (None until it has
+        two points)"""
+        floor = float(np.sqrt(np.mean(self.stats.std_error ** 2)))
+        self.floor_counts.append(self.stats.count)
+        self.floors.append(floor)
+        if len(self.floors) > self.max_floor_points:  # keep a point out of two, the curve being seen in log scale
+            self.floor_counts = self.floor_counts[1::2]
+            self.floors = self.floors[1::2]
+        self.settings.child('normalization', 'noise_floor').setValue(floor)
+        self.settings.child('normalization', 'single_shot_noise').setValue(floor * np.sqrt(self.stats.count))
+        if len(self.floors) < 2:
+            return None
+        counts = np.array(self.floor_counts, dtype=float)
+        return DataCalculated('Noise floor', data=[np.array(self.floors)],
+                              axes=[Axis('Shots averaged', data=counts, index=0)])
+
     def do_bkg(self):
         self.doing_bkg = True
         self.data_mixer.snap()
@@ -76,6 +218,7 @@ class DataMixerModelDeltaR(DataMixerModel):
 
                 self.settings.child("do_bkg").setValue(False)
                 self.doing_bkg = False
+                self.reset_reference()  # dR/R averaged so far was computed with the previous background
 
             else:
                 if first_is_on:
@@ -84,14 +227,57 @@ class DataMixerModelDeltaR(DataMixerModel):
                 else:
                     poff = dwa.isig[::2, :]
                     pon = dwa.isig[1::2, :]
+                # counts of a sensor (uint16) would wrap around in the differences and cannot be shifted in place
+                dtype = np.result_type(dwa.data[0], np.float32)
+                poff.data = [poff.data[0].astype(dtype, copy=False)]
+                pon.data = [pon.data[0].astype(dtype, copy=False)]
 
                 if self.bkg_poff is not None and self.bkg_pon is not None:
-                    poff.data = [poff.data[0] - self.bkg_poff.data[0]]
-                    pon.data = [pon.data[0] - self.bkg_pon.data[0]]
+                    with self.stage_timer.stage('background'):
+                        poff.data = [poff.data[0] - self.bkg_poff.data[0]]
+                        pon.data = [pon.data[0] - self.bkg_pon.data[0]]
+
+                if self.settings['alignment', 'align_on']:
+                    with self.stage_timer.stage('alignment'):
+                        shifts = self.align_shots(pon, poff, first_is_on)
+                    dte_processed.append(DataCalculated('Shot shifts', data=[shifts]))
+
+                if self.settings['rejection', 'reject_on']:
+                    with self.stage_timer.stage('rejection'):
+                        dte_processed.append(self.reject_outliers(pon, poff))
+                    if pon.shape[0] == 0:
+                        return dte_processed
+
+                if self.normalizer.mode != 'none':
+                    with self.stage_timer.stage('normalization'):
+                        pon.data = [self.normalizer.normalize(pon.data[0], poff.data[0])]
+
+                with self.stage_timer.stage('dRoverR'):
+                    dwa_shots = (pon-poff)/poff
+                with self.stage_timer.stage('statistics'):
+                    self.stats.update(dwa_shots.data[0])
+                self.settings.child('running', 'n_shots').setValue(self.stats.count)
+
+                with self.stage_timer.stage('data'):
+                    dwa = dwa_shots.mean(axis=0)
+                    dwa.name = "dR over R"
+                    dte_processed.append(dwa)
+
+                    dwa_running = dwa.deepcopy_with_new_data([self.stats.mean.copy(), self.stats.std_error])
+                    dwa_running.name = "dR over R running"
+                    dwa_running.labels = ['mean', 'std error']
+                    dte_processed.append(dwa_running)
+                    dte_processed.append(DataCalculated('Shots averaged', data=[np.array([self.stats.count])]))
+                    if self.stats.count > 1:
+                        noise_floor = self.update_noise_floor()
+                        if noise_floor is not None:
+                            dte_processed.append(noise_floor)
 
-                dwa = ((pon-poff)/poff).mean(axis=0)
-                dwa.name = "dR over R"
-                dte_processed.append(dwa)
+                if self.stage_timer.enabled:
+                    self.stage_timer.publish(self.settings.child('timing'))
+                    if self.settings['timing', 'stages_export']:
+                        for dwa_timing in self.stage_timer.to_data(DataCalculated):
+                            dte_processed.append(dwa_timing)
 
         return dte_processed
 
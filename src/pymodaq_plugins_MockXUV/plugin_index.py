@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+On demand loading of the instrument plugin modules, replacing the packages __init__ importing all of them
+"""
+import ast
+import importlib
+import logging
+import time
+from pathlib import Path
+from typing import List
+
+_indexes: List['PluginIndex'] = []
+
+
+def _classes_defined_in(path: Path) -> List[str]:
+    """Names of the classes defined at the top level of a python file, read without importing it"""
+    try:
+        tree = ast.parse(path.read_bytes(), filename=str(path))
+    except SyntaxError:
+        return []
+    return [node.name for node in tree.body if isinstance(node, ast.ClassDef)]
+
+
+class PluginIndex:
+    """Index of the plugin modules of a package, built by scanning the source files rather than importing them.
+
+    A module is imported only when the package attribute of its name, or of a class it defines, is first
+    accessed (see make_lazy_package). The index is cached and rebuilt only for the files whose modification time
+    changed. The duration (or failure) of each import is kept in the report.
+    """
+
+    def __init__(self, package: str, directory: Path, prefix: str = 'daq_', logger: logging.Logger = None):
+        self.package = package
+        self.directory = Path(directory)
+        self.prefix = prefix
+        self.logger = logger
+        self.report = {}  # module name: dict(seconds=import duration, error=None or the error message)
+        self._entries = {}  # module name: (modification time, class names)
+
+    def modules(self) -> dict:
+        """Mapping from the plugin module names of the package to the names of the classes they define"""
+        paths = {path.stem: path for path in self.directory.glob(f'{self.prefix}*.py')}
+        for name in set(self._entries) - set(paths):
+            del self._entries[name]
+        for name, path in paths.items():
+            mtime = path.stat().st_mtime_ns
+            if name not in self._entries or self._entries[name][0] != mtime:
+                self._entries[name] = (mtime, _classes_defined_in(path))
+        return {name: classes for name, (_, classes) in sorted(self._entries.items())}
+
+    def find_module(self, attribute: str) -> str:
+        """Name of the module named attribute or defining the class named attribute, None if there is none"""
+        modules = self.modules()
+        if attribute in modules:
+            return attribute
+        for name, classes in modules.items():
+            if attribute in classes:
+                return name
+        return None
+
+    def load(self, name: str):
+        """Import the plugin module name, recording the duration or the error in the report"""
+        start = time.perf_counter()
+        try:
+            module = importlib.import_module(f'.{name}', self.package)
+        except Exception as e:
+            self.report[name] = dict(seconds=time.perf_counter() - start, error=str(e))
+            if self.logger is not None:
+                self.logger.warning(f"{name} plugin couldn't be loaded due to some missing packages or errors: {e}")
+            raise
+        self.report[name] = dict(seconds=time.perf_counter() - start, error=None)
+        if self.logger is not None:
+            self.logger.debug(f'{name} plugin imported in {self.report[name]["seconds"] * 1000:.1f} ms')
+        return module
+
+    def getattr(self, attribute: str):
+        name = self.find_module(attribute)
+        if name is None:
+            raise AttributeError(f'module {self.package!r} has no attribute {attribute!r}')
+        try:
+            module = self.load(name)
+        except Exception as e:
+            raise AttributeError(f'plugin {attribute!r} of {self.package!r} could not be imported') from e
+        return module if name == attribute else getattr(module, attribute)
+
+    def dir(self) -> List[str]:
+        """Names of the plugin modules and classes of the package"""
+        return sorted({attribute for name, classes in self.modules().items() for attribute in [name] + classes})
+
+
+def make_lazy_package(package: str, init_file: str, logger: logging.Logger = None) -> PluginIndex:
+    """Index the plugins of the package whose __init__ is init_file
+
+    The __getattr__ of the package is to be bound to the returned index (PEP 562), e.g.::
+
+        _index = make_lazy_package(__name__, __file__, logger)
+        __getattr__ = _index.getattr
+    """
+    index = PluginIndex(package, Path(init_file).parent, logger=logger)
+    _indexes.append(index)
+    return index
+
+
+def import_report() -> List[dict]:
+    """Import duration (s) and error of each plugin module loaded so far, slowest first"""
+    rows = [dict(module=f'{index.package}.{name}', **entry) for index in _indexes
+            for name, entry in index.report.items()]
+    return sorted(rows, key=lambda row: row['seconds'], reverse=True)
+
+
+if __name__ == '__main__':
+    # import every plugin of the package and print how long each took (the indexes are those of the package
+    # module, not of this __main__ one)
+    for package in ('daq_move_plugins', 'daq_viewer_plugins.plugins_0D', 'daq_viewer_plugins.plugins_1D',
+                    'daq_viewer_plugins.plugins_2D', 'daq_viewer_plugins.plugins_ND'):
+        plugins = importlib.import_module(f'pymodaq_plugins_MockXUV.{package}')
+        for module_name in plugins._index.modules():
+            try:
+                plugins._index.load(module_name)
+            except Exception:
+                pass
+    for row in importlib.import_module('pymodaq_plugins_MockXUV.plugin_index').import_report():
+        print(f"{row['seconds'] * 1000:10.1f} ms  {row['module']}  {row['error'] or ''}")
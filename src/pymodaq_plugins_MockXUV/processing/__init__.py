@@ -0,0 +1,4 @@
+# -*- coding: utf-8 -*-
+"""
+Numerical processing of the shot-by-shot data, used by the models
+"""
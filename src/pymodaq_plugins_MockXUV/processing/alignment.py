@@ -0,0 +1,66 @@
+import numpy as np
+
+from pymodaq_plugins_MockXUV.hardware.hhg_spectrum import shift_spectra
+
+
+class ShotAligner:
+    """Shot to shot alignment of spectra on a reference, by cross-correlation.
+
+    The shift of every shot of a chunk is measured at once: one batched real FFT of the chunk, a product with the
+    conjugated spectrum of the reference (computed once, in set_reference), one inverse FFT, then the peak of
+    each cross-correlation refined to a fraction of pixel by a parabola through its three highest points. The
+    FFTs are zero padded so the correlation is not circular, and the peak searched within max_shift pixels.
+    Shots and reference are centered and apodized (Hann window) first, otherwise the steps at the edges of the
+    spectra, which do not move with the shots, would dominate the correlation.
+    align then shifts back every shot (linear interpolation, see shift_spectra).
+    """
+
+    def __init__(self, max_shift: int = 20):
+        self.max_shift = max_shift
+        self.reference: np.ndarray = None
+        self._reference_fft: np.ndarray = None
+        self._window: np.ndarray = None
+        self._nfft = 0
+
+    @property
+    def has_reference(self) -> bool:
+        return self.reference is not None
+
+    def set_reference(self, reference: np.ndarray):
+        self.reference = np.array(reference, dtype=float)
+        npixels = self.reference.size
+        self._nfft = 1 << int(np.ceil(np.log2(npixels + min(self.max_shift, npixels - 1) + 1)))
+        self._window = np.hanning(npixels)
+        self._reference_fft = np.conj(np.fft.rfft(self._apodize(self.reference), n=self._nfft))
+
+    def _apodize(self, spectra: np.ndarray) -> np.ndarray:
+        apodized = spectra - spectra.mean(axis=-1, keepdims=True)
+        apodized *= self._window
+        return apodized
+
+    def clear_reference(self):
+        self.reference = None
+        self._reference_fft = None
+
+    def measure(self, shots: np.ndarray) -> np.ndarray:
+        """Shift (pixels) of each shot (row) of shots relative to the reference: row i is the reference
+        displaced by shifts[i] pixels towards the higher indices"""
+        if shots.shape[-1] != self.reference.size:
+            raise ValueError(f'Shots of {shots.shape[-1]} pixels aligned on a reference of {self.reference.size}')
+        correlation = np.fft.irfft(np.fft.rfft(self._apodize(shots), n=self._nfft, axis=-1) * self._reference_fft,
+                                   n=self._nfft, axis=-1)
+        # lags -max_shift..max_shift, the negative ones being at the end of the circular correlation
+        max_shift = min(self.max_shift, self.reference.size - 1)
+        lags = np.concatenate((correlation[:, -max_shift - 1:], correlation[:, :max_shift + 2]), axis=-1)
+        peak = np.argmax(lags[:, 1:-1], axis=-1) + 1
+        rows = np.arange(lags.shape[0])
+        left, center, right = lags[rows, peak - 1], lags[rows, peak], lags[rows, peak + 1]
+        curvature = left - 2 * center + right
+        with np.errstate(invalid='ignore', divide='ignore'):
+            offset = np.where(curvature < 0, 0.5 * (left - right) / curvature, 0.)
+        return peak - (max_shift + 1) + offset
+
+    def align(self, shots: np.ndarray):
+        """Shots shifted back onto the reference, and their measured shifts"""
+        shifts = self.measure(shots)
+        return shift_spectra(shots, -shifts), shifts
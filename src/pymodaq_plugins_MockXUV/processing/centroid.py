@@ -0,0 +1,40 @@
+import numpy as np
+
+
+class Centroider:
+    """Centroid and rms width of the spots of images of a given shape, from their first and second moments.
+
+    The moments are taken on the two projections of the images (one pass on the pixels each), against pixel
+    coordinates computed once, so a stack of frames (shape (..., ny, nx)) is processed in a few vectorized
+    reductions. Pixels below threshold (in counts, after subtracting background) are ignored.
+    """
+
+    def __init__(self, shape, threshold: float = 0.):
+        self.shape = tuple(shape)
+        self.threshold = threshold
+        self.y = np.arange(self.shape[0], dtype=float)
+        self.x = np.arange(self.shape[1], dtype=float)
+        self.background = 0.
+
+    def moments(self, frames: np.ndarray):
+        """Centroids and rms widths of frames, each an array of shape frames.shape[:-2] + (2,) with (y, x) last.
+        The centroid of an empty frame is nan."""
+        if frames.shape[-2:] != self.shape:
+            raise ValueError(f'Frames of shape {frames.shape[-2:]} given to a centroider of shape {self.shape}')
+        if self.threshold > 0 or np.any(self.background):
+            frames = frames - self.background
+            frames[frames < self.threshold] = 0
+        centroids = np.empty(frames.shape[:-2] + (2,))
+        widths = np.empty_like(centroids)
+        for axis, coordinates in ((0, self.y), (1, self.x)):
+            projection = frames.sum(axis=-1 if axis == 0 else -2)
+            total = projection.sum(axis=-1)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean = projection @ coordinates / total
+                variance = projection @ coordinates ** 2 / total - mean ** 2
+            centroids[..., axis] = mean
+            widths[..., axis] = np.sqrt(np.clip(variance, 0, None))
+        return centroids, widths
+
+    def centroid(self, frames: np.ndarray) -> np.ndarray:
+        return self.moments(frames)[0]
@@ -0,0 +1,150 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+DX_TO_SIGMA = 1 / (2 * np.sqrt(np.log(2)))  # dx of gauss1D (the FWHM of the square of the gaussian) to rms width
+
+
+class HarmonicFits:
+    """Gaussian parameters of each harmonic (columns) of each shot (rows), as the arguments of
+    models.dR_model.gaussian_fit (so widths are the dx of gauss1D)"""
+
+    def __init__(self, amplitude: np.ndarray, centre: np.ndarray, width: np.ndarray, offset: np.ndarray):
+        self.amplitude = amplitude
+        self.centre = centre
+        self.width = width
+        self.offset = offset
+
+
+class HarmonicIndexer:
+    """Windows of the harmonics of a HHG spectrum, found once in a reference spectrum, and their batched fits.
+
+    The harmonics are the maxima of the smoothed reference (over smoothing pixels) standing above its median by
+    more than threshold times its peak to median range, at least min_distance pixels apart. Each window spans
+    from the minimum between a harmonic and its previous neighbour to the minimum with its next one. The windows
+    are stored as one (nharmonics, length) array of pixel indexes (and weights masking the pixels beyond each
+    window), so that the harmonics of a whole chunk of shots are gathered in a single indexing.
+
+    fit then adjusts a gaussian on a constant offset to every harmonic of every shot at once: moments give the
+    starting point, refined by a few Levenberg-Marquardt iterations, each solving all the 4x4 normal equations in
+    one batched np.linalg.solve.
+    """
+
+    def __init__(self, reference: np.ndarray, pixels: np.ndarray = None, smoothing: int = 5, min_distance: int = 20,
+                 threshold: float = 0.1, iterations: int = 5):
+        self.reference = np.asarray(reference, dtype=float).ravel()
+        self.pixels = np.arange(self.reference.size, dtype=float) if pixels is None else np.asarray(pixels, float)
+        self.iterations = iterations
+
+        smoothed = np.convolve(self.reference, np.ones(smoothing) / smoothing, mode='same')
+        neighbourhood = np.pad(smoothed, min_distance, mode='edge')
+        local_max = sliding_window_view(neighbourhood, 2 * min_distance + 1).max(axis=-1)
+        baseline = np.median(smoothed)
+        peaks = np.flatnonzero((smoothed == local_max) & (smoothed > baseline + threshold * (smoothed.max() - baseline)))
+        peaks = peaks[np.diff(peaks, prepend=-min_distance - 1) > min_distance]  # flat tops give several maxima
+        self.peaks = peaks
+
+        bounds = [0] + [peaks[i] + int(np.argmin(smoothed[peaks[i]:peaks[i + 1]])) for i in range(peaks.size - 1)]
+        bounds.append(self.reference.size)
+        starts = np.array(bounds[:-1] if peaks.size else [], dtype=int)  # no window without harmonics
+        stops = np.array(bounds[1:] if peaks.size else [], dtype=int)
+        if peaks.size > 1:  # the first and last windows are as wide as their neighbours, not up to the edges
+            starts[0] = max(0, peaks[0] - (stops[0] - peaks[0]))
+            stops[-1] = min(self.reference.size, peaks[-1] + (peaks[-1] - starts[-1]))
+        self.windows = np.stack((starts, stops), axis=1)
+        length = int((stops - starts).max()) if peaks.size else 0
+        self.indexes = np.minimum(starts[:, None] + np.arange(length), self.reference.size - 1)
+        self.weights = (starts[:, None] + np.arange(length) < stops[:, None]).astype(float)
+        self._x = self.pixels[self.indexes]
+        # centres are kept within their window and widths between a pixel and the window width (rms)
+        self._lowest = self.pixels[starts][:, None] if peaks.size else np.empty((0, 1))
+        self._highest = self.pixels[stops - 1][:, None] if peaks.size else np.empty((0, 1))
+        self._min_sigma = np.abs(np.diff(self.pixels[:2])).item() / 2 if self.pixels.size > 1 else 0.5
+
+    @property
+    def n_harmonics(self) -> int:
+        return self.peaks.size
+
+    def fit(self, spectra: np.ndarray) -> HarmonicFits:
+        """Fit the harmonics of spectra, of shape (nshots, npixels) or (npixels,) (then the fits are of shape
+        (nharmonics,)), the fits being empty (nharmonics = 0) if the reference has no harmonic"""
+        single = spectra.ndim == 1
+        spectra = np.atleast_2d(spectra)
+        if spectra.shape[1] != self.reference.size:
+            raise ValueError(f'Spectra of {spectra.shape[1]} pixels fitted on windows of {self.reference.size}')
+        if self.n_harmonics == 0:
+            fits = HarmonicFits(*(np.empty((spectra.shape[0], 0)) for _ in range(4)))
+        else:
+            fits = self._fit(spectra)
+        if single:
+            fits = HarmonicFits(*(getattr(fits, name)[0] for name in ('amplitude', 'centre', 'width', 'offset')))
+        return fits
+
+    def _fit(self, spectra: np.ndarray) -> HarmonicFits:
+        """Fit the harmonics (at least one) of spectra, of shape (nshots, npixels)"""
+        y = spectra[:, self.indexes]  # (nshots, nharmonics, length)
+        weights = self.weights
+        x = self._x
+
+        # moments of the peaks above their minimum as starting point
+        offset = np.where(weights > 0, y, np.inf).min(axis=-1)
+        signal = (y - offset[..., None]) * weights
+        total = signal.sum(axis=-1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            centre = (signal * x).sum(axis=-1) / total
+            sigma = np.sqrt(np.clip((signal * x ** 2).sum(axis=-1) / total - centre ** 2, 1e-2, None))
+        amplitude = np.where(weights > 0, y, -np.inf).max(axis=-1) - offset
+        parameters = np.stack((amplitude, centre, sigma, offset), axis=-1)
+        parameters = np.nan_to_num(parameters, nan=1.)
+
+        # derivatives along the pixels (for matmul), zero beyond the windows: as the weights are 0 or 1, the
+        # normal matrix and vector are then plain products with the jacobian
+        jacobian = np.empty(y.shape[:2] + (4,) + y.shape[2:])
+        jacobian[..., 3, :] = weights
+        reduced = np.empty_like(y)
+        residuals = np.empty_like(y)
+        # Levenberg-Marquardt: a fit whose step increased its residuals goes back to its best parameters and
+        # takes a shorter step from there, with the normal equations kept from their evaluation
+        best = parameters.copy()
+        best_cost = np.full(parameters.shape[:2], np.inf)
+        best_normal = np.zeros(parameters.shape[:2] + (4, 4))
+        best_vector = np.zeros(parameters.shape[:2] + (4, 1))
+        damping = np.full(parameters.shape[:2], 1e-3)
+        for iteration in range(self.iterations + 1):
+            amplitude, centre, sigma, offset = (parameters[..., index, None] for index in range(4))
+            np.subtract(x, centre, out=reduced)
+            reduced /= sigma
+            gaussian = jacobian[..., 0, :]
+            np.square(reduced, out=gaussian)
+            gaussian *= -0.5
+            np.exp(gaussian, out=gaussian)
+            np.multiply(gaussian, amplitude, out=residuals)
+            residuals += offset
+            np.subtract(y, residuals, out=residuals)
+            residuals *= weights
+            cost = np.einsum('shl,shl->sh', residuals, residuals)
+            improved = cost <= best_cost
+            if iteration == self.iterations:
+                best[improved] = parameters[improved]
+                break
+
+            gaussian *= weights
+            np.multiply(gaussian, reduced, out=jacobian[..., 1, :])
+            jacobian[..., 1, :] *= amplitude / sigma
+            np.multiply(jacobian[..., 1, :], reduced, out=jacobian[..., 2, :])
+            best[improved] = parameters[improved]
+            best_cost[improved] = cost[improved]
+            best_normal[improved] = (jacobian @ np.swapaxes(jacobian, -1, -2))[improved]
+            best_vector[improved] = (jacobian @ residuals[..., None])[improved]
+            damping = np.where(improved, damping / 3, damping * 4)
+
+            normal = best_normal + (damping[..., None] * np.diagonal(best_normal, axis1=-2, axis2=-1))[..., None] \
+                * np.eye(4)
+            normal += 1e-12 * np.eye(4)  # keeps empty windows invertible
+            parameters = best + np.linalg.solve(normal, best_vector)[..., 0]
+            np.clip(parameters[..., 1], self._lowest[:, 0], self._highest[:, 0], out=parameters[..., 1])
+            np.clip(parameters[..., 2], self._min_sigma, self._highest[:, 0] - self._lowest[:, 0],
+                    out=parameters[..., 2])
+        parameters = best
+
+        amplitude, centre, sigma, offset = np.moveaxis(parameters, -1, 0)
+        return HarmonicFits(amplitude, centre, sigma / DX_TO_SIGMA, offset)
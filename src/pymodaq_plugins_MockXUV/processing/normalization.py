@@ -0,0 +1,68 @@
+import numpy as np
+
+NORMALIZATIONS = ('none', 'reference', 'fit')
+
+
+def region_slices(regions: str) -> list:
+    """Slices of the pixel regions written as comma separated python slices, e.g. '0:100, 850:', a single slice of
+    all the pixels when regions is empty. Raise ValueError if regions cannot be parsed."""
+    if not regions.strip():
+        return [slice(None)]
+    slices = []
+    for region in regions.split(','):
+        try:
+            bounds = [int(bound) if bound.strip() else None for bound in region.split(':')]
+        except ValueError:
+            bounds = []
+        if len(bounds) != 2:
+            raise ValueError(f'Invalid pixel region {region.strip()!r}, expected start:stop')
+        slices.append(slice(*bounds))
+    return slices
+
+
+class CommonModeNormalizer:
+    """Removal of the shot to shot intensity fluctuations common to a pump-on shot and its pump-off partner.
+
+    Each pump-on shot is divided by its intensity ratio to the pump-off shot of its pair, measured on reference
+    regions of pixels (see region_slices) chosen outside of the band sensitive to the pump, either as the ratio
+    of their counts (mode 'reference') or as the least squares scale factor of pon = ratio * poff (mode 'fit').
+    The counts in the regions are matrix-vector products with the region weights, so a chunk is normalized in a
+    few vectorized passes.
+    """
+
+    def __init__(self, mode: str = 'reference', regions: str = ''):
+        if mode not in NORMALIZATIONS:
+            raise ValueError(f'Unknown normalization {mode}, expected one of {NORMALIZATIONS}')
+        self.mode = mode
+        self.regions = ''
+        self._slices = [slice(None)]
+        self._weights: np.ndarray = None
+        self.set_regions(regions)
+
+    def weights(self, npixels: int) -> np.ndarray:
+        """Weights (1 inside, 0 outside) of the reference regions over npixels pixels"""
+        if self._weights is None or self._weights.size != npixels:
+            self._weights = np.zeros(npixels)
+            for region in self._slices:
+                self._weights[region] = 1.
+        return self._weights
+
+    def set_regions(self, regions: str):
+        """Use the reference regions of regions (see region_slices), the previous ones being kept if it is invalid
+        (ValueError)"""
+        self._slices = region_slices(regions)
+        self.regions = regions
+        self._weights = None
+
+    def ratios(self, pon: np.ndarray, poff: np.ndarray) -> np.ndarray:
+        """Intensity ratio of the pump-on to the pump-off shot of each pair (row)"""
+        weights = self.weights(pon.shape[1])
+        if self.mode == 'none':
+            return np.ones(pon.shape[0])
+        if self.mode == 'reference':
+            return (pon @ weights) / (poff @ weights)
+        return np.einsum('ij,ij,j->i', pon, poff, weights) / np.einsum('ij,ij,j->i', poff, poff, weights)
+
+    def normalize(self, pon: np.ndarray, poff: np.ndarray) -> np.ndarray:
+        """pon divided by the ratios of the pairs, in a new array"""
+        return pon / self.ratios(pon, poff)[:, None]
@@ -0,0 +1,101 @@
+import numpy as np
+
+MAD_TO_SIGMA = 1.4826  # ratio of the standard deviation to the median absolute deviation of a gaussian
+
+
+def shot_metrics(shots: np.ndarray, reference: np.ndarray) -> np.ndarray:
+    """Metrics of each shot (row) of shots, shape (nshots, 2): the total counts and the correlation coefficient of
+    the shot with the reference (0 for a flat shot)"""
+    metrics = np.empty((shots.shape[0], 2))
+    np.sum(shots, axis=1, out=metrics[:, 0])
+    centered = shots - (metrics[:, :1] / shots.shape[1])
+    reference = reference - reference.mean()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        metrics[:, 1] = centered @ reference / (np.sqrt(np.einsum('ij,ij->i', centered, centered))
+                                                * np.sqrt(reference @ reference))
+    np.nan_to_num(metrics[:, 1], copy=False, nan=0.)
+    return metrics
+
+
+class RobustStats:
+    """Median and median absolute deviation of the last window values of a few metrics, updated by chunks.
+
+    The values are kept in a ring buffer of shape (window, nmetrics), so the statistics follow slow changes of
+    the source and cost one median of the buffer per chunk, whatever the number of shots seen.
+    """
+
+    def __init__(self, window: int = 1000):
+        self.window = window
+        self.count = 0
+        self.median: np.ndarray = None
+        self.mad: np.ndarray = None
+        self._values: np.ndarray = None
+        self._index = 0
+
+    def reset(self):
+        self.count = 0
+        self.median = None
+        self.mad = None
+        self._values = None
+        self._index = 0
+
+    def update(self, values: np.ndarray):
+        """Add the rows of values, of shape (nvalues, nmetrics)"""
+        if self._values is None or self._values.shape[1] != values.shape[1]:
+            self._values = np.empty((self.window, values.shape[1]))
+            self.count = 0
+            self._index = 0
+        values = values[-self.window:]
+        indexes = (self._index + np.arange(values.shape[0])) % self.window
+        self._values[indexes] = values
+        self._index = (indexes[-1] + 1) % self.window if values.shape[0] else self._index
+        self.count = min(self.count + values.shape[0], self.window)
+
+        filled = self._values[:self.count]
+        self.median = np.median(filled, axis=0)
+        self.mad = np.median(np.abs(filled - self.median), axis=0)
+
+    def zscores(self, values: np.ndarray) -> np.ndarray:
+        """Robust distance of values to the median, in standard deviations"""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            zscores = np.abs(values - self.median) / (MAD_TO_SIGMA * self.mad)
+        zscores[np.isnan(zscores)] = 0.  # a metric not varying at all
+        return zscores
+
+
+class OutlierRejector:
+    """Rejection of the pump-on/pump-off pairs of shots having an outlier shot (misfire, gas burst, saturation...).
+
+    A shot is an outlier when one of its metrics (see shot_metrics) is more than threshold robust standard
+    deviations away from the median of the recent shots of the same pump state (see RobustStats). The reference
+    of the correlation is the median pump off spectrum of the first chunk, unless given. The counts of accepted
+    and rejected pairs are accumulated until reset.
+    """
+
+    def __init__(self, threshold: float = 5., window: int = 1000):
+        self.threshold = threshold
+        self.stats = (RobustStats(window), RobustStats(window))  # pump on, pump off
+        self.reference: np.ndarray = None
+        self.accepted = 0
+        self.rejected = 0
+
+    def reset(self):
+        for stats in self.stats:
+            stats.reset()
+        self.reference = None
+        self.accepted = 0
+        self.rejected = 0
+
+    def accept(self, pon: np.ndarray, poff: np.ndarray) -> np.ndarray:
+        """Boolean mask of the pairs (rows of pon and poff) to keep"""
+        if self.reference is None:
+            self.reference = np.median(poff, axis=0)
+        keep = np.ones(pon.shape[0], dtype=bool)
+        for shots, stats in zip((pon, poff), self.stats):
+            metrics = shot_metrics(shots, self.reference)
+            stats.update(metrics)
+            keep &= np.all(stats.zscores(metrics) <= self.threshold, axis=1)
+        n_accepted = int(np.count_nonzero(keep))
+        self.accepted += n_accepted
+        self.rejected += keep.size - n_accepted
+        return keep
@@ -0,0 +1,57 @@
+import time
+
+import numpy as np
+
+
+def bin_edges(size: int, binning: int) -> np.ndarray:
+    """First index of each bin of binning elements along an axis of size elements, the last one possibly shorter"""
+    return np.arange(0, size, max(1, binning))
+
+
+def _bin_rows(array: np.ndarray, binning: int) -> np.ndarray:
+    """Sum (as floats) of array over blocks of binning rows, the whole blocks through a reshaped view"""
+    binning = max(1, binning)
+    n_whole = array.shape[0] // binning
+    binned = np.empty((bin_edges(array.shape[0], binning).size,) + array.shape[1:])
+    np.sum(array[:n_whole * binning].reshape((n_whole, binning) + array.shape[1:]), axis=1, dtype=np.float64,
+           out=binned[:n_whole])
+    if n_whole < binned.shape[0]:
+        np.sum(array[n_whole * binning:], axis=0, dtype=np.float64, out=binned[-1])
+    return binned
+
+
+def bin_image(image: np.ndarray, shot_binning: int, pixel_binning: int) -> np.ndarray:
+    """Mean of image (shots x pixels) over blocks of shot_binning shots and pixel_binning pixels.
+
+    Shots are binned first, summing a reshaped view of the image: only the binned arrays are allocated, never a
+    copy of the (contiguous) image, whatever its dtype (integer counts are summed as floats).
+    """
+    binned = _bin_rows(image, shot_binning)
+    if pixel_binning > 1:
+        binned = _bin_rows(binned.T, pixel_binning).T
+    binned /= np.diff(bin_edges(image.shape[0], shot_binning), append=image.shape[0])[:, None]
+    binned /= np.diff(bin_edges(image.shape[1], pixel_binning), append=image.shape[1])
+    return binned
+
+
+class PreviewThrottle:
+    """Rate limiter of a live display: due is True at most max_rate times per second (always if max_rate <= 0)"""
+
+    def __init__(self, max_rate: float = 30.):
+        self.max_rate = max_rate
+        self._last = None
+        self._period = 0.
+
+    def due(self) -> bool:
+        now = time.perf_counter()
+        if self.max_rate > 0 and self._last is not None and now - self._last < 1 / self.max_rate:
+            return False
+        if self._last is not None:
+            self._period = now - self._last
+        self._last = now
+        return True
+
+    @property
+    def rate(self) -> float:
+        """Actual rate of the previews, from the last two"""
+        return 1 / self._period if self._period > 0 else 0.
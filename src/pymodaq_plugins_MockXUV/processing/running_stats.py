@@ -0,0 +1,57 @@
+import numpy as np
+
+
+class RunningStats:
+    """Running mean and variance along the first (shot) axis over any number of chunks.
+
+    Chunks are merged with the pairwise update of Chan et al. (Welford's algorithm generalized to batches),
+    so memory stays that of one mean and one sum of squares whatever the number of shots. Feeding a chunk
+    whose per shot shape differs from the previous ones restarts the statistics.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean: np.ndarray = None
+        self._m2: np.ndarray = None
+
+    def reset(self):
+        self.count = 0
+        self.mean = None
+        self._m2 = None
+
+    def update(self, chunk: np.ndarray):
+        """Add the shots of chunk, an array of shape (nshots, ...)"""
+        n_chunk = chunk.shape[0]
+        if n_chunk == 0:
+            return
+        mean_chunk = chunk.mean(axis=0)
+        m2_chunk = chunk.var(axis=0) * n_chunk
+
+        if self.count == 0 or self.mean.shape != mean_chunk.shape:
+            self.count = n_chunk
+            self.mean = mean_chunk
+            self._m2 = m2_chunk
+            return
+
+        total = self.count + n_chunk
+        delta = mean_chunk - self.mean
+        self.mean += delta * (n_chunk / total)
+        delta **= 2
+        delta *= self.count * n_chunk / total
+        self._m2 += m2_chunk
+        self._m2 += delta
+        self.count = total
+
+    @property
+    def variance(self) -> np.ndarray:
+        """Unbiased variance of the shots"""
+        if self.count < 2:
+            return np.zeros_like(self.mean)
+        return self._m2 / (self.count - 1)
+
+    @property
+    def std_error(self) -> np.ndarray:
+        """Standard error on the mean"""
+        if self.count < 2:
+            return np.zeros_like(self.mean)
+        return np.sqrt(self.variance / self.count)
@@ -0,0 +1,122 @@
+import time
+from typing import Callable
+
+import numpy as np
+
+
+class DelayBinner:
+    """Average of shots (rows) falling in delay bins, kept separately for each sweep direction.
+
+    Shots are binned by chunks, with one sorting pass and a reduceat per chunk. Forward (direction 0) and backward
+    (direction 1) sweeps visit a given delay at times symmetric about the middle of a back and forth, so a
+    linear drift cancels in their average (see mean), while their difference (see drift) measures it.
+    """
+
+    def __init__(self, edges: np.ndarray, row_shape):
+        self.edges = np.asarray(edges, dtype=float)
+        self.n_bins = self.edges.size - 1
+        self.sums = np.zeros((2, self.n_bins) + tuple(np.atleast_1d(row_shape)))
+        self.counts = np.zeros((2, self.n_bins), dtype=np.int64)
+
+    @property
+    def centers(self) -> np.ndarray:
+        return (self.edges[:-1] + self.edges[1:]) / 2
+
+    def add(self, delays: np.ndarray, rows: np.ndarray, direction: int = 0):
+        """Accumulate rows (one per shot) acquired at delays (one per shot)"""
+        bins = np.searchsorted(self.edges, delays, side='right') - 1
+        inside = (bins >= 0) & (bins < self.n_bins)
+        bins = bins[inside]
+        if bins.size == 0:
+            return
+        rows = rows[inside]
+        order = np.argsort(bins, kind='stable')
+        bins = bins[order]
+        starts = np.flatnonzero(np.diff(bins, prepend=-1))
+        self.sums[direction, bins[starts]] += np.add.reduceat(rows[order], starts, axis=0)
+        self.counts[direction] += np.bincount(bins, minlength=self.n_bins)
+
+    def mean(self, direction: int = None) -> np.ndarray:
+        """Average of the shots of each bin, of one direction or of both, nan for empty bins"""
+        sums = self.sums.sum(axis=0) if direction is None else self.sums[direction]
+        counts = self.counts.sum(axis=0) if direction is None else self.counts[direction]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return sums / counts.reshape(counts.shape + (1,) * (sums.ndim - 1))
+
+    def drift(self) -> np.ndarray:
+        """Difference between the forward and backward averages"""
+        return self.mean(0) - self.mean(1)
+
+
+class ContinuousSweep:
+    """Delay scan sweeping the stage at constant velocity while acquiring, instead of stepping and settling.
+
+    Each chunk returned by grab (one row per shot) is tagged with delays interpolated linearly between the stage
+    positions read just before and just after it was grabbed, then binned in bins of bin_width. With
+    back_and_forth, the sweeps alternate in direction (start to stop, then stop to start...), otherwise the stage
+    flies back to start between sweeps.
+
+    The stage is any object with the velocity attribute and the move_at and get_value methods of MockDelayStage.
+    """
+
+    def __init__(self, stage, grab: Callable[[], np.ndarray], start: float, stop: float, velocity: float,
+                 bin_width: float, n_sweeps: int = 1, back_and_forth: bool = True):
+        self.stage = stage
+        self.grab = grab
+        self.start = start
+        self.stop = stop
+        self.velocity = velocity
+        self.n_sweeps = n_sweeps
+        self.back_and_forth = back_and_forth
+        self.edges = np.arange(min(start, stop), max(start, stop) + bin_width / 2, bin_width)
+        self.binner: DelayBinner = None
+        self.n_chunks = 0
+        self.duration = 0.
+
+    def sweeps(self) -> list:
+        """(from, to, direction) of each sweep"""
+        sweeps = []
+        for index in range(self.n_sweeps):
+            backward = self.back_and_forth and index % 2 == 1
+            sweeps.append((self.stop, self.start, 1) if backward else (self.start, self.stop, 0))
+        return sweeps
+
+    def run(self) -> DelayBinner:
+        start_time = time.perf_counter()
+        velocity = self.stage.velocity
+        try:
+            for begin, end, direction in self.sweeps():
+                self.stage.velocity = 0.
+                self.stage.move_at(begin)
+                self.stage.velocity = self.velocity
+                self.stage.move_at(end)
+                self._acquire_sweep(end, direction)
+        finally:
+            self.stage.velocity = velocity
+        self.duration = time.perf_counter() - start_time
+        return self.binner
+
+    def _acquire_sweep(self, end: float, direction: int):
+        delay_before = self.stage.get_value()
+        while True:
+            rows = self.grab()
+            delay_after = self.stage.get_value()
+            if self.binner is None:
+                self.binner = DelayBinner(self.edges, rows.shape[1:])
+            self.binner.add(np.linspace(delay_before, delay_after, rows.shape[0]), rows, direction)
+            self.n_chunks += 1
+            if delay_after == end:
+                break
+            delay_before = delay_after
+
+
+def pump_probe_grab(simulator, nframes: int) -> Callable[[], np.ndarray]:
+    """grab function giving the dR/R of each pump-on/pump-off pair of shots of a Mock_SingleShot like simulator"""
+    def grab() -> np.ndarray:
+        chunk = simulator.grab_XUV(nframes)
+        pon, poff = (chunk[0::2], chunk[1::2]) if simulator.FirstShotIsPumpOn else (chunk[1::2], chunk[0::2])
+        dR_over_R = pon / poff
+        dR_over_R -= 1
+        simulator.release(chunk)
+        return dR_over_R
+    return grab
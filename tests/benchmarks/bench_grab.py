@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""
+Headless benchmarks of the mock detectors grab paths and of the dR/R model
+
+Run from the repository root::
+
+    python tests/benchmarks/bench_grab.py                # print the results
+    python tests/benchmarks/bench_grab.py --save         # store them as the new baseline
+    python tests/benchmarks/bench_grab.py --compare      # exit with 1 if a case regressed from the baseline
+    python tests/benchmarks/bench_grab.py --farm 8       # aggregate throughput of 8 farm cameras vs workers
+
+The speed of each case is compared as its shot rate relative to that of a reference numpy workload measured in
+the same run (see bench_reference), so that a baseline saved on one machine still holds on another one. Peak
+memories are compared as such.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+
+from pymodaq_data.data import DataToExport, DataRaw
+from pymodaq_gui.parameter import Parameter
+
+from pymodaq_plugins_MockXUV.daq_viewer_plugins.plugins_1D.daq_1Dviewer_XUVSpectrum import DAQ_1DViewer_XUVSpectrum
+from pymodaq_plugins_MockXUV.daq_viewer_plugins.plugins_2D.daq_2Dviewer_MockCMOS import DAQ_2DViewer_MockCMOS
+from pymodaq_plugins_MockXUV.daq_viewer_plugins.plugins_2D.daq_2Dviewer_MockStabCamera import \
+    DAQ_2DViewer_MockStabCamera
+from pymodaq_plugins_MockXUV.hardware.cmos_simulator import resample
+from pymodaq_plugins_MockXUV.hardware.simulator_farm import SimulatorFarm
+from pymodaq_plugins_MockXUV.models.dR_model import DataMixerModelDeltaR
+
+BASELINE_PATH = Path(__file__).parent.joinpath('baseline.json')
+
+CHUNK_SIZES = (100, 1000)
+PIXELS = (512, 2048)
+CMOS_OUTPUTS = (('twod_image',), ('ponoff',), ('dRoverR',), ('twod_image', 'ponoff', 'dRoverR'))
+
+
+class Sink:
+    """Counts what a plugin emits"""
+
+    def __init__(self):
+        self.nbytes = 0
+        self.ngrabs = 0
+
+    def __call__(self, dte: DataToExport):
+        self.ngrabs += 1
+        self.nbytes += sum(array.nbytes for dwa in dte for array in dwa.data)
+
+
+def prepare_cmos(chunk_size: int, npixels: int, outputs=('twod_image',)):
+    plugin = DAQ_2DViewer_MockCMOS()
+    plugin.settings.child('sleep_time').setValue(0)
+    plugin.settings.child('chunk_size').setValue(chunk_size)
+    for output in ('twod_image', 'ponoff', 'dRoverR'):
+        plugin.settings.child(output).setValue(output in outputs)
+    plugin.ini_detector()
+    controller = plugin.controller
+    controller.pon, controller.poff = resample(controller.pon, npixels), resample(controller.poff, npixels)
+    plugin.set_axes()
+    return plugin, 2 * (chunk_size // 2)
+
+
+def prepare_stab(chunk_size: int, npixels: int, outputs=()):
+    plugin = DAQ_2DViewer_MockStabCamera()
+    plugin.settings.child('sleep_time').setValue(0)
+    plugin.settings.child('chunk_size').setValue(chunk_size)
+    plugin.ini_detector()
+    controller = plugin.controller
+    controller.stabpon = np.ones((npixels, 1))
+    controller.stabpoff = np.zeros((npixels, 1))
+    return plugin, 2 * (chunk_size // 2)
+
+
+def prepare_spectrum(chunk_size: int, npixels: int, outputs=()):
+    plugin = DAQ_1DViewer_XUVSpectrum()
+    plugin.settings.child('timing_opts', 'chunk_size').setValue(chunk_size)
+    plugin.settings.child('timing_opts', 'batched').setValue(True)
+    plugin.ini_detector()
+    plugin.controller.data = resample(plugin.controller.data, npixels)
+    plugin.clear_roi()  # the spectra are made from the data of the region of interest
+    return plugin, chunk_size
+
+
+def make_dR_model(chunk_size: int, npixels: int):
+    """Build a DataMixerModelDeltaR outside of a dashboard together with a chunk to process"""
+    rng = np.random.default_rng(0)
+    image = DataRaw('Image', data=[1000 + rng.random((chunk_size, npixels))])
+    image.origin = 'CMOS'
+    onoff = DataRaw('OnOff', data=[np.tile([1., 0.], chunk_size // 2)])
+    onoff.origin = 'Stab'
+    dte = DataToExport('bench', data=[image, onoff])
+
+    settings = Parameter.create(name='settings', type='group', children=[
+        {'name': 'models', 'type': 'group', 'children': [
+            {'name': 'model_params', 'type': 'group', 'children': DataMixerModelDeltaR.params}]}])
+    modules_manager = SimpleNamespace(get_det_data_list=lambda: dte)
+    model = DataMixerModelDeltaR(SimpleNamespace(settings=settings,
+                                                 dashboard=SimpleNamespace(modules_manager=modules_manager)))
+    model.ini_model()
+    return model, dte
+
+
+def bench_plugin(prepare, chunk_size: int, npixels: int, outputs=(), ngrabs=20) -> dict:
+    plugin, nshots = prepare(chunk_size, npixels, outputs)
+    sink = Sink()
+    plugin.dte_signal.connect(sink)
+    plugin.grab_data()  # warm up the buffers
+
+    sink.nbytes = 0
+    start = time.perf_counter()
+    for _ in range(ngrabs):
+        plugin.grab_data()
+    elapsed = time.perf_counter() - start
+    nbytes = sink.nbytes
+
+    tracemalloc.start()
+    for _ in range(3):
+        plugin.grab_data()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    plugin.close()
+    return dict(shots_per_s=ngrabs * nshots / elapsed, bytes_per_s=nbytes / elapsed, peak_memory=peak)
+
+
+def bench_dR_model(chunk_size: int, npixels: int, ngrabs=20) -> dict:
+    model, dte = make_dR_model(chunk_size, npixels)
+    model.process_dte(dte)
+    start = time.perf_counter()
+    for _ in range(ngrabs):
+        model.process_dte(dte)
+    elapsed = time.perf_counter() - start
+    nbytes = dte.get_data_from_name('Image')[0].nbytes * ngrabs
+
+    tracemalloc.start()
+    model.process_dte(dte)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return dict(shots_per_s=ngrabs * chunk_size / elapsed, bytes_per_s=nbytes / elapsed, peak_memory=peak)
+
+
+def bench_farm(n_cameras: int, n_workers: int, chunk_size=100, npixels=2048, duration=2.) -> dict:
+    """Aggregate shot rate of n_cameras free running farm cameras hosted by n_workers processes"""
+    farm = SimulatorFarm(n_workers=n_workers)
+    try:
+        cameras = [farm.add_camera(nframes=chunk_size // 2, n_pixels=npixels, seed=ind, amp_noise=1000.)
+                   for ind in range(n_cameras)]
+        for camera in cameras:  # wait for the processes to be started
+            camera.release(camera.grab_XUV(chunk_size // 2))
+        nshots = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < duration:
+            for camera in cameras:
+                chunk = camera.grab_XUV(chunk_size // 2)
+                nshots += chunk.shape[0]
+                camera.release(chunk)
+        elapsed = time.perf_counter() - start
+        stats = farm.stats()
+    finally:
+        farm.close()
+    return dict(shots_per_s=nshots / elapsed, cameras={name: stats[name] for name in stats if name != 'total'})
+
+
+def bench_reference(chunk_size=1000, npixels=2048, ngrabs=20) -> dict:
+    """Shot rate of plain numpy work on chunks (noise generation, column means), a measure of the machine speed"""
+    rng = np.random.default_rng(0)
+    chunk = np.empty((chunk_size, npixels))
+    rng.random(out=chunk)
+    start = time.perf_counter()
+    for _ in range(ngrabs):
+        rng.random(out=chunk)
+        chunk[0::2].mean(axis=0)
+        chunk[1::2].mean(axis=0)
+    elapsed = time.perf_counter() - start
+    return dict(shots_per_s=ngrabs * chunk_size / elapsed)
+
+
+def run_suite(chunk_sizes=CHUNK_SIZES, pixels=PIXELS, cmos_outputs=CMOS_OUTPUTS, ngrabs=20) -> dict:
+    """Run every benchmark case, return a mapping from case name to its metrics, relative_speed being the shot
+    rate of the case over that of the reference workload"""
+    reference = bench_reference(ngrabs=ngrabs)['shots_per_s']
+    results = {}
+    for chunk_size, npixels in itertools.product(chunk_sizes, pixels):
+        size = f'chunk{chunk_size}-pix{npixels}'
+        for outputs in cmos_outputs:
+            results[f'MockCMOS-{size}-{"+".join(outputs)}'] = bench_plugin(prepare_cmos, chunk_size, npixels,
+                                                                           outputs, ngrabs)
+        results[f'MockStabCamera-{size}'] = bench_plugin(prepare_stab, chunk_size, npixels, ngrabs=ngrabs)
+        results[f'XUVSpectrum-{size}'] = bench_plugin(prepare_spectrum, chunk_size, npixels, ngrabs=ngrabs)
+        results[f'DeltaR-{size}'] = bench_dR_model(chunk_size, npixels, ngrabs)
+    for metrics in results.values():
+        metrics['relative_speed'] = metrics['shots_per_s'] / reference
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance=0.3) -> list:
+    """List the cases slower (relative to the reference workload) or more memory hungry than the baseline by more
+    than tolerance (relative)"""
+    regressions = []
+    for case, metrics in results.items():
+        reference = baseline.get(case)
+        if reference is None:
+            continue
+        if metrics['relative_speed'] < reference['relative_speed'] * (1 - tolerance):
+            regressions.append(f"{case}: {metrics['relative_speed']:.3f} x the reference shot rate "
+                               f"(baseline {reference['relative_speed']:.3f})")
+        if metrics['peak_memory'] > reference['peak_memory'] * (1 + tolerance):
+            regressions.append(f"{case}: peak memory {metrics['peak_memory']} B "
+                               f"(baseline {reference['peak_memory']} B)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--save', action='store_true', help='store the results as the baseline')
+    parser.add_argument('--compare', action='store_true', help='compare the results with the baseline')
+    parser.add_argument('--baseline', type=Path, default=BASELINE_PATH)
+    parser.add_argument('--tolerance', type=float, default=0.3)
+    parser.add_argument('--ngrabs', type=int, default=20)
+    parser.add_argument('--farm', type=int, default=0, metavar='NCAMERAS',
+                        help='measure the scaling of the simulator farm with the number of workers instead')
+    args = parser.parse_args()
+
+    if args.farm > 0:
+        for n_workers in sorted({1, 2, 4, os.cpu_count() or 1, args.farm}):
+            if n_workers <= args.farm:
+                result = bench_farm(args.farm, n_workers)
+                print(f"{args.farm} cameras on {n_workers:3d} workers {result['shots_per_s']:12.0f} shots/s")
+        return 0
+
+    results = run_suite(ngrabs=args.ngrabs)
+    for case, metrics in results.items():
+        print(f"{case:60s} {metrics['shots_per_s']:12.0f} shots/s ({metrics['relative_speed']:6.3f} x ref) "
+              f"{metrics['bytes_per_s'] / 1e6:10.1f} MB/s {metrics['peak_memory'] / 1e6:8.2f} MB peak")
+
+    if args.save:
+        meta = dict(python=platform.python_version(), numpy=np.__version__, machine=platform.machine(),
+                    processor=platform.processor())
+        args.baseline.write_text(json.dumps(dict(meta=meta, results=results), indent=2))
+    if args.compare:
+        regressions = compare(results, json.loads(args.baseline.read_text())['results'], args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
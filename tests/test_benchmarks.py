@@ -0,0 +1,20 @@
+from benchmarks.bench_grab import run_suite, compare
+
+
+def test_benchmark_suite_runs_headless():
+    results = run_suite(chunk_sizes=(10,), pixels=(64,), cmos_outputs=(('twod_image', 'ponoff', 'dRoverR'),),
+                        ngrabs=2)
+    assert set(results) == {'MockCMOS-chunk10-pix64-twod_image+ponoff+dRoverR', 'MockStabCamera-chunk10-pix64',
+                            'XUVSpectrum-chunk10-pix64', 'DeltaR-chunk10-pix64'}
+    for metrics in results.values():
+        assert metrics['shots_per_s'] > 0
+        assert metrics['bytes_per_s'] > 0
+        assert metrics['relative_speed'] > 0
+
+
+def test_compare_flags_regressions():
+    baseline = {'case': dict(shots_per_s=1000., relative_speed=1., peak_memory=100)}
+    # a slower machine: the absolute rate does not matter, the rate relative to the reference does
+    assert compare({'case': dict(shots_per_s=100., relative_speed=0.9, peak_memory=110)}, baseline) == []
+    assert len(compare({'case': dict(shots_per_s=5000., relative_speed=0.5, peak_memory=200)}, baseline)) == 2
+    assert compare({'new case': dict(shots_per_s=1., relative_speed=1., peak_memory=1)}, baseline) == []
@@ -0,0 +1,385 @@
+import os
+import time
+
+import h5py
+import numpy as np
+import pytest
+
+from pymodaq_plugins_MockXUV.hardware.frame_pool import FramePool
+from pymodaq_plugins_MockXUV.hardware.cmos_simulator import Mock_SingleShot
+from pymodaq_plugins_MockXUV.hardware.chunk_producer import ChunkProducer
+from pymodaq_plugins_MockXUV.hardware.noise import NoiseGenerator
+from pymodaq_plugins_MockXUV.hardware.asset_cache import AssetCache
+from pymodaq_plugins_MockXUV.hardware.delay_stage import MockDelayStage, TransientResponse
+from pymodaq_plugins_MockXUV.hardware.hdf5_stream import HDF5StreamWriter
+from pymodaq_plugins_MockXUV.hardware.hhg_spectrum import HHG_Spectrum, shift_spectra
+from pymodaq_plugins_MockXUV.hardware.replay import ReplaySimulator
+from pymodaq_plugins_MockXUV.hardware.sensor_model import SensorModel
+from pymodaq_plugins_MockXUV.hardware.shm_simulator import SharedMemorySimulator
+from pymodaq_plugins_MockXUV.hardware.simulator_farm import SimulatorFarm
+
+
+def test_frame_pool_recycles_released_buffers():
+    pool = FramePool((4, 3), n_buffers=2)
+    first = pool.acquire()
+    second = pool.acquire()
+    assert pool.n_free == 0
+    pool.release(first[0::2])  # releasing a view gives back its buffer
+    assert pool.acquire() is first
+    assert pool.n_allocations == 2
+    third = pool.acquire()  # exhausted: grows instead of handing out a busy buffer
+    assert third is not first and third is not second
+    assert pool.n_allocations == 3
+
+
+def test_grab_xuv_interleaves_pon_poff():
+    controller = Mock_SingleShot()
+    data = controller.grab_XUV(5)
+    assert data.shape == (10, controller.pon.size)
+    first, second = (controller.pon, controller.poff) if controller.FirstShotIsPumpOn else \
+        (controller.poff, controller.pon)
+    assert np.all(data[0::2] == first)
+    assert np.all(data[1::2] == second)
+
+
+def test_grab_xuv_steady_state_does_not_allocate():
+    controller = Mock_SingleShot(n_buffers=2)
+    for _ in range(10):
+        data = controller.grab_XUV(5)
+        controller.release(data)
+    assert controller._pools['xuv'].n_allocations == 2
+
+
+def test_grab_stab_follows_pump_state():
+    controller = Mock_SingleShot()
+    controller.grab_XUV(3)
+    stab = controller.grab_stab(3)
+    assert stab.shape == (6, 1024)
+    assert stab[0, 0] == (1. if controller.FirstShotIsPumpOn else 0.)
+    assert stab[1, 0] == (0. if controller.FirstShotIsPumpOn else 1.)
+
+
+def test_chunk_producer_drops_when_consumer_lags():
+    dropped = []
+    counter = iter(range(10**6))
+    producer = ChunkProducer(lambda: next(counter), period=0.001, depth=2, on_drop=dropped.append)
+    producer.start()
+    time.sleep(0.05)
+    assert producer.get(timeout=1) == 0
+    assert producer.n_dropped > 0
+    producer.stop()
+    assert not producer.is_running
+    assert producer.queue_fill == 0
+    assert len(dropped) == producer.n_dropped + 1  # the chunk left in the queue is handed back on stop
+
+
+def test_noise_is_reproducible_per_detector():
+    a = NoiseGenerator(seed=12, name='cam0').uniform(np.empty(100))
+    b = NoiseGenerator(seed=12, name='cam0').uniform(np.empty(100))
+    c = NoiseGenerator(seed=12, name='cam1').uniform(np.empty(100))
+    assert np.array_equal(a, b)
+    assert not np.array_equal(a, c)
+
+
+@pytest.mark.parametrize('dtype', (np.float32, np.float64))
+def test_noise_is_added_in_place_in_data_dtype(dtype):
+    noise = NoiseGenerator(seed=0)
+    data = np.full((200, 50), 1000., dtype=dtype)
+    noise.add_gaussian(data, 2.)
+    assert data.dtype == dtype
+    assert abs(data.std() - 2.) < 0.1
+    noise.add_shot_noise(data)
+    assert abs(data.var() - 1004.) < 50
+
+
+def test_drift_is_continuous_across_calls():
+    noise = NoiseGenerator(seed=0)
+    noise.drift_block = 64
+    first = noise.drift(np.empty(100), amplitude=0.5)
+    noise.reseed(0)
+    both = noise.drift(np.empty(150), amplitude=0.5)
+    assert np.allclose(first, both[:100])
+
+
+def test_asset_cache_shares_read_only_arrays(tmp_path):
+    np.save(tmp_path / 'a.npy', np.arange(10.))
+    with h5py.File(tmp_path / 'b.h5', 'w') as f:
+        f.create_dataset('contiguous', data=np.arange(5.))
+        f.create_dataset('chunked', data=np.arange(6.), chunks=(2,), compression='gzip')
+
+    cache = AssetCache(max_entries=2)
+    first = cache.get(tmp_path / 'a.npy')
+    assert cache.get(tmp_path / 'a.npy') is first
+    assert not first.flags.writeable
+    assert np.array_equal(cache.get(tmp_path / 'b.h5', 'contiguous'), np.arange(5.))
+    assert np.array_equal(cache.get(tmp_path / 'b.h5', 'chunked'), np.arange(6.))
+    assert cache.info()['hits'] == 1 and cache.info()['misses'] == 3
+    assert len(cache) == 2  # least recently used entry evicted
+
+    np.save(tmp_path / 'a.npy', np.zeros(3))
+    os.utime(tmp_path / 'a.npy', ns=(0, 10**9))
+    assert np.array_equal(cache.get(tmp_path / 'a.npy'), np.zeros(3))
+
+
+def test_controllers_share_their_data():
+    assert HHG_Spectrum().data is HHG_Spectrum().data
+    assert Mock_SingleShot().pon.base is Mock_SingleShot().pon.base
+
+
+def test_batched_shift_matches_interp():
+    rng = np.random.default_rng(3)
+    spectra = rng.random((6, 40))
+    shifts = rng.normal(0, 5, 6)
+    x = np.arange(40)
+    expected = np.array([np.interp(x, x + shift, spectrum) for shift, spectrum in zip(shifts, spectra)])
+    assert np.allclose(shift_spectra(spectra, shifts), expected)
+
+
+def test_grab_spectra_without_noise_is_the_reference():
+    controller = HHG_Spectrum()
+    spectra = controller.grab_spectra(4, NoiseGenerator(seed=0))
+    assert spectra.shape == (4, controller.data.size)
+    assert np.allclose(spectra, controller.data)
+
+
+def test_spectrum_roi_and_binning():
+    controller = HHG_Spectrum()
+    assert np.allclose(controller.grab_spectra(1, NoiseGenerator(seed=0))[0], controller.data)
+
+    controller.set_roi(left=100, width=301, bottom=0, height=controller.sensor_height, binning=2)
+    assert controller.roi['width'] == 300
+    spectra = controller.grab_spectra(3, NoiseGenerator(seed=0))
+    assert spectra.shape == (3, 150)
+    assert np.allclose(spectra[0], controller.data[100:400].reshape((-1, 2)).sum(axis=1))
+    assert np.allclose(controller.pixels[:2], [100.5, 102.5])
+
+    center = controller.find_vertical_center()
+    assert center == pytest.approx(controller.beam_center, abs=0.1)
+    noisy = HHG_Spectrum().find_vertical_center(NoiseGenerator(seed=0), amp_noise=2000.)
+    assert noisy != center and noisy == pytest.approx(controller.beam_center, abs=1)
+    controller.set_roi(left=0, width=2048, bottom=int(center) - 1, height=3)
+    assert 0 < controller.roi_data.sum() < controller.data.sum()
+    controller.clear_roi()
+    assert controller.roi_data is controller.data
+
+
+def test_shared_memory_simulator_serves_views_of_its_rings():
+    simulator = SharedMemorySimulator(nframes=5, n_slots=2)
+    try:
+        for _ in range(3):  # more grabs than slots: slots must come back with release
+            chunk = simulator.grab_XUV(5)
+            assert chunk.shape == (10, simulator.pon.size)
+            first, second = (simulator.pon, simulator.poff) if simulator.FirstShotIsPumpOn \
+                else (simulator.poff, simulator.pon)
+            np.testing.assert_array_equal(chunk[0::2], np.broadcast_to(first, chunk[0::2].shape))
+            np.testing.assert_array_equal(chunk[1::2], np.broadcast_to(second, chunk[1::2].shape))
+            simulator.release(chunk)
+        stab = simulator.grab_stab(5)
+        assert stab.shape == (10, simulator.stabpon.shape[0])
+        simulator.release(stab)
+        with pytest.raises(ValueError, match='chunk size of the MockCMOS'):
+            simulator.grab_stab(3)  # would make the XUV grabs drop the chunks of the other size
+
+        simulator.configure(amp_noise=10.)
+        chunk = simulator.grab_XUV(5)
+        while np.all(chunk[::2] == chunk[0]):  # chunks produced before the update
+            simulator.release(chunk)
+            chunk = simulator.grab_XUV(5)
+        simulator.release(chunk)
+    finally:
+        simulator.close()
+    assert not simulator.is_running
+
+
+def test_simulator_farm_serves_independent_cameras():
+    farm = SimulatorFarm(n_workers=2)
+    try:
+        small = farm.add_camera(nframes=5, n_pixels=128, seed=1, amp_noise=10.)
+        large = farm.add_camera(nframes=10, n_pixels=256, seed=2, amp_noise=10., period=0.01)
+        assert small._worker is not large._worker
+        for _ in range(3):
+            for camera, shape in ((small, (10, 128)), (large, (20, 256))):
+                chunk = camera.grab_XUV(shape[0] // 2)
+                assert chunk.shape == shape
+                noise = chunk[0::2] - (camera.pon if camera.FirstShotIsPumpOn else camera.poff)
+                assert 0 <= noise.min() and noise.max() < 10
+                camera.release(chunk)
+                stab = camera.grab_stab(shape[0] // 2)  # following the pump states of the XUV chunk
+                np.testing.assert_array_equal(stab[0::2, 0], float(camera.FirstShotIsPumpOn))
+                camera.release(stab)
+
+        with pytest.raises(ValueError, match='chunk size of the MockCMOS'):
+            small.grab_stab(10)
+
+        stats = farm.stats()
+        assert stats['camera0']['chunks'] == stats['camera1']['chunks'] == 3
+        assert stats['camera1']['max_fps'] > 0
+        small.close()
+        assert list(farm.cameras) == ['camera1']
+    finally:
+        farm.close()
+
+
+def test_sensor_model_reads_out_uint16_counts():
+    sensor = SensorModel((64,), electrons_per_count=1., gain=2., read_noise=0., offset=100., offset_spread=0.,
+                         prnu=0., hot_fraction=0.05, full_well=1000.)
+    assert len(sensor.hot_pixels[1]) == 3
+    noise = NoiseGenerator(seed=0)
+    signal = np.full((2000, 64), 400.)
+    signal[:, -1] = 5000.  # saturating pixel
+    counts = sensor.apply(signal, np.empty(signal.shape, np.uint16), noise)
+
+    assert counts.dtype == np.uint16
+    cold = np.setdiff1d(np.arange(63), sensor.hot_pixels[1])
+    # 400 electrons: shot noise of 20 e- rms, 2 ADU per electron
+    assert counts[:, cold].mean() == pytest.approx(100 + 2 * 400, rel=1e-3)
+    assert counts[:, cold].std() == pytest.approx(2 * 20, rel=0.05)
+    assert np.all(counts[:, -1] == 100 + 2 * 1000)
+    assert np.all(counts[:, sensor.hot_pixels[1]].mean(axis=0) > counts[:, cold].mean())
+
+
+def test_readout_recycles_the_light_chunk():
+    simulator = Mock_SingleShot(dtype=np.float32)
+    simulator.sensor = SensorModel(simulator.pon.shape)
+    noise = NoiseGenerator(seed=0)
+    for _ in range(10):
+        counts = simulator.readout(simulator.grab_XUV(10), noise)
+        assert counts.dtype == np.uint16 and counts.shape == (20, simulator.pon.size)
+        simulator.release(counts)
+    assert simulator._pools['xuv'].n_allocations == simulator._pools['adc'].n_allocations == simulator.n_buffers
+
+
+def test_transient_response_interpolates_and_caches():
+    simulator = Mock_SingleShot()
+    response = TransientResponse(simulator.pon, simulator.poff, delays=np.linspace(-1, 4, 11), irf=0.05)
+    np.testing.assert_allclose(response.pon_at(-1.), simulator.poff, rtol=1e-12)  # before time zero
+    np.testing.assert_array_equal(response.pon_at(0.5), response.pon_table[3])  # on a node
+    np.testing.assert_allclose(response.pon_at(0.6), 0.8 * response.pon_table[3] + 0.2 * response.pon_table[4])
+    assert response.pon_at(0.6) is response.pon_at(0.6)
+    assert (response.hits, response.misses) == (2, 1)
+    assert not response.pon_at(0.6).flags.writeable
+    np.testing.assert_array_equal(response.pon_at(100.), response.pon_table[-1])
+
+
+def test_simulator_follows_the_delay_stage():
+    simulator = Mock_SingleShot()
+    simulator.delay_stage = stage = MockDelayStage()
+    stage.move_at(-2.)
+    np.testing.assert_allclose(simulator.pump_on(), simulator.poff)
+    stage.move_at(0.3)
+    early = simulator.pump_on() / simulator.poff - 1
+    stage.move_at(10.)
+    late = simulator.pump_on() / simulator.poff - 1
+    assert np.abs(late).max() < np.abs(early).max()
+    stage.set_response(tau_decay=50.)
+    assert np.abs(simulator.pump_on() / simulator.poff - 1).max() > np.abs(late).max()
+
+
+def write_recording(path, n_chunks=5, nframes=4, n_pixels=16):
+    """Shots numbered by their pixels value, in chunks starting with a pump-on or a pump-off shot, as streamed"""
+    shots = np.arange(2 * n_chunks * nframes, dtype=np.uint16)[:, None] * np.ones(n_pixels, np.uint16)
+    pump_on = np.zeros(shots.shape[0], dtype=bool)
+    for chunk in range(n_chunks):
+        pump_on[2 * chunk * nframes + chunk % 2:2 * (chunk + 1) * nframes:2] = True
+    with h5py.File(path, 'w') as f:
+        f.create_dataset('raw', data=shots, chunks=(4, n_pixels))
+        f.create_dataset('pump_on', data=pump_on)
+    return shots, pump_on
+
+
+def test_replay_reads_ahead_loops_and_seeks(tmp_path):
+    shots, pump_on = write_recording(tmp_path / 'recording.h5')
+    replay = ReplaySimulator(tmp_path / 'recording.h5', block_bytes=6 * shots[:1].nbytes, prefetch=2)
+    try:
+        assert replay.block_shots == 4 and replay.n_shots == 40
+        np.testing.assert_array_equal(replay.pon, shots[:4][pump_on[:4]].mean(axis=0))  # of the first block
+        replayed = []
+        for _ in range(6):  # 60 shots: the recording and half of it again
+            chunk = replay.grab_XUV(5)
+            pon = chunk[0::2] if replay.FirstShotIsPumpOn else chunk[1::2]
+            assert np.all(pump_on[pon[:, 0].astype(int)])  # pairs reordered to a single pump state order
+            replayed.append(np.sort(chunk[:, 0]))
+            replay.release(chunk)
+        np.testing.assert_array_equal(np.concatenate(replayed), np.concatenate(
+            [np.sort(shots[start:start + 10, 0]) for start in (0, 10, 20, 30, 0, 10)]))
+        assert replay.n_loops == 1 and replay.position == 20
+        assert replay._pools['xuv'].n_allocations == replay.n_buffers
+
+        replay.seek(33)
+        assert replay.position == 32
+        replay.loop = False
+        np.testing.assert_array_equal(np.sort(replay.grab_XUV(4)[:, 0]), np.arange(32, 40))
+        with pytest.raises(EOFError):
+            replay.grab_XUV(1)
+        replay.seek(0)
+        replay.grab_XUV(2)
+        stab = replay.grab_stab(2)  # the pump states of the last chunk, without taking shots from the replay
+        np.testing.assert_array_equal(stab[0::2, 0] == 1, replay.FirstShotIsPumpOn)
+        np.testing.assert_array_equal(stab[1::2, 0] == 1, not replay.FirstShotIsPumpOn)
+        assert replay.position == 4
+    finally:
+        replay.close()
+
+
+def test_replay_memory_maps_npy_recordings(tmp_path):
+    shots = np.random.default_rng(0).random((30, 8))
+    np.save(tmp_path / 'recording.npy', shots)
+    replay = ReplaySimulator(tmp_path / 'recording.npy', first_is_on=False)
+    try:
+        assert replay.n_shots == 30 and not replay.FirstShotIsPumpOn
+        np.testing.assert_array_equal(replay.poff, shots[0::2].mean(axis=0))
+        np.testing.assert_array_equal(replay.grab_XUV(15), shots)
+        np.testing.assert_array_equal(replay.grab_XUV(1), shots[:2])
+    finally:
+        replay.close()
+
+
+@pytest.mark.parametrize('compression', ['none', 'lzf', 'gzip'])
+def test_stream_writer_appends_to_one_dataset_per_channel(tmp_path, compression):
+    path = tmp_path / 'stream.h5'
+    writer = HDF5StreamWriter(path, compression=compression, chunk_bytes=4096, attributes=dict(chunk_size=10))
+    writer.start()
+    chunks = [np.full((10, 64), ind, dtype=np.float32) for ind in range(5)]
+    for chunk in chunks:
+        writer.append('raw', chunk)
+        writer.append('pump_on', np.arange(10) % 2 == 0)
+        chunk[:] = -1  # the writer works on a copy
+    writer.close()
+    assert writer.n_rows == dict(raw=50, pump_on=50)
+
+    with h5py.File(path, 'r') as f:
+        assert set(f.keys()) == {'raw', 'pump_on'}
+        assert f.attrs['chunk_size'] == 10
+        raw = f['raw']
+        assert raw.maxshape == (None, 64) and raw.chunks == (16, 64)
+        assert raw.compression == (None if compression == 'none' else compression)
+        np.testing.assert_array_equal(raw[:, 0], np.repeat(np.arange(5), 10))
+        assert f['pump_on'].dtype == bool
+
+
+def test_stream_writer_fills_the_rows_skipped_by_a_channel(tmp_path):
+    writer = HDF5StreamWriter(tmp_path / 'stream.h5')
+    writer.start()
+    writer.append('dR', np.ones((2, 4)), start=0)
+    writer.append('dR', np.ones((2, 4)), start=5)
+    writer.append('flags', np.ones(3, dtype=bool), start=1)
+    with pytest.raises(ValueError):
+        writer.append('dR', np.ones((2, 4)), start=3)
+    writer.close()
+    assert writer.n_rows == dict(dR=7, flags=4)
+    with h5py.File(tmp_path / 'stream.h5', 'r') as f:
+        dR = f['dR'][()]
+        assert not f['flags'][0] and np.all(f['flags'][1:])
+    assert np.all(np.isnan(dR[2:5])) and np.all(dR[:2] == 1) and np.all(dR[5:] == 1)
+
+
+def test_stream_writer_reports_write_errors(tmp_path):
+    writer = HDF5StreamWriter(tmp_path / 'stream.h5')
+    writer.start()
+    writer.append('raw', np.zeros((2, 8)))
+    writer.append('raw', np.zeros((2, 4)))  # rows of another shape
+    with pytest.raises(RuntimeError):
+        writer.flush()
+    writer.close()
+    with pytest.raises(ValueError):
+        HDF5StreamWriter(tmp_path / 'other.h5', compression='zstd')
@@ -0,0 +1,62 @@
+import time
+
+import numpy as np
+import pytest
+
+from pymodaq_data.data import DataCalculated
+
+from pymodaq_gui.parameter import Parameter
+
+from pymodaq_plugins_MockXUV.instrumentation import FPSMeter, StageTimer, stage_params
+
+
+def test_fps_meter_rates():
+    meter = FPSMeter(window=10.)
+    for _ in range(5):
+        meter.add_generation(100, 0.001)
+        meter.add_delivery(100)
+        time.sleep(0.01)
+    assert meter.max_fps == pytest.approx(1e5)
+    assert 0 < meter.fps < 100 / 0.01
+    meter.reset()
+    assert meter.fps == 0. and meter.max_fps == 0.
+
+
+def test_stage_timer_statistics():
+    timer = StageTimer(stages=('given', 'sleep', 'skipped'))
+    with timer.stage('sleep'):
+        time.sleep(0.001)
+    assert timer.stats() == {}  # disabled: nothing measured
+    timer.enabled = True
+    for duration in (0.001, 0.002, 0.003):
+        with timer.stage('sleep'):
+            time.sleep(duration)
+        timer.add('given', duration)
+    stats = timer.stats()
+    assert list(stats) == ['given', 'sleep']  # declared order, the stages never run left out
+    assert stats['given']['min'] == 0.001 and stats['given']['mean'] == pytest.approx(0.002)
+    assert stats['given']['p99'] == pytest.approx(0.003, rel=0.01) and stats['given']['count'] == 3
+    assert 0.001 <= stats['sleep']['min'] <= stats['sleep']['mean'] <= stats['sleep']['p99']
+    assert timer.report().splitlines()[0].startswith('given: min 1.000, mean 2.000')
+
+    data = timer.to_data(DataCalculated)  # the declared stages, not measured until published
+    assert [dwa.name for dwa in data] == ['Timing given', 'Timing sleep', 'Timing skipped']
+    assert all(np.isnan(dwa[0][0]) for dwa in data)
+    group = Parameter.create(name='timing', type='group', children=stage_params())
+    timer.publish(group, force=True)
+    assert group['stages'] == timer.report()
+    data = timer.to_data(DataCalculated)
+    assert [dwa.name for dwa in data] == ['Timing given', 'Timing sleep', 'Timing skipped']
+    assert data[0].dim.name == 'Data0D' and data[0][2][0] == pytest.approx(3., rel=0.01)
+    assert np.isnan(data[2][1][0])  # never run, but still exported
+
+
+def test_stage_timer_nested_runs_of_a_stage():
+    timer = StageTimer(enabled=True)
+    with timer.stage('run'):
+        time.sleep(0.002)
+        with timer.stage('run'):
+            time.sleep(0.001)
+    stats = timer.stats()['run']
+    assert stats['count'] == 2
+    assert 0.001 <= stats['min'] < 0.003 <= stats['p99']  # the outer run is timed from its own start
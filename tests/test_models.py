@@ -0,0 +1,248 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from pymodaq_data.data import DataToExport, DataRaw
+from pymodaq_gui.parameter import Parameter
+
+from pymodaq_plugins_MockXUV.hardware.cmos_simulator import Mock_SingleShot
+from pymodaq_plugins_MockXUV.hardware.hhg_spectrum import shift_spectra
+from pymodaq_plugins_MockXUV.models.dR_model import DataMixerModelDeltaR, gaussian_fit
+from pymodaq_plugins_MockXUV.processing.centroid import Centroider
+from pymodaq_plugins_MockXUV.processing.harmonics import HarmonicIndexer
+from pymodaq_plugins_MockXUV.processing.preview import PreviewThrottle, bin_image
+from pymodaq_plugins_MockXUV.processing.running_stats import RunningStats
+
+
+def make_dte(image: np.ndarray, first_is_on=True) -> DataToExport:
+    onoff = np.tile([1., 0.] if first_is_on else [0., 1.], image.shape[0] // 2)
+    dwa_image = DataRaw('Image', data=[image])
+    dwa_image.origin = 'CMOS'
+    dwa_onoff = DataRaw('OnOff', data=[onoff])
+    dwa_onoff.origin = 'Stab'
+    return DataToExport('data', data=[dwa_image, dwa_onoff])
+
+
+def make_model(dte: DataToExport) -> DataMixerModelDeltaR:
+    settings = Parameter.create(name='settings', type='group', children=[
+        {'name': 'models', 'type': 'group', 'children': [
+            {'name': 'model_params', 'type': 'group', 'children': DataMixerModelDeltaR.params}]}])
+    modules_manager = SimpleNamespace(get_det_data_list=lambda: dte)
+    model = DataMixerModelDeltaR(SimpleNamespace(settings=settings,
+                                                 dashboard=SimpleNamespace(modules_manager=modules_manager)))
+    model.ini_model()
+    return model
+
+
+def test_running_stats_matches_numpy_over_chunks():
+    rng = np.random.default_rng(0)
+    shots = rng.normal(3., 2., (1000, 7))
+    stats = RunningStats()
+    for chunk in np.array_split(shots, 13):
+        stats.update(chunk)
+    assert stats.count == 1000
+    assert np.allclose(stats.mean, shots.mean(axis=0))
+    assert np.allclose(stats.variance, shots.var(axis=0, ddof=1))
+    assert np.allclose(stats.std_error, shots.std(axis=0, ddof=1) / np.sqrt(1000))
+
+
+def test_bin_image_averages_blocks_and_throttle_limits_the_rate():
+    image = np.arange(7 * 5, dtype=np.uint16).reshape(7, 5)
+    binned = bin_image(image, 3, 2)
+    assert binned.shape == (3, 3) and binned.dtype == np.float64
+    assert binned[0, 0] == image[:3, :2].mean()
+    assert binned[2, 2] == image[6:, 4:].mean()  # shorter last bins
+    np.testing.assert_array_equal(bin_image(image, 1, 1), image)
+
+    throttle = PreviewThrottle(max_rate=5.)
+    assert [throttle.due() for _ in range(3)] == [True, False, False]
+    throttle.max_rate = 0
+    assert throttle.due() and throttle.due()
+
+
+def test_centroider_matches_the_moments_of_each_frame():
+    y, x = np.mgrid[:40, :50]
+    centers = np.array([[15.3, 20.7], [24., 31.2], [19.5, 35.1]])
+    frames = np.stack([np.exp(-((y - cy) ** 2 + (x - cx) ** 2) / 2 / 3. ** 2) for cy, cx in centers])
+    centroids, widths = Centroider((40, 50)).moments(frames)
+    np.testing.assert_allclose(centroids, centers, atol=1e-4)
+    np.testing.assert_allclose(widths, 3., rtol=1e-3)
+
+    centroider = Centroider((40, 50), threshold=0.5)
+    centroider.background = 0.2
+    np.testing.assert_allclose(centroider.centroid(frames[0] + 0.2), centers[0], atol=0.05)
+    assert np.isnan(centroider.centroid(np.zeros((40, 50)))).all()
+
+
+def test_harmonic_indexer_fits_every_harmonic_of_every_shot():
+    x = np.arange(600.)
+    centres = np.array([80., 190., 310., 440.])
+    amplitudes = np.array([500., 1000., 800., 300.])
+    widths = np.array([10., 14., 18., 22.])  # dx of gauss1D
+    reference = sum(gaussian_fit(x, *parameters, 0) for parameters in zip(amplitudes, centres, widths)) + 50
+    indexer = HarmonicIndexer(reference)
+    assert indexer.n_harmonics == 4
+    assert np.all((indexer.windows[:, 0] < centres) & (centres < indexer.windows[:, 1]))
+
+    rng = np.random.default_rng(5)
+    shifts = rng.normal(0, 3., 20)
+    shots = np.stack([np.interp(x - shift, x, reference) for shift in shifts]) + rng.normal(0, 2., (20, 600))
+    fits = indexer.fit(shots)
+    assert fits.centre.shape == (20, 4)
+    np.testing.assert_allclose(fits.centre, centres + shifts[:, None], atol=0.3)
+    np.testing.assert_allclose(fits.width, np.broadcast_to(widths, (20, 4)), rtol=0.05)
+    np.testing.assert_allclose(fits.amplitude, np.broadcast_to(amplitudes, (20, 4)), rtol=0.05)
+    np.testing.assert_allclose(indexer.fit(reference).offset, 50, atol=1)
+
+
+def test_harmonic_indexer_without_harmonics_gives_empty_fits():
+    indexer = HarmonicIndexer(np.full(100, 50.))
+    assert indexer.n_harmonics == 0 and indexer.windows.shape == (0, 2)
+    assert indexer.fit(np.ones((3, 100))).centre.shape == (3, 0)
+    assert indexer.fit(np.ones(100)).amplitude.shape == (0,)
+
+
+def test_dR_model_accumulates_and_resets():
+    rng = np.random.default_rng(1)
+    image = 1 + rng.random((20, 8))
+    dte = make_dte(image)
+    model = make_model(dte)
+
+    for _ in range(3):
+        dte_processed = model.process_dte(make_dte(image))
+    assert model.stats.count == 30
+    assert model.settings['running', 'n_shots'] == 30
+
+    shots = np.tile((image[::2] - image[1::2]) / image[1::2], (3, 1))
+    running = dte_processed.get_data_from_name('dR over R running')
+    assert np.allclose(running[0], shots.mean(axis=0))
+    assert np.allclose(running[1], shots.std(axis=0, ddof=1) / np.sqrt(30))
+    assert dte_processed.get_data_from_name('Shots averaged')[0][0] == 30
+
+    model.reset_stats()
+    assert model.stats.count == 0
+    assert model.settings['running', 'n_shots'] == 0
+
+
+def test_dR_model_exports_the_timing_of_its_stages():
+    image = 1 + np.random.default_rng(2).random((20, 8))
+    model = make_model(make_dte(image))
+    model.settings.child('timing', 'stages_on').setValue(True)
+    model.update_settings(model.settings.child('timing', 'stages_on'))
+    model.settings.child('timing', 'stages_export').setValue(True)
+    dte_processed = model.process_dte(make_dte(image))
+
+    assert {'dRoverR', 'statistics', 'data'} <= set(model.stage_timer.stats())
+    assert 'dRoverR: min' in model.settings['timing', 'stages']
+    timing = dte_processed.get_data_from_name('Timing dRoverR')
+    assert timing.dim.name == 'Data0D' and timing.labels == ['min (ms)', 'mean (ms)', 'p99 (ms)']
+
+
+def test_dR_model_aligns_the_jittering_shots():
+    simulator = Mock_SingleShot()
+    rng = np.random.default_rng(2)
+    shifts = rng.normal(0, 2., 40)
+    image = np.empty((40, simulator.pon.size))
+    image[0::2] = simulator.pon
+    image[1::2] = simulator.poff
+    jittered = shift_spectra(image, shifts)
+    expected = simulator.pon / simulator.poff - 1
+
+    model = make_model(make_dte(jittered))
+    dR_blurred = model.process_dte(make_dte(jittered)).get_data_from_name('dR over R')[0]
+    model.settings.child('alignment', 'align_on').setValue(True)
+    model.update_settings(model.settings.child('alignment', 'align_on'))
+    dte_processed = model.process_dte(make_dte(jittered))
+
+    measured = dte_processed.get_data_from_name('Shot shifts')[0]
+    measured -= measured.mean() - shifts.mean()  # the reference is the average of the jittering shots
+    np.testing.assert_allclose(measured, shifts, atol=0.2)
+    dR_aligned = dte_processed.get_data_from_name('dR over R')[0]
+    inner = slice(20, -20)  # away from the edges the shifts clip
+    assert np.abs(dR_aligned - expected)[inner].max() < 0.3 * np.abs(dR_blurred - expected)[inner].max()
+    assert model.settings['alignment', 'shift_rms'] == pytest.approx(np.sqrt(np.mean(measured ** 2)), abs=0.3)
+
+
+def test_dR_model_drops_the_pairs_with_an_outlier_shot():
+    rng = np.random.default_rng(3)
+    image = 100 + 50 * np.sin(np.linspace(0, 6, 30)) + rng.normal(0, 1., (40, 30))
+    image[::2] *= 1.01  # pump on
+    clean = (image[::2] - image[1::2]) / image[1::2]
+    model = make_model(make_dte(image))
+    model.settings.child('rejection', 'reject_on').setValue(True)
+    model.process_dte(make_dte(image))
+
+    spoiled = image.copy()
+    spoiled[4] = 2.  # misfire of a pump on shot
+    spoiled[11] *= 3  # gas burst on a pump off shot
+    spoiled[17] = rng.permutation(spoiled[17])  # garbled shot, same total counts
+    dte_processed = model.process_dte(make_dte(spoiled))
+
+    assert model.rejector.rejected == 3 and model.rejector.accepted == 37
+    assert dte_processed.get_data_from_name('Shot rejection')[1][0] == 3
+    assert model.settings['rejection', 'accepted'] == 37
+    keep = np.ones(20, dtype=bool)
+    keep[[2, 5, 8]] = False
+    assert np.allclose(model.stats.mean, np.concatenate((clean, clean[keep])).mean(axis=0))
+
+
+def test_dR_model_processes_sensor_counts():
+    rng = np.random.default_rng(5)
+    spectrum = 1000 + 500 * np.sin(np.linspace(0, 6, 30))
+    counts = (spectrum + rng.normal(0, 2., (40, 30))).astype(np.uint16)
+    counts[::2, 10:20] -= 300  # pump on below pump off: differences that would wrap around in uint16
+
+    dRs = []
+    for image in (counts, counts.astype(np.float64)):
+        model = make_model(make_dte(image))  # no background: the shots are processed as given
+        for param, value in ((('alignment', 'align_on'), True), (('normalization', 'mode'), 'reference'),
+                             (('normalization', 'regions'), '0:10, 20:')):
+            model.settings.child(*param).setValue(value)
+            model.update_settings(model.settings.child(*param))
+        dRs.append(model.process_dte(make_dte(image)).get_data_from_name('dR over R')[0])
+    np.testing.assert_allclose(dRs[0], dRs[1], rtol=1e-5, atol=1e-6)
+    assert dRs[0][10:20].mean() < 0  # no wrap around
+
+
+@pytest.mark.parametrize('mode', ['reference', 'fit'])
+def test_dR_model_normalization_lowers_the_noise_floor(mode):
+    rng = np.random.default_rng(4)
+    spectrum = 1000 + 500 * np.sin(np.linspace(0, 6, 30))
+    dR = np.zeros(30)
+    dR[10:20] = 0.01  # pump sensitive band
+
+    def chunk():
+        intensities = rng.normal(1, 0.1, (40, 1))  # source fluctuations
+        image = spectrum * intensities + rng.normal(0, 1., (40, 30))
+        image[::2] *= 1 + dR
+        return image
+
+    floors = {}
+    for normalization in ('none', mode):
+        model = make_model(make_dte(chunk()))
+        model.settings.child('normalization', 'mode').setValue(normalization)
+        model.settings.child('normalization', 'regions').setValue('0:10, 20:')
+        for param in ('mode', 'regions'):
+            model.update_settings(model.settings.child('normalization', param))
+        for _ in range(10):
+            dte_processed = model.process_dte(make_dte(chunk()))
+        floors[normalization] = model.settings['normalization', 'noise_floor']
+
+    curve = dte_processed.get_data_from_name('Noise floor')
+    assert curve.axes[0].get_data().tolist() == list(range(20, 220, 20))
+    assert curve[0][-1] == floors[mode] < curve[0][0]
+    assert floors[mode] < floors['none'] / 10
+    np.testing.assert_allclose(model.stats.mean[10:20], 0.01, atol=1e-3)
+    assert model.settings['normalization', 'single_shot_noise'] == pytest.approx(floors[mode] * np.sqrt(200))
+
+
+def test_dR_model_keeps_its_regions_when_new_ones_are_invalid():
+    model = make_model(make_dte(np.ones((4, 30))))
+    regions = model.settings.child('normalization', 'regions')
+    regions.setValue('0:10, 20:')
+    model.update_settings(regions)
+    regions.setValue('0:10, twenty:')
+    model.update_settings(regions)
+    assert model.normalizer.regions == regions.value() == '0:10, 20:'
+    assert model.normalizer.weights(30).sum() == 20
@@ -0,0 +1,47 @@
+import os
+import subprocess
+import sys
+import textwrap
+from pathlib import Path
+
+import pytest
+
+from pymodaq_plugins_MockXUV.plugin_index import PluginIndex
+
+
+def test_plugin_packages_import_their_modules_on_demand():
+    script = textwrap.dedent("""
+        import sys
+        import pymodaq_plugins_MockXUV.daq_viewer_plugins.plugins_2D as plugins
+        from pymodaq_plugins_MockXUV.plugin_index import import_report
+        def loaded_plugins():
+            return [name for name in sys.modules if name.startswith(plugins.__name__ + '.')]
+
+        assert loaded_plugins() == []
+        assert 'daq_2Dviewer_MockCMOS' in dir(plugins)
+        plugins.DAQ_2DViewer_MockCMOS
+        loaded = loaded_plugins()
+        assert loaded == [plugins.__name__ + '.daq_2Dviewer_MockCMOS'], loaded
+        assert [row['module'] for row in import_report()] == loaded
+    """)
+    src = str(Path(__file__).parents[1].joinpath('src'))
+    result = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True,
+                            env=dict(os.environ, PYTHONPATH=src, QT_QPA_PLATFORM='offscreen'))
+    assert result.returncode == 0, result.stderr
+
+
+def test_plugin_index_reports_broken_modules(tmp_path):
+    package = tmp_path / 'lazy_plugins'
+    package.mkdir()
+    (package / '__init__.py').write_text('')
+    (package / 'daq_move_Broken.py').write_text('import not_an_installed_module\n\nclass DAQ_Move_Broken:\n    pass\n')
+    sys.path.insert(0, str(tmp_path))
+    try:
+        index = PluginIndex('lazy_plugins', package)
+        assert index.modules() == dict(daq_move_Broken=['DAQ_Move_Broken'])
+        with pytest.raises(AttributeError) as error:
+            index.getattr('DAQ_Move_Broken')
+        assert isinstance(error.value.__cause__, ModuleNotFoundError)
+        assert 'not_an_installed_module' in index.report['daq_move_Broken']['error']
+    finally:
+        sys.path.remove(str(tmp_path))
@@ -0,0 +1,309 @@
+from types import SimpleNamespace
+
+import h5py
+import numpy as np
+import pytest
+
+from pymodaq.control_modules.plugin_base import ControllerStatus
+from pymodaq.utils.data import DataActuator
+from pymodaq_gui.parameter import Parameter
+
+from pymodaq_plugins_MockXUV.daq_move_plugins.daq_move_MockBeamSteering import DAQ_Move_MockBeamSteering
+from pymodaq_plugins_MockXUV.daq_move_plugins.daq_move_MockDelayStage import DAQ_Move_MockDelayStage
+from pymodaq_plugins_MockXUV.daq_viewer_plugins.plugins_1D.daq_1Dviewer_XUVSpectrum import DAQ_1DViewer_XUVSpectrum
+from pymodaq_plugins_MockXUV.daq_viewer_plugins.plugins_2D.daq_2Dviewer_MockCMOS import DAQ_2DViewer_MockCMOS
+from pymodaq_plugins_MockXUV.daq_viewer_plugins.plugins_2D.daq_2Dviewer_MockStabCamera import (
+    DAQ_2DViewer_MockStabCamera)
+from pymodaq_plugins_MockXUV.models.PIDModelBeamStab import PIDModelBeamStab
+
+
+def init_plugin(klass, master=None, **settings):
+    """Initialize a plugin with the given settings (group__name for nested ones), as a slave of master if given"""
+    plugin = klass()
+    for name, value in settings.items():
+        plugin.settings.child(*name.split('__')).setValue(value)
+    if master is not None:
+        plugin.settings.child('controller', 'controller_status').setValue(ControllerStatus.SLAVE)
+    plugin.ini_detector(None if master is None else master.controller)
+    emitted = []
+    plugin.dte_signal.connect(emitted.append)
+    return plugin, emitted
+
+
+def test_cmos_hardware_averaging_streams_chunks():
+    plugin, emitted = init_plugin(DAQ_2DViewer_MockCMOS, sleep_time=0, chunk_size=20, amp_noise=12.,
+                                  noise_seed=0, gas_off=True, ponoff=True, dRoverR=True)
+    assert plugin.hardware_averaging
+    plugin.grab_data(Naverage=1)
+    single = emitted[-1].get_data_from_name('Image')[0]
+    plugin.grab_data(Naverage=100)
+    averaged = emitted[-1].get_data_from_name('Image')[0]
+
+    assert averaged.shape == single.shape
+    # gas off: each shot is a flat background, its spread along the pixels is the noise
+    assert averaged.var(axis=1).mean() == pytest.approx(single.var(axis=1).mean() / 100, rel=0.2)
+    assert emitted[-1].get_data_from_name('POnOff')[0].shape == (plugin.controller.pon.size,)
+    assert emitted[-1].get_data_from_name('dRoverR')[0].shape == (plugin.controller.pon.size,)
+    assert plugin.controller._pools['xuv'].n_allocations == plugin.controller.n_buffers
+
+
+def test_cmos_averaging_follows_the_pump_state_of_each_chunk():
+    plugin, emitted = init_plugin(DAQ_2DViewer_MockCMOS, sleep_time=0, chunk_size=20, amp_noise=0., gas_off=True,
+                                  ponoff=True, dRoverR=True)
+    plugin.grab_data(Naverage=1)
+    single = emitted[-1]
+    plugin.grab_data(Naverage=50)  # chunks starting with either pump state
+    averaged = emitted[-1]
+
+    np.testing.assert_allclose(single.get_data_from_name('dRoverR')[0], 1.)
+    np.testing.assert_allclose(averaged.get_data_from_name('dRoverR')[0], 1.)
+    for on_off in range(2):
+        np.testing.assert_allclose(averaged.get_data_from_name('POnOff')[on_off],
+                                   single.get_data_from_name('POnOff')[on_off])
+    image = averaged.get_data_from_name('Image')[0]
+    assert np.allclose(image, np.tile(image[:2], (10, 1))) and not np.allclose(image[0], image[1])  # not mixed
+    plugin.close()
+
+
+def test_emitted_chunks_outlive_the_simulator_buffers():
+    for klass, name in ((DAQ_2DViewer_MockCMOS, 'Image'), (DAQ_2DViewer_MockStabCamera, 'Camera')):
+        plugin, emitted = init_plugin(klass, sleep_time=0, chunk_size=20)
+        snapshots = []
+        for _ in range(2 * plugin.controller.n_buffers):  # every pooled buffer reused
+            plugin.grab_data(Naverage=1)
+            snapshots.append(emitted[-1].get_data_from_name(name)[0].copy())
+        for dte, snapshot in zip(emitted, snapshots):
+            np.testing.assert_array_equal(dte.get_data_from_name(name)[0], snapshot)
+        plugin.close()
+
+
+def test_cmos_streams_every_shot_to_hdf5(tmp_path):
+    path = tmp_path / 'cmos.h5'
+    plugin, emitted = init_plugin(DAQ_2DViewer_MockCMOS, sleep_time=0, chunk_size=20, dRoverR=True,
+                                  stream__stream_path=str(path), stream__compression='lzf')
+    plugin.settings.child('stream', 'stream_on').setValue(True)
+    plugin.commit_settings(plugin.settings.child('stream', 'stream_on'))
+    plugin.grab_data(Naverage=3)
+    plugin.settings.child('dRoverR').setValue(False)
+    plugin.grab_data(Naverage=1)
+    plugin.settings.child('dRoverR').setValue(True)
+    plugin.grab_data(Naverage=1)
+    plugin.close()
+
+    with h5py.File(path, 'r') as f:
+        assert f['raw'].shape == (100, plugin.controller.pon.size)
+        assert f['pump_on'].shape == (100,)
+        assert np.all(f['pump_on'][0::2] != f['pump_on'][1::2])
+        dR = f['dR_over_R'][()]
+    assert dR.shape == (50, plugin.controller.pon.size)  # a row per pair of raw, NaN while dRoverR was off
+    assert np.all(np.isnan(dR[30:40])) and np.all(np.isfinite(dR[:30])) and np.all(np.isfinite(dR[40:]))
+
+
+def test_cmos_streams_the_pump_state_of_the_produced_chunks(tmp_path):
+    path = tmp_path / 'cmos.h5'
+    plugin, emitted = init_plugin(DAQ_2DViewer_MockCMOS, sleep_time=0, chunk_size=20, amp_noise=0., gas_off=True,
+                                  dRoverR=True, producer__use_producer=True, producer__queue_depth=4,
+                                  stream__stream_path=str(path))
+    plugin.settings.child('stream', 'stream_on').setValue(True)
+    plugin.commit_settings(plugin.settings.child('stream', 'stream_on'))
+    for _ in range(10):  # the producer makes the chunks ahead of the grabs
+        plugin.grab_data(Naverage=1)
+    plugin.close()
+
+    with h5py.File(path, 'r') as f:
+        pump_on = f['pump_on'][:]
+        np.testing.assert_array_equal(f['raw'][pump_on], 2 * f['raw'][~pump_on])  # gas off: pump on is 2 x off
+        np.testing.assert_allclose(f['dR_over_R'][:], 1.)
+
+
+def replayed_rows(path, start: int, n_shots: int) -> np.ndarray:
+    """Shots start to start + n_shots of a recording as replayed: the pairs starting with another pump state than
+    the first shot swapped (see ReplaySimulator)"""
+    with h5py.File(path, 'r') as f:
+        rows, pump_on = f['raw'][start:start + n_shots], f['pump_on'][start:start + n_shots]
+    swapped = np.flatnonzero(pump_on[0::2] != pump_on[0]) * 2
+    rows[swapped], rows[swapped + 1] = rows[swapped + 1], rows[swapped].copy()
+    return rows
+
+
+def test_cmos_and_stab_camera_replay_a_stream(tmp_path):
+    path = tmp_path / 'cmos.h5'
+    recorder, recorded = init_plugin(DAQ_2DViewer_MockCMOS, sleep_time=0, chunk_size=20, noise_seed=0,
+                                     stream__stream_path=str(path))
+    recorder.settings.child('stream', 'stream_on').setValue(True)
+    recorder.commit_settings(recorder.settings.child('stream', 'stream_on'))
+    for _ in range(3):
+        recorder.grab_data(Naverage=1)
+    recorder.close()
+
+    plugin, emitted = init_plugin(DAQ_2DViewer_MockCMOS, sleep_time=0, chunk_size=20, simulator='replay',
+                                  replay__replay_path=str(path), dRoverR=True)
+    assert plugin.controller.replays and plugin.settings['replay', 'n_shots'] == 60
+    slave, slave_frames = init_plugin(DAQ_2DViewer_MockStabCamera, master=plugin, sleep_time=0, chunk_size=20)
+    for index in range(4):
+        plugin.grab_data(Naverage=1)
+        image = emitted[-1].get_data_from_name('Image')[0]
+        np.testing.assert_array_equal(image, recorded[index % 3].get_data_from_name('Image')[0])
+        slave.grab_data()  # follows the pump states of the image, without taking shots from the replay
+        stab = slave_frames[-1].get_data_from_name('Camera')[0][:, 0] > 0.5
+        assert stab[0] == plugin.controller.FirstShotIsPumpOn and np.all(stab[0::2] != stab[1::2])
+    assert plugin.settings['replay', 'position'] == 20
+    plugin.settings.child('replay', 'seek_shot').setValue(10)  # chunks across two recorded ones
+    plugin.commit_settings(plugin.settings.child('replay', 'seek_shot'))
+    for start in (10, 30):
+        plugin.grab_data(Naverage=1)
+        np.testing.assert_array_equal(emitted[-1].get_data_from_name('Image')[0], replayed_rows(path, start, 20))
+    slave.close()
+    plugin.close()
+
+    camera, frames = init_plugin(DAQ_2DViewer_MockStabCamera, sleep_time=0, chunk_size=20, amp_noise=0.,
+                                 replay__replay_path=str(path))
+    camera.grab_data()
+    with h5py.File(path, 'r') as f:
+        np.testing.assert_array_equal(frames[-1].get_data_from_name('Camera')[0][:, 0], f['pump_on'][:20])
+    camera.close()
+
+
+def test_stab_camera_takes_the_chunk_size_of_a_shared_simulator_process():
+    plugin, emitted = init_plugin(DAQ_2DViewer_MockCMOS, sleep_time=0, chunk_size=20, simulator='process')
+    slave, slave_frames = init_plugin(DAQ_2DViewer_MockStabCamera, master=plugin, sleep_time=0, chunk_size=10)
+    try:
+        assert slave.settings['chunk_size'] == 20
+        for _ in range(2):
+            plugin.grab_data(Naverage=1)
+            slave.grab_data()
+            assert slave_frames[-1].get_data_from_name('Camera').shape[0] == 20
+    finally:
+        plugin.close()
+
+
+def test_cmos_exports_the_timing_of_its_stages():
+    plugin, emitted = init_plugin(DAQ_2DViewer_MockCMOS, sleep_time=0, chunk_size=20, dRoverR=True,
+                                  timing_opts__stages_on=True, timing_opts__stages_export=True)
+    for _ in range(3):
+        plugin.grab_data(Naverage=1)
+    stats = plugin.stage_timer.stats()
+    assert {'grab', 'simulation', 'noise', 'image', 'dRoverR', 'data', 'emit'} <= set(stats)
+    assert stats['simulation']['count'] == 3
+    timing = emitted[-1].get_data_from_name('Timing dRoverR')
+    assert timing.dim.name == 'Data0D' and len(timing) == 3
+    assert emitted[-1].get_data_from_name('Timing emit') is not None  # published after the emit of a grab
+    assert 'emit: ' in plugin.settings['timing_opts', 'stages']
+    names = [[dwa.name for dwa in dte] for dte in emitted]
+    assert names[0] == names[-1] and 'Timing preview' in names[0]  # the same channels at every grab, NaN if not run
+    assert np.isnan(emitted[-1].get_data_from_name('Timing preview')[0][0])
+
+
+def test_cmos_displays_a_decimated_preview_at_a_limited_rate():
+    plugin, emitted = init_plugin(DAQ_2DViewer_MockCMOS, sleep_time=0, chunk_size=20, noise_seed=0,
+                                  preview__preview_on=True, preview__max_rate=1., preview__shot_binning=4,
+                                  preview__pixel_binning=8)
+    displayed = []
+    plugin.dte_signal_temp.connect(displayed.append)
+    for _ in range(3):
+        plugin.grab_data(Naverage=1)
+    assert len(displayed) == 1  # at most 1 Hz, in display only emits
+    previews = [dte.get_data_from_name('Preview') for dte in displayed]
+    assert all(dte.get_data_from_name('Preview') is None for dte in emitted)  # same saved data at every grab
+    assert [[dwa.name for dwa in dte] for dte in emitted] == [['Image']] * 3
+    image = emitted[0].get_data_from_name('Image')
+    assert not image.do_plot and image.do_save  # full rate data still saved and sent to the extensions
+    assert previews[0].do_plot and not previews[0].do_save
+    n_pixels = plugin.controller.pon.size
+    assert previews[0].shape == (5, -(-n_pixels // 8))
+    np.testing.assert_allclose(previews[0][0][1, 0], image[0][4:8, :8].mean())
+
+
+def test_cmos_sensor_model_gives_uint16_images():
+    plugin, emitted = init_plugin(DAQ_2DViewer_MockCMOS, sleep_time=0, chunk_size=20, noise_seed=0, dRoverR=True,
+                                  precision='float32', sensor__sensor_on=True)
+    plugin.grab_data(Naverage=1)
+    assert emitted[-1].get_data_from_name('Image')[0].dtype == np.uint16
+    plugin.grab_data(Naverage=4)
+    assert emitted[-1].get_data_from_name('Image')[0].dtype == np.float64
+    dR = emitted[-1].get_data_from_name('dRoverR')[0]
+    assert np.all(np.abs(dR) < 1)  # no wrap around of the unsigned differences
+
+
+def test_delay_scan_gives_a_transient_map():
+    stage = DAQ_Move_MockDelayStage()
+    stage.ini_stage()
+    plugin, emitted = init_plugin(DAQ_2DViewer_MockCMOS, sleep_time=0, chunk_size=20, amp_noise=0.,
+                                  twod_image=False, dRoverR=True, follow_delay=True)
+    delays = np.array([-1., 0., 0.2, 1., 5., 15.])
+    dR_map = []
+    for delay in delays:
+        stage.move_abs(DataActuator(data=delay, units='ps'))
+        assert stage.get_actuator_value().value() == pytest.approx(delay)
+        plugin.grab_data()
+        dR_map.append(np.abs(emitted[-1].get_data_from_name('dRoverR')[0]).max())
+    assert dR_map[0] == pytest.approx(0, abs=1e-12)
+    assert np.argmax(dR_map) in (2, 3)  # rises within the instrument response then decays
+    assert dR_map[-1] < dR_map[4] < max(dR_map)
+    stage.move_home()
+
+
+def test_beam_stabilization_loop_locks_the_centroid():
+    mirrors = {}
+    for axis in ('Y', 'X'):
+        mirrors[axis] = DAQ_Move_MockBeamSteering()
+        mirrors[axis].axis_name = axis
+        mirrors[axis].ini_stage()
+    camera, emitted = init_plugin(DAQ_2DViewer_MockStabCamera, sleep_time=0, chunk_size=20, noise_seed=0,
+                                  beam__beam_on=True)
+    beam = camera.beam
+    beam.drift, beam.jitter = 0., 0.1
+    beam.offset[:] = (4., -3.)  # the beam went astray
+
+    settings = Parameter.create(name='settings', type='group', children=[
+        {'name': 'models', 'type': 'group', 'children': [
+            {'name': 'model_params', 'type': 'group', 'children': PIDModelBeamStab.params}]}])
+    modules_manager = SimpleNamespace(actuators_name=PIDModelBeamStab.actuators_name,
+                                      detectors_name=PIDModelBeamStab.detectors_name)
+    model = PIDModelBeamStab(SimpleNamespace(settings=settings, modules_manager=modules_manager))
+    camera.settings.child('beam', 'beam_on').setValue(False)
+    camera.grab_data()
+    with pytest.raises(ValueError, match='enable the Beam image'):
+        model.convert_input(emitted[-1])
+    camera.settings.child('beam', 'beam_on').setValue(True)
+    for _ in range(30):  # proportional loop, the PID extension running it in PyMoDAQ
+        camera.grab_data()
+        inputs = model.convert_input(emitted[-1])
+        errors = [setpoint - data[0][0] for setpoint, data in zip(PIDModelBeamStab.setpoint_ini, inputs)]
+        outputs = model.convert_output([0.5 * error for error in errors])
+        for data in outputs:
+            mirrors[data.name[0]].current_value = mirrors[data.name[0]].get_actuator_value()  # polled by DAQ_Move
+            mirrors[data.name[0]].move_rel(DataActuator(data=data.value(), units='px'))
+
+    np.testing.assert_allclose(beam.position, PIDModelBeamStab.setpoint_ini, atol=0.2)
+    assert mirrors['Y'].get_actuator_value().value() == pytest.approx(-4., abs=0.2)
+    model.timer.publish(model.settings.child('loop'), force=True)
+    assert model.settings['loop', 'rate'] > 0 and model.settings['loop', 'shots'] == 20
+    assert 0 < model.settings['loop', 'processing'] <= model.settings['loop', 'latency']
+    beam.offset[:] = 0.
+    for mirror in mirrors.values():
+        mirror.move_home()
+
+
+def test_xuv_spectrum_streams_the_fits_of_the_harmonics():
+    plugin, emitted = init_plugin(DAQ_1DViewer_XUVSpectrum, timing_opts__chunk_size=50, timing_opts__batched=True,
+                                  timing_opts__amp_noise=200., timing_opts__shift_noise=3.,
+                                  timing_opts__noise_seed=0, harmonics__fit_on=True)
+    plugin.grab_data()
+    harmonics = emitted[-1].get_data_from_name('Harmonics')
+    n_harmonics = plugin.settings['harmonics', 'n_harmonics']
+    assert n_harmonics > 10
+    assert harmonics.labels == ['amplitude', 'centre', 'width'] and harmonics[1].shape == (50, n_harmonics)
+    centres = harmonics[1][:, 1:-1]  # the first and last harmonics are weak or cut by the sensor edge
+    jitter = centres - centres.mean(axis=0)
+    assert np.std(jitter - jitter.mean(axis=1, keepdims=True)) < 0.5  # every harmonic moves with the shot
+    assert np.std(jitter.mean(axis=1)) == pytest.approx(3., rel=0.3)
+
+
+def test_xuv_spectrum_centres_its_roi_on_the_beam():
+    plugin, emitted = init_plugin(DAQ_1DViewer_XUVSpectrum, roi__auto_vert=True, roi__height=20, roi__left=100,
+                                  roi__width=1000, timing_opts__noise_seed=0)
+    plugin.update_roi()
+    roi = plugin.controller.roi
+    assert roi['binning'] == 1 and roi['width'] == 1000
+    assert roi['bottom'] + roi['height'] / 2 == pytest.approx(plugin.controller.beam_center, abs=1)
@@ -0,0 +1,36 @@
+import numpy as np
+
+from pymodaq_plugins_MockXUV.hardware.cmos_simulator import Mock_SingleShot
+from pymodaq_plugins_MockXUV.hardware.delay_stage import MockDelayStage
+from pymodaq_plugins_MockXUV.scanners.continuous_sweep import ContinuousSweep, DelayBinner, pump_probe_grab
+
+
+def test_back_and_forth_binning_cancels_a_linear_drift():
+    binner = DelayBinner(np.linspace(0, 10, 11), 1)
+    delays = np.linspace(0, 10, 1000, endpoint=False)
+    signal = np.sin(delays)[:, None]
+    binner.add(delays, signal + np.linspace(0, 1, 1000)[:, None], direction=0)
+    binner.add(delays[::-1], signal[::-1] + np.linspace(1, 2, 1000)[:, None], direction=1)
+    binner.add(np.array([-1., 10.5]), np.ones((2, 1)))  # outside of the bins
+
+    assert binner.counts.tolist() == [[100] * 10, [100] * 10]
+    expected = np.array([signal[index * 100:(index + 1) * 100].mean() for index in range(10)])
+    np.testing.assert_allclose(binner.mean()[:, 0], expected + 1, atol=1e-12)
+    # forward minus backward: the drift accumulated between the two visits of each bin
+    np.testing.assert_allclose(binner.drift()[:, 0], np.linspace(-1.9, -0.1, 10), atol=1e-3)
+
+
+def test_continuous_sweep_tags_the_chunks_with_the_stage_delay():
+    simulator = Mock_SingleShot()
+    simulator.delay_stage = stage = MockDelayStage()
+    simulator.pump_on()  # builds the response table before sweeping
+    sweep = ContinuousSweep(stage, pump_probe_grab(simulator, 20), start=-1., stop=4., velocity=50.,
+                            bin_width=0.5, n_sweeps=2)
+    binner = sweep.run()
+
+    assert stage.get_value() == -1. and stage.velocity == 0.
+    assert binner.centers[0] == -0.75 and binner.centers[-1] == 3.75
+    assert (binner.counts > 0).all() and sweep.n_chunks >= 4
+    dR_over_R = np.abs(binner.mean()).max(axis=1)
+    assert dR_over_R[0] < 1e-6 < dR_over_R[3]  # nothing before time zero
+    assert dR_over_R[-1] < dR_over_R[3]  # then the decay